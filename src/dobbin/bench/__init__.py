@@ -0,0 +1,230 @@
+"""Benchmark harness.
+
+Scenarios are classes registered with the ``scenario`` decorator. For
+each scenario, the harness calls ``setup`` once, then ``prepare`` and
+``run`` a number of times (first to warm up, then to measure); each
+call to ``run`` is timed separately. The ``run`` method may return the
+number of operations it performed (the default is one). Use ``python
+-m dobbin.bench`` to run the benchmarks from the command line.
+"""
+
+import gc
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import transaction
+
+from dobbin.metrics import clock
+
+SCENARIOS = {}
+
+
+def scenario(cls):
+    """Register scenario class."""
+
+    SCENARIOS[cls.name] = cls
+    return cls
+
+
+class Scenario(object):
+    """Benchmark scenario.
+
+    The ``params`` mapping defines the parameters of the scenario and
+    their default values; they're set as attributes on the instance.
+    """
+
+    name = None
+    group = 'macro'
+    params = {}
+    warmup = 2
+    iterations = 20
+
+    def __init__(self, path, **params):
+        self.path = path
+        for key, value in params.items():
+            if key not in self.params:
+                raise TypeError(
+                    "Unknown parameter for %s: %s." % (self.name, key))
+        settings = dict(self.params)
+        settings.update(params)
+        self.settings = settings
+        self.__dict__.update(settings)
+
+    def setup(self):
+        pass
+
+    def prepare(self):
+        """Called before each run (the time is not measured)."""
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+    def extra(self):
+        """Return additional results of the scenario (a mapping)."""
+
+        return {}
+
+
+def percentile(values, p):
+    """Return the ``p`` percentile of sorted ``values`` (using linear
+    interpolation)."""
+
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def summarize(samples, operations, elapsed):
+    """Return the statistics of the ``samples`` (the duration of an
+    operation in each run); the throughput is given by the number of
+    operations performed in the ``elapsed`` time of all runs."""
+
+    samples = sorted(samples)
+    return {
+        'samples': len(samples),
+        'operations': operations,
+        'mean': sum(samples) / len(samples),
+        'min': samples[0],
+        'max': samples[-1],
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'ops_per_second': operations / elapsed if elapsed else 0.0,
+        }
+
+
+def run_scenario(cls, params=None, warmup=None, iterations=None):
+    """Run scenario and return its results.
+
+    The durations are given per operation, in seconds.
+    """
+
+    if warmup is None:
+        warmup = cls.warmup
+    if iterations is None:
+        iterations = cls.iterations
+
+    directory = tempfile.mkdtemp(prefix='dobbin-bench-')
+    path = os.path.join(directory, 'bench.db')
+    inst = cls(path, **(params or {}))
+    transaction.abort()
+    try:
+        inst.setup()
+
+        for i in range(warmup):
+            inst.prepare()
+            inst.run()
+
+        samples = []
+        operations = 0
+        total = 0.0
+        gc.collect()
+        for i in range(iterations):
+            inst.prepare()
+            started = clock()
+            count = inst.run()
+            elapsed = clock() - started
+            if count is None:
+                count = 1
+            samples.append(elapsed / count)
+            operations += count
+            total += elapsed
+
+        result = summarize(samples, operations, total)
+        result['params'] = inst.settings
+        result.update(inst.extra())
+        return result
+    finally:
+        try:
+            inst.teardown()
+        finally:
+            transaction.abort()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(names=None, group=None, params=None, warmup=None, iterations=None,
+        log=None):
+    """Run scenarios (by default, all scenarios); returns a report."""
+
+    load_scenarios()
+
+    if names is None:
+        names = sorted(
+            name for (name, cls) in SCENARIOS.items()
+            if group is None or cls.group == group)
+
+    results = {}
+    for name in names:
+        try:
+            cls = SCENARIOS[name]
+        except KeyError:
+            raise ValueError("Unknown scenario: %s." % name)
+
+        # only the parameters which the scenario defines apply
+        applicable = dict(
+            (key, value) for (key, value) in (params or {}).items()
+            if key in cls.params)
+
+        if log is not None:
+            log.write("%s ... " % name)
+            log.flush()
+
+        result = results[name] = run_scenario(
+            cls, applicable, warmup, iterations)
+
+        if log is not None:
+            log.write("%s\n" % format_duration(result['p50']))
+
+    return {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': sys.platform,
+        'results': results,
+        }
+
+
+def compare(baseline, report, tolerance=0.05, key='p50'):
+    """Compare report to a baseline report.
+
+    Returns a list of ``(name, baseline, current, ratio, regressed)``
+    tuples for the scenarios included in both reports; a scenario has
+    regressed if it's slower than the baseline by more than the
+    tolerance (a fraction).
+    """
+
+    rows = []
+    current = report['results']
+    for name, result in sorted(baseline['results'].items()):
+        if name not in current:
+            continue
+        before = result[key]
+        after = current[name][key]
+        ratio = after / before if before else 1.0
+        rows.append((name, before, after, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def format_duration(seconds):
+    if seconds >= 1:
+        return "%.2f s" % seconds
+    if seconds >= 0.001:
+        return "%.2f ms" % (seconds * 1000)
+    return "%.2f us" % (seconds * 1000000)
+
+
+def load_scenarios():
+    # importing the modules registers the scenarios
+    from dobbin.bench import memory
+    from dobbin.bench import micro
+    from dobbin.bench import scenarios
@@ -0,0 +1,109 @@
+"""Run benchmarks.
+
+Usage: python -m dobbin.bench [options] [scenario ...]
+
+The report is written as JSON (to standard output, or the file given
+with ``--output``). With ``--compare``, the results are compared to a
+saved report and the exit status is non-zero if a scenario has
+regressed.
+"""
+
+import argparse
+import json
+import sys
+
+from dobbin import bench
+
+
+def parse_param(value):
+    key, sep, value = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            "Parameter must be given as key=value.")
+    try:
+        value = int(value)
+    except ValueError:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dobbin.bench", description="Run benchmarks.")
+    parser.add_argument(
+        'scenarios', nargs='*', metavar='scenario',
+        help="scenarios to run (default: all in the group)")
+    parser.add_argument(
+        '-g', '--group', default='macro',
+        help="group of scenarios to run (default: %(default)s)")
+    parser.add_argument(
+        '-l', '--list', action='store_true', help="list scenarios")
+    parser.add_argument(
+        '-p', '--param', action='append', type=parse_param, default=[],
+        metavar='KEY=VALUE', help="set scenario parameter")
+    parser.add_argument(
+        '-n', '--iterations', type=int, help="number of measured runs")
+    parser.add_argument(
+        '-w', '--warmup', type=int, help="number of warmup runs")
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="don't print progress")
+    parser.add_argument(
+        '-o', '--output', help="write report to file")
+    parser.add_argument(
+        '-c', '--compare', metavar='BASELINE',
+        help="compare to baseline report")
+    parser.add_argument(
+        '-t', '--tolerance', type=float, default=0.05,
+        help="allowed slowdown relative to baseline "
+        "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    bench.load_scenarios()
+
+    if args.list:
+        for name, cls in sorted(bench.SCENARIOS.items()):
+            doc = ' '.join((cls.__doc__ or '').split())
+            sys.stdout.write("%-24s %-7s %s\n" % (name, cls.group, doc))
+        return 0
+
+    report = bench.run(
+        args.scenarios or None,
+        group=args.group,
+        params=dict(args.param),
+        warmup=args.warmup,
+        iterations=args.iterations,
+        log=None if args.quiet else sys.stderr,
+        )
+
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    elif not args.compare:
+        sys.stdout.write(data + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = bench.compare(baseline, report, args.tolerance)
+        regressed = False
+        for name, before, after, ratio, slower in rows:
+            regressed = regressed or slower
+            sys.stdout.write("%-24s %12s %12s %+7.1f%%%s\n" % (
+                name,
+                bench.format_duration(before),
+                bench.format_duration(after),
+                (ratio - 1) * 100,
+                "  REGRESSION" if slower else ""))
+        if regressed:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Memory benchmarks.
+
+A log of ``count`` objects (with ``size`` attributes or entries each)
+is written when the scenario is set up. The run opens the database
+and then checks out every object; the memory used per object is
+measured for each state (``shared`` and ``local``) as the growth of
+the resident set size (``rss``), the memory allocated by Python as
+traced by ``tracemalloc`` (``traced``) and the estimate given by
+``Database.memory_report`` (``estimated``), in bytes.
+
+To measure at larger scales, set the count (e.g. ``-p
+count=1000000``); note that tracing the allocations makes the run
+several times slower.
+"""
+
+import gc
+import resource
+import sys
+import tracemalloc
+
+import transaction
+
+from dobbin.bench import Scenario
+from dobbin.bench import scenario
+from dobbin.database import Database
+from dobbin.persistent import CompactPersistent
+from dobbin.persistent import Persistent
+from dobbin.persistent import PersistentDict
+from dobbin.persistent import checkout
+
+
+def rss():
+    """Return the resident set size of the process (in bytes)."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        # the peak size is the best we can do (in kilobytes on Linux,
+        # bytes on macOS)
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    return pages * resource.getpagesize()
+
+
+class CompactObject(CompactPersistent):
+    __slots__ = tuple('attr%d' % i for i in range(8))
+
+
+class MemoryScenario(Scenario):
+    group = 'memory'
+    params = {'count': 10000, 'size': 4}
+    warmup = 0
+    iterations = 1
+
+    cls = None
+
+    def setup(self):
+        database = Database(self.path)
+        root = Persistent()
+        database.elect(root)
+        transaction.commit()
+        database.bulk_load(self.make(i) for i in range(self.count))
+        database.close()
+        self.results = {}
+
+    def measure(self, database, objects, baseline):
+        gc.collect()
+        total = database.memory_report()['total']
+        return {
+            'rss': float(rss() - baseline[0]) / objects,
+            'traced': float(
+                tracemalloc.get_traced_memory()[0] - baseline[1]) / objects,
+            'estimated': float(
+                total['size'] + total['copies_size'] + total['changes_size']
+                ) / objects,
+            }
+
+    def run(self):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            baseline = rss(), tracemalloc.get_traced_memory()[0]
+            database = Database(self.path)
+            try:
+                transaction.begin()
+                objects = [
+                    obj for obj in tuple(database._oid2obj.values())
+                    if isinstance(obj, self.cls)]
+                count = len(objects)
+                self.results['shared'] = self.measure(
+                    database, count, baseline)
+
+                for obj in objects:
+                    checkout(obj)
+                self.results['local'] = self.measure(
+                    database, count, baseline)
+
+                del objects
+                transaction.abort()
+            finally:
+                database.close()
+        finally:
+            tracemalloc.stop()
+
+    def extra(self):
+        return self.results
+
+
+@scenario
+class PersistentMemory(MemoryScenario):
+    """Memory used by persistent objects with ``size`` attributes."""
+
+    name = 'memory_persistent'
+    cls = Persistent
+
+    def make(self, i):
+        obj = Persistent()
+        for j in range(self.size):
+            setattr(obj, 'attr%d' % j, i * self.size + j)
+        return obj
+
+
+@scenario
+class CompactMemory(PersistentMemory):
+    """Memory used by compact objects with ``size`` attributes (at
+    most eight)."""
+
+    name = 'memory_compact'
+    cls = CompactObject
+
+    def make(self, i):
+        obj = CompactObject()
+        for j in range(self.size):
+            setattr(obj, 'attr%d' % j, i * self.size + j)
+        return obj
+
+
+@scenario
+class PersistentDictMemory(MemoryScenario):
+    """Memory used by persistent dictionaries with ``size`` entries."""
+
+    name = 'memory_dict'
+    cls = PersistentDict
+
+    def make(self, i):
+        obj = PersistentDict()
+        for j in range(self.size):
+            obj[j] = i * self.size + j
+        return obj
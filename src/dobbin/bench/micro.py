@@ -0,0 +1,362 @@
+"""Micro-benchmarks of the functions which dominate the profiles of a
+transaction: checkout, the working copy dictionary, the synchronizer
+and the persistent references of the log.
+
+Each scenario takes three parameters: the number of attributes (or
+entries) of an object (``size``), the number of threads which run the
+operation at the same time (``threads``) and the number of objects
+which are in use (``objects``). The time is given per operation.
+
+The garbage collector is disabled while the operations are timed; it
+runs between the runs instead.
+"""
+
+import gc
+import io
+import itertools
+import threading
+
+import transaction
+
+from dobbin.bench import Scenario
+from dobbin.bench import scenario
+from dobbin.database import Database
+from dobbin.persistent import Persistent
+from dobbin.persistent import PersistentDict
+from dobbin.persistent import WorkingCopyDict
+from dobbin.persistent import checkout
+from dobbin.persistent import object_lock
+from dobbin.persistent import sync
+from dobbin.utils import make_timestamp
+
+
+class MicroScenario(Scenario):
+    """Scenario which runs an operation in one or more threads.
+
+    The ``before`` method is called in each thread before the
+    operation (``work``) is run; it's not timed. With more than one
+    thread, the threads are started once and wait for each run to
+    begin, such that only the operations are timed.
+    """
+
+    group = 'micro'
+    params = {'size': 10, 'threads': 1, 'objects': 100}
+    warmup = 10
+    iterations = 100
+
+    # number of times the cheapest operations are repeated in a run
+    repeat = 10
+
+    database = None
+    _workers = ()
+
+    def setup(self):
+        self.keys = ['attr%d' % i for i in range(self.size)]
+        self.database = Database(self.path)
+        root = Persistent()
+        self.database.elect(root)
+        root.items = self.items = [self.make() for i in range(self.objects)]
+        transaction.commit()
+
+        if self.threads > 1:
+            self._start_workers()
+
+        gc.disable()
+
+    def make(self):
+        obj = Persistent()
+        for key in self.keys:
+            setattr(obj, key, "value of %s" % key)
+        return obj
+
+    def before(self):
+        transaction.abort()
+        transaction.begin()
+
+    def work(self):
+        raise NotImplementedError
+
+    def prepare(self):
+        gc.collect()
+        if self._workers:
+            self._ready.wait()
+        else:
+            self.before()
+
+    def run(self):
+        if not self._workers:
+            return self.work()
+
+        self._start.wait()
+        self._done.wait()
+        return sum(self._counts)
+
+    def teardown(self):
+        gc.enable()
+
+        if self._workers:
+            self._stopped = True
+            try:
+                self._ready.wait()
+                self._start.wait()
+            except threading.BrokenBarrierError:
+                pass
+            for thread in self._workers:
+                thread.join()
+
+        transaction.abort()
+        if self.database is not None:
+            self.database.close()
+
+    def _start_workers(self):
+        parties = self.threads + 1
+        self._ready = threading.Barrier(parties)
+        self._start = threading.Barrier(parties)
+        self._done = threading.Barrier(parties)
+        self._stopped = False
+        self._counts = [0] * self.threads
+        self._workers = [
+            threading.Thread(target=self._worker, args=(i, ))
+            for i in range(self.threads)
+            ]
+        for thread in self._workers:
+            thread.daemon = True
+            thread.start()
+
+    def _worker(self, index):
+        try:
+            while True:
+                self.before()
+                self._ready.wait()
+                self._start.wait()
+                if self._stopped:
+                    break
+                self._counts[index] = self.work()
+                self._done.wait()
+        except threading.BrokenBarrierError:
+            pass
+        except:
+            # let the other threads (and the harness) know
+            for barrier in (self._ready, self._start, self._done):
+                barrier.abort()
+            raise
+        finally:
+            transaction.abort()
+
+
+@scenario
+class Checkout(MicroScenario):
+    """Check out shared objects."""
+
+    name = 'checkout'
+
+    def work(self):
+        for obj in self.items:
+            checkout(obj)
+        return len(self.items)
+
+
+@scenario
+class CheckoutOwn(MicroScenario):
+    """Check out objects, each in a transaction of its own; the threads
+    have their own share of the objects, such that they contend only
+    for the object locks (see ``object_lock``)."""
+
+    name = 'checkout_own'
+
+    def setup(self):
+        self._shares = itertools.count()
+        self._local = threading.local()
+        MicroScenario.setup(self)
+
+    def before(self):
+        MicroScenario.before(self)
+        local = self._local
+        if not hasattr(local, 'items'):
+            local.items = self.items[next(self._shares)::self.threads]
+
+    def work(self):
+        items = self._local.items
+        for obj in items:
+            transaction.begin()
+            checkout(obj)
+            transaction.abort()
+        return len(items)
+
+
+@scenario
+class LocalClass(MicroScenario):
+    """Create the local class of an object (see ``_p_class``)."""
+
+    name = 'p_class'
+
+    def work(self):
+        for obj in self.items:
+            obj._p_class(obj.__dict__)
+        return len(self.items)
+
+
+@scenario
+class WorkingCopyGetItem(MicroScenario):
+    """Read the attributes of checked out objects."""
+
+    name = 'working_copy_getitem'
+
+    def before(self):
+        MicroScenario.before(self)
+        for obj in self.items:
+            checkout(obj)
+
+    def work(self):
+        keys = self.keys
+        for i in range(self.repeat):
+            for obj in self.items:
+                for key in keys:
+                    getattr(obj, key)
+        return self.repeat * len(self.items) * len(keys)
+
+
+@scenario
+class WorkingCopyIter(MicroScenario):
+    """Iterate over the keys of checked out dictionaries."""
+
+    name = 'working_copy_iter'
+
+    def make(self):
+        obj = PersistentDict()
+        for key in self.keys:
+            obj[key] = "value of %s" % key
+        return obj
+
+    def before(self):
+        MicroScenario.before(self)
+        for obj in self.items:
+            checkout(obj)
+
+    def work(self):
+        for i in range(self.repeat):
+            for obj in self.items:
+                for key in obj:
+                    pass
+        return self.repeat * len(self.items) * self.size
+
+
+@scenario
+class WorkingCopySetState(MicroScenario):
+    """Update the shared state of checked out objects with the local
+    changes (as when a transaction is committed)."""
+
+    name = 'working_copy_setstate'
+
+    def before(self):
+        MicroScenario.before(self)
+        name = threading.current_thread().name
+        for obj in self.items:
+            checkout(obj)
+            obj.attr0 = name
+
+    def work(self):
+        for obj in self.items:
+            lock = object_lock(obj)
+            lock.acquire()
+            try:
+                obj.__setstate__(obj.__getstate__())
+            finally:
+                lock.release()
+        return len(self.items)
+
+
+@scenario
+class WorkingCopyApply(MicroScenario):
+    """Apply the ``size`` changesets of a working copy which have been
+    committed since a transaction began (see ``_p_apply``)."""
+
+    name = 'working_copy_apply'
+
+    def setup(self):
+        MicroScenario.setup(self)
+        self.start = make_timestamp()
+        self.copies = []
+        for obj in self.items:
+            wc = WorkingCopyDict(dict(obj.__dict__))
+            for key in self.keys:
+                wc._p_commit({key: "new value"}, make_timestamp())
+            self.copies.append(wc)
+
+    def work(self):
+        start = self.start
+        for i in range(self.repeat):
+            for wc in self.copies:
+                wc._p_apply(start, {})
+        return self.repeat * len(self.copies) * self.size
+
+
+@scenario
+class NewTransaction(MicroScenario):
+    """Begin a transaction with objects in local state (these are
+    refreshed)."""
+
+    name = 'new_transaction'
+
+    def before(self):
+        MicroScenario.before(self)
+        for obj in self.items:
+            checkout(obj)
+
+    def work(self):
+        sync.newTransaction(transaction.get())
+        return len(self.items)
+
+
+@scenario
+class AfterCompletion(MicroScenario):
+    """End a transaction with objects in local state (these are
+    checked in)."""
+
+    name = 'after_completion'
+
+    def before(self):
+        MicroScenario.before(self)
+        for obj in self.items:
+            checkout(obj)
+
+    def work(self):
+        sync.afterCompletion(transaction.get())
+        return len(self.items)
+
+
+@scenario
+class PersistentId(MicroScenario):
+    """Get the persistent identifier of an object (when an object
+    which references it is written to the log)."""
+
+    name = 'persistent_id'
+
+    def work(self):
+        persistent_id = self.database.persistent_id
+        for i in range(self.repeat):
+            for obj in self.items:
+                persistent_id(obj)
+        return self.repeat * len(self.items)
+
+
+@scenario
+class PersistentLoad(MicroScenario):
+    """Load an object from its persistent identifier (when an object
+    which references it is read from the log)."""
+
+    name = 'persistent_load'
+
+    def setup(self):
+        MicroScenario.setup(self)
+        database = self.database
+        self.tokens = [database.persistent_id(obj) for obj in self.items]
+        unpickler = database._unpickler(database, io.BytesIO(), None, [])
+        self.load = unpickler.persistent_load
+
+    def work(self):
+        load = self.load
+        for i in range(self.repeat):
+            for token in self.tokens:
+                load(token)
+        return self.repeat * len(self.tokens)
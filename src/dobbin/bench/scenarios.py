@@ -0,0 +1,429 @@
+import os
+import tempfile
+import threading
+
+import transaction
+
+from dobbin.bench import Scenario
+from dobbin.bench import scenario
+from dobbin.database import Database
+from dobbin.exc import ConflictError
+from dobbin.persistent import Persistent
+from dobbin.persistent import PersistentCounter
+from dobbin.persistent import PersistentDict
+from dobbin.persistent import PersistentFile
+from dobbin.persistent import PersistentQueue
+from dobbin.persistent import checkout
+from dobbin.persistent import read_only
+
+
+class Record(Persistent):
+    def __init__(self, value):
+        self.value = value
+
+
+class DatabaseScenario(Scenario):
+    """Scenario which opens a database with a root object."""
+
+    root_class = Persistent
+
+    def setup(self):
+        self.database = Database(self.path)
+        self.root = self.root_class()
+        self.database.elect(self.root)
+        transaction.commit()
+
+    def teardown(self):
+        self.database.close()
+
+    def extra(self):
+        return {'log_size': os.path.getsize(self.path)}
+
+
+def commit_with_retry(func, *args):
+    """Call function and commit the transaction; the transaction is
+    retried on conflicts (and if the log is locked by another
+    process). Returns the number of retries."""
+
+    retries = 0
+    while True:
+        transaction.begin()
+        try:
+            func(*args)
+            transaction.commit()
+        except (ConflictError, IOError):
+            transaction.abort()
+            retries += 1
+        else:
+            return retries
+
+
+@scenario
+class ColdStart(Scenario):
+    """Open a database; the log has ``size`` megabytes of objects
+    which have each been changed ``updates`` times."""
+
+    name = 'cold_start'
+    params = {'size': 16, 'updates': 4, 'payload': 200}
+    iterations = 5
+    warmup = 1
+
+    def setup(self):
+        database = Database(self.path)
+        root = Persistent()
+        database.elect(root)
+        transaction.commit()
+
+        # objects are written in bulk; then changed such that the log
+        # has a history
+        target = self.size * 1024 * 1024
+        payload = 'x' * self.payload
+        records = []
+        while os.path.getsize(self.path) < target / (self.updates + 1):
+            batch = [Record(payload) for i in range(1000)]
+            database.bulk_load(batch)
+            records.extend(batch)
+
+        for i in range(self.updates):
+            for j in range(0, len(records), 1000):
+                transaction.begin()
+                for obj in records[j:j + 1000]:
+                    checkout(obj)
+                    obj.value = payload
+                transaction.commit()
+
+        checkout(root)
+        root.records = records
+        transaction.commit()
+
+        self.objects = len(database)
+        database.close()
+
+    def run(self):
+        Database(self.path).close()
+
+    def extra(self):
+        return {
+            'log_size': os.path.getsize(self.path),
+            'objects': self.objects,
+            }
+
+
+@scenario
+class CommitSingle(DatabaseScenario):
+    """Change and commit a single object."""
+
+    name = 'commit_single'
+    iterations = 200
+    warmup = 10
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        self.count = 0
+
+    def run(self):
+        transaction.begin()
+        checkout(self.root)
+        self.root.value = self.count
+        self.count += 1
+        transaction.commit()
+
+
+@scenario
+class CommitMany(DatabaseScenario):
+    """Commit ``count`` new objects in a single transaction."""
+
+    name = 'commit_many'
+    params = {'count': 1000}
+
+    def run(self):
+        transaction.begin()
+        items = [Record('Bob') for i in range(self.count)]
+        checkout(self.root)
+        self.root.items = items
+        transaction.commit()
+        return self.count
+
+
+@scenario
+class DictUpdate(DatabaseScenario):
+    """Set ``count`` entries of a persistent dictionary with ``size``
+    entries and commit."""
+
+    name = 'dict_update'
+    params = {'size': 10000, 'count': 10}
+    root_class = PersistentDict
+    iterations = 100
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        checkout(self.root)
+        for i in range(self.size):
+            self.root[i] = i
+        transaction.commit()
+        self.value = 0
+
+    def run(self):
+        transaction.begin()
+        checkout(self.root)
+        for i in range(self.count):
+            self.value += 1
+            self.root[self.value % self.size] = self.value
+        transaction.commit()
+
+
+@scenario
+class ReadHeavy(DatabaseScenario):
+    """Read ``reads`` attributes of ``count`` objects in a read-only
+    transaction."""
+
+    name = 'read_heavy'
+    params = {'count': 1000, 'reads': 10000}
+    iterations = 50
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        checkout(self.root)
+        self.root.items = [Record(i) for i in range(self.count)]
+        transaction.commit()
+        transaction.begin()
+        self.items = self.root.items
+
+    def run(self):
+        items = self.items
+        count = len(items)
+        with read_only():
+            for i in range(self.reads):
+                items[i % count].value
+        return self.reads
+
+
+@scenario
+class BlobWrite(DatabaseScenario):
+    """Commit a stream of ``size`` kilobytes."""
+
+    name = 'blob_write'
+    params = {'size': 1024}
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        self.data = os.urandom(self.size * 1024)
+
+    def run(self):
+        f = tempfile.TemporaryFile()
+        f.write(self.data)
+        f.seek(0)
+        transaction.begin()
+        checkout(self.root)
+        self.root.file = PersistentFile(f)
+        transaction.commit()
+
+
+@scenario
+class BlobRead(DatabaseScenario):
+    """Read a stream of ``size`` kilobytes."""
+
+    name = 'blob_read'
+    params = {'size': 1024}
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        f = tempfile.TemporaryFile()
+        f.write(os.urandom(self.size * 1024))
+        f.seek(0)
+        checkout(self.root)
+        self.root.file = PersistentFile(f)
+        transaction.commit()
+
+    def run(self):
+        length = 0
+        for chunk in self.root.file:
+            length += len(chunk)
+        assert length == self.size * 1024
+
+
+@scenario
+class ThreadContention(DatabaseScenario):
+    """Commit ``commits`` transactions in each of ``threads`` threads;
+    each thread changes its own object."""
+
+    name = 'thread_contention'
+    params = {'threads': 4, 'commits': 25}
+    iterations = 10
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        checkout(self.root)
+        self.root.items = [Record(0) for i in range(self.threads)]
+        transaction.commit()
+        self.retries = []
+
+    def change(self, obj):
+        checkout(obj)
+        obj.value += 1
+
+    def work(self, obj):
+        for i in range(self.commits):
+            self.retries.append(commit_with_retry(self.change, obj))
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.work, args=(obj, ))
+            for obj in self.root.items
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.threads * self.commits
+
+    def extra(self):
+        return {'retries': sum(self.retries)}
+
+
+@scenario
+class ProcessContention(DatabaseScenario):
+    """Commit ``commits`` transactions in each of ``processes`` forked
+    processes (each with its own database instance)."""
+
+    name = 'process_contention'
+    params = {'processes': 4, 'commits': 25}
+    iterations = 5
+    warmup = 1
+
+    def work(self):
+        database = Database(self.path)
+        obj = database.root
+
+        def change():
+            checkout(obj)
+            obj.value = os.getpid()
+
+        for i in range(self.commits):
+            commit_with_retry(change)
+        database.close()
+
+    def run(self):
+        pids = []
+        for i in range(self.processes):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    transaction.abort()
+                    self.work()
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+
+        for pid in pids:
+            pid, status = os.waitpid(pid, 0)
+            if status:
+                raise RuntimeError("Process exited with status %d." % status)
+
+        return self.processes * self.commits
+
+
+@scenario
+class ConflictingCounters(DatabaseScenario):
+    """Increment a shared counter ``commits`` times in each of
+    ``threads`` threads; and set a shared attribute (which conflicts,
+    such that transactions are retried)."""
+
+    name = 'conflicting_counters'
+    params = {'threads': 4, 'commits': 25}
+    iterations = 10
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        checkout(self.root)
+        self.root.counter = PersistentCounter()
+        transaction.commit()
+        self.retries = []
+
+    def change(self):
+        counter = self.root.counter
+        checkout(counter)
+        counter.increment()
+        checkout(self.root)
+        self.root.value = threading.current_thread().name
+
+    def work(self):
+        for i in range(self.commits):
+            self.retries.append(commit_with_retry(self.change))
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.work)
+            for i in range(self.threads)
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.threads * self.commits
+
+    def extra(self):
+        return {'retries': sum(self.retries)}
+
+
+@scenario
+class QueueThreads(DatabaseScenario):
+    """Append ``count`` items to a shared queue in each of
+    ``producers`` threads while ``consumers`` threads remove them."""
+
+    name = 'queue_threads'
+    root_class = PersistentQueue
+    params = {'producers': 2, 'consumers': 2, 'count': 100}
+    iterations = 5
+
+    def setup(self):
+        DatabaseScenario.setup(self)
+        self.retries = []
+
+    def produce(self):
+        self.database.root
+        for i in range(self.count):
+            self.retries.append(commit_with_retry(self.root.append, i))
+
+    def consume(self, done):
+        self.database.root
+        retries = 0
+        while True:
+            # the queue is empty when the producers are done
+            last = done.is_set()
+            transaction.begin()
+            try:
+                self.root.popleft()
+                transaction.commit()
+            except IndexError:
+                transaction.abort()
+                if last:
+                    break
+            except ConflictError:
+                transaction.abort()
+                retries += 1
+        self.retries.append(retries)
+
+    def run(self):
+        done = threading.Event()
+        producers = [
+            threading.Thread(target=self.produce)
+            for i in range(self.producers)
+            ]
+        consumers = [
+            threading.Thread(target=self.consume, args=(done, ))
+            for i in range(self.consumers)
+            ]
+        for thread in producers + consumers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        done.set()
+        for thread in consumers:
+            thread.join()
+        return self.producers * self.count
+
+    def extra(self):
+        return {'retries': sum(self.retries)}
@@ -1,4 +1,5 @@
 import logging
+import gc
 import mmap
 import os
 import re
@@ -6,6 +7,13 @@ import sys
 import shutil
 import threading
 import base64
+import bisect
+import weakref
+
+from array import array
+from copy import copy
+
+from itertools import islice
 
 if sys.version_info[:3] < (3, 0, 0):
     import cPickle as pickle
@@ -21,52 +29,287 @@ else:
 
 from fcntl import flock
 from fcntl import LOCK_EX
+from fcntl import LOCK_SH
 from fcntl import LOCK_UN
 from fcntl import LOCK_NB
 
+# out-of-band buffers require pickle protocol 5
+PickleBuffer = getattr(pickle, 'PickleBuffer', None)
+
 from dobbin.exc import IntegrityError
-from dobbin.persistent import Persistent
+from dobbin.exc import InvalidObjectReference
+from dobbin.exc import ReadOnlyError
+from dobbin.history import HistoricalView
+from dobbin.persistent import Broken
+from dobbin.persistent import Local
+from dobbin.persistent import PersistentBase
+from dobbin.persistent import PersistentArray
 from dobbin.persistent import PersistentFile
+from dobbin.persistent import WorkingCopyDict
+from dobbin.persistent import bulk
+from dobbin.persistent import object_lock
+from dobbin.persistent import sync
+from dobbin.utils import make_timestamp
 from dobbin.manager import Manager
+from dobbin.metrics import clock
 
 # transaction log segment types
 LOG_VERSION = 0
 LOG_RECORD = 1
 LOG_STREAM = 2
 
+# the checkpoint is kept alongside the log
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_VERSION = 3
+
+# the end of the log up to the checkpoint offset is recorded; the
+# checkpoint is used only if the log matches
+CHECKPOINT_TAIL = 256
+
 re_id = re.compile(r'(?P<protocol>[a-z]+)://(?P<token>.+)')
 logger = logging.getLogger('dobbin.database')
 
+# open databases are reset in a forked process (see ``prefork``)
+_databases = weakref.WeakSet()
+
+
+def _after_fork():
+    for database in tuple(_databases):
+        database._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
 
 class Database(Manager):
-    """Object database which stores data in a single file."""
+    """Object database which stores data in a single file.
+
+    If ``buffer_threshold`` is set, binary attribute values (``bytes``
+    or ``bytearray``) of at least this size are written out-of-band
+    as raw segments of the log, bypassing the pickle buffer. When
+    loaded, such a value is a read-only memory view over the
+    (memory-mapped) database file. This requires pickle protocol 5.
+
+    If ``checkpoint_interval`` is set, a background thread writes a
+    checkpoint of the database at this interval (in seconds), if
+    transactions have been committed since the last (see
+    ``checkpoint``).
+
+    Metrics are recorded by the ``metrics`` sink (by default, they're
+    kept in memory; see ``stats``). If a ``tracer`` is given, slow
+    transactions are traced (see ``dobbin.tracing``).
+
+    If ``read_only`` is set, the log is opened for reading only;
+    objects can't be added or checked out (``ReadOnlyError``). This
+    is how a standby copy of the log is opened (see
+    ``dobbin.replication``).
+    """
 
+    _bulk = None
+    _checkpointer = None
     _rstream = None
     _wstream = None
     _oid = 0
 
-    def __init__(self, path):
+    # the transactions in the log (and the most recent version of
+    # each object; see ``write``) are indexed up to this offset
+    _index_end = 0
+
+    # size of the pickle buffer at which it's written to disk during a
+    # bulk load
+    bulk_buffer_size = 1 << 20
+
+    def __init__(self, path, buffer_threshold=None, checkpoint_interval=None,
+                 metrics=None, tracer=None, read_only=False):
+        if buffer_threshold is not None and PickleBuffer is None:
+            raise ValueError("Out-of-band buffers require pickle protocol 5.")
+
         self._path = path
+        self.read_only = read_only
+        self.buffer_threshold = buffer_threshold
+        self.checkpoint_interval = checkpoint_interval
 
         # open stream for reading
         self._open()
 
-        # pickle writer
+        # pickle writer; out-of-band buffers are collected while
+        # pickling and written when the pickle is complete
         self._buffer = BytesIO()
-        self._pickler = pickle.Pickler(self._buffer, pickle.HIGHEST_PROTOCOL)
-        self._offsets = {}
+        self._buffers = []
+        if buffer_threshold is None:
+            self._pickler = pickle.Pickler(
+                self._buffer, pickle.HIGHEST_PROTOCOL)
+        else:
+            self._pickler = pickle.Pickler(
+                self._buffer, pickle.HIGHEST_PROTOCOL,
+                buffer_callback=self._buffers.append)
+        self._pickler.persistent_id = self.persistent_id
+        self._index = TransactionIndex()
+        self._heads = {}
+        self._written = []
+
+        # commits are serialized within the process; the file lock
+        # only guards against other processes
+        self._commit_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
 
-        super(Database, self).__init__()
+        super(Database, self).__init__(metrics, tracer)
+
+        if checkpoint_interval is not None:
+            self._checkpointer = Checkpointer(self, checkpoint_interval)
+            self._checkpointer.start()
+
+        _databases.add(self)
 
     def __copy__(self):
-        return type(self)(self._path)
+        return type(self)(
+            self._path, self.buffer_threshold, self.checkpoint_interval,
+            read_only=self.read_only)
 
     def new_oid(self, obj):
         oid = obj._p_oid = self._oid + 1
         self._oid = oid
         return oid
 
+    def at(self, timestamp):
+        """Return a read-only view of the database as of the most
+        recent transaction committed at or before ``timestamp`` (see
+        ``dobbin.history``).
+
+        The objects of the view are loaded from the log on demand,
+        following the back-pointers of their versions (see
+        ``object_history``).
+        """
+
+        self._sync()
+        return HistoricalView(self, timestamp)
+
+    def bulk_load(self, objects, chunk_size=10000):
+        """Write new persistent objects to the database in bulk.
+
+        The objects are written in transactions of ``chunk_size``
+        objects each (new objects which they reference are written
+        along with them), bypassing the transaction machinery; when
+        written, an object is in shared state. Persistent objects
+        which are constructed while the iterable is consumed are not
+        checked out (see ``dobbin.persistent.bulk``).
+
+        Connect the objects to the object graph to make them
+        reachable. Returns the number of objects written.
+        """
+
+        iterator = iter(objects)
+        count = 0
+
+        with bulk():
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+
+                count += self._bulk_write(chunk)
+
+        return count
+
+    def checkpoint(self):
+        """Write a checkpoint of the database.
+
+        The checkpoint is an image of the shared state of all objects
+        as of the most recent transaction; it's written to a file
+        alongside the log (with the suffix ``.checkpoint``). When the
+        database is opened, only the transactions which follow the
+        checkpoint are read from the log. Returns the timestamp of the
+        checkpoint (or ``None`` if the database is empty).
+        """
+
+        # the shared state of the objects is copied while we hold the
+        # database lock; it's then written without holding it
+        self.lock_acquire()
+        try:
+            timestamp = self.tx_timestamp
+            if timestamp is None:
+                return
+
+            offset = self._index.offset(timestamp)
+            count = self.tx_count
+            oid = self._oid
+            index = copy(self._index)
+            objects = []
+            for obj in tuple(self._oid2obj.values()):
+                if obj._p_serial is None or isinstance(obj, Broken):
+                    continue
+
+                lock = object_lock(obj)
+                lock.acquire()
+                try:
+                    if isinstance(obj, Local):
+                        cls = obj._p_class
+                    else:
+                        cls = type(obj)
+                    state = obj._p_checkpoint()
+                finally:
+                    lock.release()
+
+                objects.append((
+                    obj._p_oid, cls, obj._p_serial, state,
+                    self._heads.get(obj._p_oid)))
+        finally:
+            self.lock_release()
+
+        log = self._open_mmap()
+        tail = log[max(0, offset - CHECKPOINT_TAIL):offset]
+
+        self._checkpoint_lock.acquire()
+        try:
+            path = self._path + CHECKPOINT_SUFFIX
+            temp = "%s.%d" % (path, os.getpid())
+            f = open(temp, 'wb')
+            try:
+                pickle.dump(
+                    (CHECKPOINT_VERSION, timestamp, offset, tail, count, oid,
+                     index),
+                    f, pickle.HIGHEST_PROTOCOL)
+
+                # entries are pickled to a buffer; out-of-band buffers
+                # are written (as in the log) before the entry which
+                # references them
+                stream = BytesIO()
+                buffers = []
+                if PickleBuffer is None:
+                    pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+                else:
+                    pickler = pickle.Pickler(
+                        stream, pickle.HIGHEST_PROTOCOL,
+                        buffer_callback=buffers.append)
+                pickler.persistent_id = self.persistent_id
+
+                for oid, cls, serial, state, head in objects:
+                    if PickleBuffer is not None:
+                        state = self._wrap_buffers(state)
+                    pickler.dump(
+                        (LOG_VERSION, (oid, cls, serial, state, head)))
+                    for buf in buffers:
+                        self._write_buffer(buf, 'buffer', 1, f)
+                    del buffers[:]
+
+                    f.write(stream.getvalue())
+                    stream.seek(0)
+                    stream.truncate()
+            finally:
+                f.close()
+
+            # the checkpoint is replaced atomically
+            os.rename(temp, path)
+        finally:
+            self._checkpoint_lock.release()
+
+        return timestamp
+
     def close(self):
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+            self._checkpointer = None
+
         self.lock_acquire()
         try:
             self._rstream.close()
@@ -74,106 +317,259 @@ class Database(Manager):
         finally:
             self.lock_release()
 
+    def object_history(self, obj):
+        """Iterate over the versions of a persistent object, most
+        recent first.
+
+        A version is a tuple ``(timestamp, state)`` where the state is
+        the changeset committed by the transaction (the oldest version
+        holds the initial state). Each version in the log points to
+        the previous version of the object; only the transactions
+        which changed the object are read.
+        """
+
+        oid = getattr(obj, '_p_oid', None)
+        if oid is None:
+            return
+
+        for timestamp, cls, state in self._history(self, oid):
+            yield timestamp, state
+
+    def prefork(self):
+        """Prepare the database to be used by forked processes.
+
+        The database catches up on transactions; the loaded objects
+        are then moved to a permanent generation of the garbage
+        collector (Python 3.7+) such that their memory pages are not
+        written to by collections in the forked processes and stay
+        shared. Call this method in the parent process before forking
+        the workers, while no transactions are in progress.
+
+        In the forked process, the database gets its own file handles
+        and locks (see ``os.register_at_fork``).
+        """
+
+        self._sync()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
     def read(self, jar, timestamp):
-        """Read transactions newer than ``timestamp``."""
+        """Read transactions newer than ``timestamp``.
+
+        If it's the timestamp of a transaction, the log is read from
+        the end of that transaction; otherwise, from the first
+        transaction with a later timestamp (see ``TransactionIndex``).
+        """
 
         if timestamp is None:
             offset = 0
         else:
             try:
-                offset = self._offsets[timestamp]
+                offset = self._index.offset(timestamp)
             except KeyError:
-                raise ValueError(
-                    "No offset found for timestamp: %s." % timestamp
-                    )
+                offset = self._index.after(timestamp)
 
         stream = self._open_mmap(offset)
         if stream is None:
             return
 
-        size = stream.size()
-        unpickler = pickle.Unpickler(stream)
+        size = len(stream)
 
-        def load(oid):
-            match = re_id.match(oid)
-            if match is None:
-                raise ValueError('Protocol mismatch: %s.' % oid)
+        # out-of-band buffers precede the entries which reference
+        # them (see ``write``)
+        buffers = []
 
-            protocol = match.group('protocol')
-            token = match.group('token')
-
-            if protocol == 'oid':
-                p = base64.b64decode(token.encode('ascii'))
-                oid, cls = pickle.loads(p)
-                return jar.get(oid, cls)
-
-            if protocol == 'file':
-                offset, length = map(int, token.split(':'))
-                return PersistentStream(self._opener, offset, length)
-
-            raise ValueError('Unknown protocol: %s.' % protocol)
-
-        unpickler.persistent_load = load
+        def make_unpickler():
+            return self._unpickler(jar, stream, stream, buffers)
 
+        unpickler = make_unpickler()
         entries = []
+        start = offset
         while size > offset:
-            segment_type, segment = unpickler.load()
+            try:
+                segment_type, segment = unpickler.load()
+            except (EOFError, pickle.UnpicklingError):
+                # the tail of the log may be a transaction which is
+                # being written by another process; it's read when
+                # the record has been written
+                if self._write_pending(stream):
+                    return
+                raise IntegrityError(
+                    "Incomplete entry at offset %d." % offset)
+
             offset = stream.tell()
 
             if segment_type == LOG_VERSION:
+                # versions written by earlier releases have no
+                # back-pointer (see ``write``)
+                if len(segment) < 4:
+                    segment += (False, )
                 entries.append(segment)
 
+                # new objects must be given an unused oid
+                if segment[0] > jar._oid:
+                    jar._oid = segment[0]
+
             elif segment_type == LOG_RECORD:
-                self._offsets[segment.timestamp] = offset
+                # a transaction may be read more than once (e.g. for
+                # a snapshot)
+                if start >= self._index_end:
+                    self._index.add(segment.timestamp, offset)
+                    if segment.status:
+                        heads = self._heads
+                        for entry in entries:
+                            heads[entry[0]] = start
+                    self._index_end = offset
+
                 yield segment, entries
                 del entries[:]
+                start = offset
+
+                # the pickle memory is cleared when a transaction
+                # begins (see ``tpc_begin``); an unpickler can't be
+                # reset, so we use a new one
+                unpickler = make_unpickler()
 
             elif segment_type == LOG_STREAM:
                 name, length = segment
+                if name == 'buffer':
+                    view = memoryview(stream)[offset:offset + length]
+                    buffers.append(view.toreadonly())
                 stream.seek(length, os.SEEK_CUR)
 
-        if entries:
+        if entries and not self._write_pending(stream):
             raise IntegrityError(
                 "Transaction record not found for %d entries." % len(entries))
 
-    def write(self, oid, cls, state):
-        def persistent_id(obj):
-            """This closure provides persistent identifier tokens for
-            persistent objects and files.
-            """
+    def read_checkpoint(self, jar, end=None):
+        """Read the checkpoint file (see ``checkpoint``).
+
+        The checkpoint is used only if it matches the log.
+        """
+
+        if jar is not self:
+            return
+
+        try:
+            f = open(self._path + CHECKPOINT_SUFFIX, 'rb')
+        except (IOError, OSError):
+            return
+
+        try:
+            try:
+                stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                return
+        finally:
+            f.close()
+
+        log = self._open_mmap()
+        if log is None:
+            return
+
+        # the header of earlier versions may differ
+        header = pickle.load(stream)
+        if header[0] != CHECKPOINT_VERSION:
+            return
+
+        version, timestamp, offset, tail, count, oid, index = header
+        if (end and timestamp > end) or \
+               offset > log.size() or \
+               log[offset - len(tail):offset] != tail:
+            return
+
+        buffers = []
+        unpickler = self._unpickler(jar, stream, log, buffers)
+        size = stream.size()
+        objects = []
+        while size > stream.tell():
+            segment_type, segment = unpickler.load()
+            if segment_type == LOG_VERSION:
+                # the offset of the most recent version is kept
+                # along with the state
+                objects.append(segment[:4])
+                if segment[4] is not None:
+                    self._heads[segment[0]] = segment[4]
+            elif segment_type == LOG_STREAM:
+                name, length = segment
+                pos = stream.tell()
+                view = memoryview(stream)[pos:pos + length]
+                buffers.append(view.toreadonly())
+                stream.seek(length, os.SEEK_CUR)
+
+        if oid > self._oid:
+            self._oid = oid
+
+        self._index = index
+        self._index_end = offset
+        return TransactionRecord(timestamp, True), count, objects
+
+    def persistent_id(self, obj):
+        """Return persistent identifier token for persistent objects
+        and files (see ``write``).
+        """
 
-            if isinstance(obj, Persistent):
-                if obj._p_jar is None:
+        if isinstance(obj, PersistentBase):
+            if obj._p_jar is None:
+                if self._bulk is None:
                     self.add(obj)
+                else:
+                    self._bulk_add(obj)
 
-                oid = obj._p_oid
-                if oid is None:
-                    oid = self.new_oid(obj)
+            oid = obj._p_oid
+            if oid is None:
+                oid = self.new_oid(obj)
 
-                p = pickle.dumps((oid, obj._p_class))
-                e = base64.b64encode(p).decode('ascii')
+            # the object may be referenced without being checked
+            # out (in which case ``_p_class`` is a method)
+            if isinstance(obj, Local):
+                cls = obj._p_class
+            else:
+                cls = type(obj)
 
-                return "oid://%s" % e
+            p = pickle.dumps((oid, cls))
+            e = base64.b64encode(p).decode('ascii')
 
-            if isinstance(obj, PersistentStream):
-                return "file://%d:%d" % (obj.offset, obj.length)
+            return "oid://%s" % e
 
-            if isinstance(obj, PersistentFile):
-                # write transaction log segment
-                offset, length = self._write_stream(obj)
+        if isinstance(obj, PersistentStream):
+            return "file://%d:%d" % (obj.offset, obj.length)
 
-                # switch identity to transaction stream
-                obj.__dict__.clear()
-                obj.__class__ = PersistentStream
-                obj.__init__(self._opener, offset, length)
+        if isinstance(obj, PersistentBuffer) and obj.path == self._path:
+            return "array://%s:%d:%d" % (
+                obj.typecode, obj.offset, obj.length)
 
-                return "file://%d:%d" % (offset, length)
+        if isinstance(obj, PersistentArray):
+            data = obj.data
+            offset, length = self._write_buffer(data)
 
-            if is_filelike(obj):
-                raise TypeError(
-                    "Can't persist files; use the ``PersistentFile`` wrapper.")
+            # switch identity to transaction buffer
+            typecode = obj.typecode
+            obj.__dict__.clear()
+            obj.__class__ = PersistentBuffer
+            obj.__init__(self._path, memoryview(data), offset, length)
 
-        self._pickler.persistent_id = persistent_id
+            return "array://%s:%d:%d" % (typecode, offset, length)
+
+        if isinstance(obj, PersistentFile):
+            # write transaction log segment
+            offset, length = self._write_stream(obj)
+
+            # switch identity to transaction stream
+            obj.__dict__.clear()
+            obj.__class__ = PersistentStream
+            obj.__init__(self._opener, offset, length)
+
+            return "file://%d:%d" % (offset, length)
+
+        if is_filelike(obj):
+            raise TypeError(
+                "Can't persist files; use the ``PersistentFile`` wrapper.")
+
+    def write(self, oid, cls, state):
+        if self.buffer_threshold is not None:
+            state = self._wrap_buffers(state)
 
         # pickle object state; note that the pickler instance is set
         # up to write to a buffer in memory --- the reason being that
@@ -183,7 +579,30 @@ class Database(Manager):
         # write data to disk, circumventing the pickle buffer; this is
         # used to write file streams in parallel with the pickle
         # operation); all in all: brittle machinery.
-        self._write(LOG_VERSION, (oid, cls, state))
+        #
+        # each version points to the transaction which wrote the
+        # previous version of the object (the pickle memory spans a
+        # transaction, so it's decoded from the beginning).
+        buffers = self._buffers
+        self.metrics.count('write.records')
+        trace = self._thread.trace
+        if trace is not None:
+            pos = self._buffer.tell()
+        try:
+            self._write(
+                LOG_VERSION, (oid, cls, state, self._heads.get(oid)))
+            self._written.append(oid)
+            if trace is not None:
+                trace.objects.append((
+                    oid, "%s.%s" % (cls.__module__, cls.__name__),
+                    self._buffer.tell() - pos))
+
+            # the out-of-band buffers are written directly to disk;
+            # they precede the pickle buffer in the log
+            for buf in buffers:
+                self._write_buffer(buf, 'buffer', 1)
+        finally:
+            del buffers[:]
 
     def tpc_abort(self, transaction):
         self.lock_acquire()
@@ -195,58 +614,45 @@ class Database(Manager):
                 self._write(
                     LOG_RECORD, TransactionRecord(self.tx_timestamp, False)
                     )
-                self._flush()
+                self._index_end = self._flush()
             finally:
                 # update transaction state
                 self.tx_ref = None
-
-                # release commit-lock
-                self._commitlock_release()
-
-                # close stream
-                self._wstream.close()
+                del self._written[:]
+                self._end_write()
         finally:
             self.lock_release()
 
         super(Database, self).tpc_abort(transaction)
+        self._end_trace('aborted')
 
     def tpc_begin(self, transaction):
-        self.lock_acquire()
-        try:
-            if self.tx_ref is transaction:
-                return
-
-            # open write stream
-            wstream = self._wstream = open(self._path, 'ab+')
-
-            # acquire commit lock
-            fd = wstream.fileno()
-            self._commitlock_acquire = lambda: flock(fd, LOCK_EX | LOCK_NB)
-            self._commitlock_release = lambda: flock(fd, LOCK_UN)
+        if self.tx_ref is transaction:
+            return
 
-            self.lock_release()
+        started = clock()
+        if self.tracer is not None:
+            self._thread.trace = self.tracer.begin()
 
-            try:
-                self._commitlock_acquire()
-            except IOError:
-                self.lock_acquire()
-                self.tx_ref = None
-                raise
+        try:
+            self._begin_write()
+        except IOError:
+            self.tx_ref = None
+            self._thread.trace = None
+            raise
 
-            # acquire lock and store transaction
-            self.lock_acquire()
+        # store transaction
+        self.lock_acquire()
+        try:
             self.tx_ref = transaction
-
-            # clear pickle memory; we shouldn't actually have to do
-            # this---since we're anyway reading the log from the
-            # beginning; XXX: look into this further
-            self._pickler.clear_memo()
         finally:
             self.lock_release()
 
         super(Database, self).tpc_begin(transaction)
+        self._timing('tpc_begin', clock() - started)
 
     def tpc_vote(self, transaction):
+        started = clock()
         self.lock_acquire()
         try:
             if transaction is not self.tx_ref:
@@ -255,53 +661,274 @@ class Database(Manager):
             self.lock_release()
 
         super(Database, self).tpc_vote(transaction)
+        self._timing('tpc_vote', clock() - started)
 
     def tpc_finish(self, transaction):
+        started = clock()
         self.lock_acquire()
         try:
             if transaction is not self.tx_ref:
                 return
             try:
+                # update database timestamp
+                self.tx_timestamp = self._thread.timestamp
+
                 # write transaction record
                 self._write(
                     LOG_RECORD, TransactionRecord(self.tx_timestamp, True)
                     )
-                self._flush()
+                self._set_heads(self._flush())
+
+                # the changes must be applied while we hold the commit
+                # lock; otherwise, a concurrent transaction could
+                # commit a change based on the previous state
+                super(Database, self).tpc_finish(transaction)
             finally:
                 # update transaction state
                 self.tx_ref = None
+                del self._written[:]
+                self._end_write()
+        finally:
+            self.lock_release()
+
+        self._timing('tpc_finish', clock() - started)
+        self._end_trace('committed')
+
+    def _bulk_add(self, obj):
+        # the slots of a compact object may not have been set
+        jar = getattr(obj, '_p_jar', None)
+        if jar is self:
+            raise RuntimeError("Object already added to the database.")
+        if jar is not None:
+            raise InvalidObjectReference(obj)
+
+        if getattr(obj, '_p_oid', None) is None:
+            self.new_oid(obj)
+        obj._p_jar = self
+        self._bulk.append(obj)
+
+    def _bulk_write(self, objects):
+        if self.read_only:
+            raise ReadOnlyError(objects[0])
+
+        self._begin_write()
+        try:
+            # catch up on transactions (committed by other processes)
+            self._sync()
+
+            # referenced objects are added to the list of pending
+            # objects while we write (see ``persistent_id``); the
+            # objects are written in order
+            pending = self._bulk = []
+            for obj in objects:
+                self._bulk_add(obj)
+            pending.reverse()
+
+            written = []
+            try:
+                while pending:
+                    obj = pending.pop()
+                    if isinstance(obj, Local):
+                        cls = obj._p_class
+                        state = obj.__getstate__()
+                    else:
+                        # the shared state includes the persistence
+                        # attributes
+                        cls = type(obj)
+                        state = dict(
+                            (key, value) for (key, value)
+                            in obj.__getstate__().items()
+                            if not key.startswith('_p_'))
+
+                    self.write(obj._p_oid, cls, state)
+                    written.append((obj, state))
+
+                    # the pickle buffer is written to disk along the way
+                    if self._buffer.tell() > self.bulk_buffer_size:
+                        self._drain()
+
+                timestamp = self.tx_timestamp = make_timestamp()
+                self._write(LOG_RECORD, TransactionRecord(timestamp, True))
+                self._set_heads(self._flush())
+            except:
+                del self._written[:]
+                self._write(
+                    LOG_RECORD, TransactionRecord(self.tx_timestamp, False)
+                    )
+                self._index_end = self._flush()
+
+                for obj in objects:
+                    obj._p_jar = obj._p_oid = None
+                for obj, state in written:
+                    obj._p_jar = obj._p_oid = None
+                raise
+
+            # the objects are unknown to other threads; they go
+            # straight to shared state
+            self.lock_acquire()
+            try:
+                oid2obj = self._oid2obj
+                for obj, state in written:
+                    oid2obj[obj._p_oid] = obj
+                    if isinstance(obj, Local):
+                        obj.__setstate__(state)
+                        obj._p_serial = timestamp
+                        obj._p_checkin()
+                        sync.forget(obj)
+                    else:
+                        object.__setattr__(obj, '_p_serial', timestamp)
+
+                self.tx_count += 1
+            finally:
+                self.lock_release()
+        finally:
+            self._bulk = None
+            self._end_write()
+
+        return len(written)
+
+    def _after_fork(self):
+        super(Database, self)._after_fork()
+        self._commit_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+
+        # the checkpoint thread is not running in this process
+        self._checkpointer = None
+
+        # the read stream is shared with the parent process
+        if self._rstream is not None:
+            self._rstream.close()
+            self._open()
+
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        del self._buffers[:]
+        del self._written[:]
+
+    def _begin_write(self):
+        """Acquire the commit lock and open the log for writing."""
+
+        started = clock()
+        self._commit_lock.acquire()
+        self.lock_acquire()
+        try:
+            # open write stream
+            wstream = self._wstream = open(self._path, 'ab+')
+
+            # acquire commit lock
+            fd = wstream.fileno()
+            self._commitlock_acquire = lambda: flock(fd, LOCK_EX | LOCK_NB)
+            self._commitlock_release = lambda: flock(fd, LOCK_UN)
+
+            self.lock_release()
+
+            try:
+                self._commitlock_acquire()
+            except IOError:
+                self.lock_acquire()
+                wstream.close()
+                self._commit_lock.release()
+                raise
 
-                # release commit-lock
-                self._commitlock_release()
+            self._timing('commit_lock', clock() - started)
+            self.lock_acquire()
 
-                # close stream
-                self._wstream.close()
+            # the transaction begins at the end of the log (the
+            # versions which it writes point back to it)
+            wstream.seek(0, os.SEEK_END)
+            self._tx_start = wstream.tell()
+
+            # clear pickle memory; we shouldn't actually have to do
+            # this---since we're anyway reading the log from the
+            # beginning; XXX: look into this further
+            self._pickler.clear_memo()
         finally:
             self.lock_release()
 
-        super(Database, self).tpc_finish(transaction)
+    def _end_trace(self, status):
+        trace = self._thread.trace
+        if trace is not None:
+            self._thread.trace = None
+            trace.timestamp = self._thread.timestamp
+            self.tracer.end(trace, status)
 
-    def _flush(self, offset=0):
+    def _end_write(self):
+        # release commit-lock
+        self._commitlock_release()
+        self._commit_lock.release()
+
+        # close stream
+        self._wstream.close()
+
+    def _drain(self, offset=0):
         stream = self._buffer
 
         # persist changes on disk
         stream.seek(offset)
         bytes = stream.read()
         self._wstream.write(bytes)
+        self.metrics.count('write.bytes', len(bytes))
 
         # truncate stream
         stream.seek(offset)
         stream.truncate()
 
-        # update offset mapping
+    def _flush(self, offset=0):
+        self._drain(offset)
+
+        # update transaction index
         offset = self._wstream.tell()
-        self._offsets[self.tx_timestamp] = offset
+        self.lock_acquire()
+        try:
+            self._index.add(self.tx_timestamp, offset)
+        finally:
+            self.lock_release()
 
         return offset
 
+    def _unpickler(self, jar, stream, log, buffers):
+        """Return unpickler which reads from ``stream``; arrays are
+        loaded from ``log`` and out-of-band buffers from the list
+        ``buffers``."""
+
+        def load(oid):
+            match = re_id.match(oid)
+            if match is None:
+                raise ValueError('Protocol mismatch: %s.' % oid)
+
+            protocol = match.group('protocol')
+            token = match.group('token')
+
+            if protocol == 'oid':
+                p = base64.b64decode(token.encode('ascii'))
+                oid, cls = pickle.loads(p)
+                return jar.get(oid, cls)
+
+            if protocol == 'file':
+                offset, length = map(int, token.split(':'))
+                return PersistentStream(self._opener, offset, length)
+
+            if protocol == 'array':
+                typecode, offset, length = token.split(':')
+                offset, length = int(offset), int(length)
+                view = memoryview(log)[offset:offset + length]
+                view = view.toreadonly().cast(typecode)
+                return PersistentBuffer(self._path, view, offset, length)
+
+            raise ValueError('Unknown protocol: %s.' % protocol)
+
+        if PickleBuffer is None:
+            unpickler = pickle.Unpickler(stream)
+        else:
+            unpickler = pickle.Unpickler(
+                stream, buffers=iter(lambda: buffers.pop(0), None))
+        unpickler.persistent_load = load
+        return unpickler
+
     def _open(self):
         if os.path.exists(self._path):
-            f = self._rstream = open(self._path, 'rb+')
+            mode = 'rb' if self.read_only else 'rb+'
+            f = self._rstream = open(self._path, mode)
             return f
 
     def _open_mmap(self, offset=0):
@@ -309,12 +936,156 @@ class Database(Manager):
             return
 
         try:
-            _map = mmap.mmap(self._rstream.fileno(), 0, mmap.PROT_READ)
+            _map = mmap.mmap(
+                self._rstream.fileno(), 0, access=mmap.ACCESS_READ)
             _map.seek(offset)
         except (ValueError, mmap.error):
             return
         return _map
 
+    def _write_pending(self, stream):
+        """Return true if a transaction is being written to the log
+        (or has been since it was mapped to ``stream``)."""
+
+        fd = self._rstream.fileno()
+        if os.fstat(fd).st_size > len(stream):
+            return True
+
+        try:
+            flock(fd, LOCK_SH | LOCK_NB)
+        except IOError:
+            return True
+
+        flock(fd, LOCK_UN)
+        return False
+
+    def _history(self, jar, oid):
+        """Yield the versions of an object as tuples of timestamp,
+        class and changeset, most recent first; references to other
+        objects are loaded from ``jar``."""
+
+        offset = self._heads.get(oid)
+        while offset is not None:
+            timestamp, cls, state, previous = self._read_version(
+                jar, oid, offset)
+            yield timestamp, cls, state
+
+            # the previous versions of an object written by an
+            # earlier release are found by reading the log
+            if previous is False:
+                for offset in self._scan_versions(oid, offset):
+                    yield self._read_version(jar, oid, offset)[:3]
+                break
+
+            offset = previous
+
+    def _load_version(self, jar, oid, timestamp):
+        """Return the class, serial and state of an object as of the
+        transaction at ``timestamp`` (or ``None`` if it didn't exist
+        at the time); references to other objects are loaded from
+        ``jar``.
+
+        The state is computed from the changesets of the object,
+        which are read from the log.
+        """
+
+        versions = [
+            version for version in self._history(jar, oid)
+            if version[0] <= timestamp
+            ]
+
+        if not versions:
+            return
+
+        serial, cls = versions[0][:2]
+        state = versions.pop()[2]
+        while versions:
+            state = cls._p_fold(state, versions.pop()[2])
+
+        return cls, serial, state
+
+    def _read_transaction(self, jar, offset):
+        """Return the record and entries of the transaction which
+        begins at ``offset``, and the offset at which it ends."""
+
+        stream = self._open_mmap(offset)
+        buffers = []
+        unpickler = self._unpickler(jar, stream, stream, buffers)
+        entries = []
+        while True:
+            segment_type, segment = unpickler.load()
+            if segment_type == LOG_VERSION:
+                entries.append(segment)
+            elif segment_type == LOG_RECORD:
+                return segment, entries, stream.tell()
+            elif segment_type == LOG_STREAM:
+                name, length = segment
+                if name == 'buffer':
+                    pos = stream.tell()
+                    view = memoryview(stream)[pos:pos + length]
+                    buffers.append(view.toreadonly())
+                stream.seek(length, os.SEEK_CUR)
+
+    def _read_version(self, jar, oid, offset):
+        """Return the timestamp, class and changeset of the version of
+        an object which was written by the transaction at ``offset``,
+        and the offset of the previous version (``None`` if there's
+        none, ``False`` if it's unknown)."""
+
+        record, entries, end = self._read_transaction(jar, offset)
+        cls = state = None
+        previous = False
+        for entry in entries:
+            if entry[0] != oid:
+                continue
+
+            # an object may be written more than once in a transaction
+            if cls is None:
+                state = entry[2]
+                if len(entry) > 3:
+                    previous = entry[3]
+            else:
+                state = entry[1]._p_fold(state, entry[2])
+            cls = entry[1]
+
+        if cls is None:
+            raise IntegrityError(
+                "Object %d not found in transaction at offset %d." % (
+                    oid, offset))
+
+        return record.timestamp, cls, state, previous
+
+    def _scan_versions(self, oid, end):
+        """Return the offsets of the committed transactions before
+        ``end`` which wrote a version of an object, most recent
+        first."""
+
+        jar = IndexJar()
+        offsets = []
+        offset = 0
+        while offset < end:
+            record, entries, next_offset = self._read_transaction(
+                jar, offset)
+            if record.status:
+                for entry in entries:
+                    if entry[0] == oid:
+                        offsets.append(offset)
+                        break
+            offset = next_offset
+
+        offsets.reverse()
+        return offsets
+
+    def _set_heads(self, offset):
+        # the versions written by the transaction which ends at
+        # ``offset`` are now the most recent
+        heads = self._heads
+        start = self._tx_start
+        for oid in self._written:
+            heads[oid] = start
+        del self._written[:]
+        self._index_end = offset
+
     def _opener(self):
         return open(self._path, 'rb')
 
@@ -327,6 +1098,64 @@ class Database(Manager):
             self._flush()
             raise
 
+    def _wrap_buffers(self, state):
+        # containers have a state of attributes and entries
+        if type(state) is tuple:
+            attrs, items = state
+            wrapped = self._wrap_buffers(attrs)
+            if wrapped is attrs:
+                return state
+            return wrapped, items
+
+        if isinstance(state, WorkingCopyDict):
+            d = state.__dict__
+        elif isinstance(state, dict):
+            d = state
+        else:
+            return state
+
+        threshold = self.buffer_threshold
+        wrapped = None
+        for key, value in d.items():
+            if isinstance(value, memoryview) or \
+                   threshold is not None and \
+                   isinstance(value, (bytes, bytearray)) and \
+                   len(value) >= threshold:
+                if wrapped is None:
+                    wrapped = dict(d)
+                wrapped[key] = PickleBuffer(value)
+
+        if wrapped is None:
+            return state
+        return wrapped
+
+    def _write_buffer(self, data, name='array', alignment=8, stream=None):
+        if stream is None:
+            stream = self._wstream
+
+        data = memoryview(data).cast('B')
+        length = len(data)
+
+        # the buffer is aligned on the item size (such that it can be
+        # used efficiently without copying); the padding is included
+        # in the segment length
+        pos = stream.tell()
+        for padding in range(alignment):
+            log = pickle.dumps((LOG_STREAM, (name, padding + length)))
+            if (pos + len(log) + padding) % alignment == 0:
+                break
+
+        stream.write(log)
+        stream.write(b'\0' * padding)
+        offset = stream.tell()
+        stream.write(data)
+
+        trace = self._thread.trace
+        if trace is not None:
+            trace.streams.append((name, length))
+
+        return offset, length
+
     def _write_stream(self, stream):
         pos = stream.tell()
         stream.seek(0, os.SEEK_END)
@@ -337,15 +1166,158 @@ class Database(Manager):
         offset = self._wstream.tell()
         shutil.copyfileobj(stream, self._wstream, length)
         stream.close()
+
+        trace = self._thread.trace
+        if trace is not None:
+            trace.streams.append((stream.name, length))
+
         return offset, length
 
 
+class IndexJar(object):
+    """Stand-in database used to read the log without loading
+    objects."""
+
+    def get(self, oid, cls=None):
+        return None
+
+
 class TransactionRecord(object):
     def __init__(self, timestamp, status):
         self.timestamp = timestamp
         self.status = status
 
 
+class TransactionIndex(object):
+    """Directory of the transactions in the log.
+
+    The timestamp of each transaction and the offset at which its
+    record ends are kept in two parallel arrays, ordered by timestamp
+    such that both can be looked up by bisection.
+
+    A transaction may be written after one with a later timestamp
+    (e.g. by a process whose clock is behind); such an entry is
+    inserted before the end. To find the first transaction in the log
+    after a timestamp (see ``after``), the offsets are also kept in
+    log order along with the highest timestamp up to each offset.
+    """
+
+    def __init__(self, timestamps=(), offsets=(), ends=(), highs=()):
+        self.timestamps = array('d', timestamps)
+        self.offsets = array('q', offsets)
+        self.ends = array('q', ends)
+        self.highs = array('d', highs)
+        self.end = self.ends[-1] if self.ends else 0
+
+    def __copy__(self):
+        return type(self)(
+            self.timestamps, self.offsets, self.ends, self.highs)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __reduce__(self):
+        return type(self), (
+            self.timestamps, self.offsets, self.ends, self.highs)
+
+    def add(self, timestamp, offset):
+        """Add the transaction which ends at ``offset`` (after those
+        already added).
+
+        An aborted transaction has the timestamp of the transaction
+        before it; it's added after it (and takes precedence). If
+        there's none, it's not added (the log is read from the
+        beginning until a transaction has been committed).
+        """
+
+        if timestamp is None:
+            return
+
+        timestamps = self.timestamps
+        if timestamps and timestamps[-1] > timestamp:
+            index = bisect.bisect_right(timestamps, timestamp)
+            timestamps.insert(index, timestamp)
+            self.offsets.insert(index, offset)
+        else:
+            timestamps.append(timestamp)
+            self.offsets.append(offset)
+
+        # transactions are added in the order they're written
+        highs = self.highs
+        if highs and highs[-1] > timestamp:
+            timestamp = highs[-1]
+        self.ends.append(offset)
+        highs.append(timestamp)
+        self.end = offset
+
+    def after(self, timestamp):
+        """Return the offset from which the log holds every
+        transaction with a later timestamp."""
+
+        # the log is read from the end of the last transaction which
+        # is preceded only by transactions that are not later
+        index = bisect.bisect_right(self.highs, timestamp)
+        return self.ends[index - 1] if index else 0
+
+    def offset(self, timestamp):
+        """Return the offset at which the transaction with the given
+        timestamp ends (``KeyError`` if there's none)."""
+
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if index < 0 or self.timestamps[index] != timestamp:
+            raise KeyError(timestamp)
+        return self.offsets[index]
+
+
+class Checkpointer(threading.Thread):
+    """Background thread which periodically writes a checkpoint of
+    the database (if transactions have been committed since the
+    last)."""
+
+    def __init__(self, database, interval):
+        threading.Thread.__init__(self, name="dobbin-checkpointer")
+        self.daemon = True
+        self.database = database
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        database = self.database
+        last = None
+        while not self._stopped.wait(self.interval):
+            # catch up on transactions committed by other processes
+            database._sync()
+            if database.tx_timestamp == last:
+                continue
+
+            try:
+                last = database.checkpoint()
+            except Exception:
+                logger.exception("Could not write checkpoint.")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class PersistentBuffer(PersistentArray):
+    """Array persisted in the transaction log.
+
+    The data is a read-only memory view (over the memory-mapped
+    database file, when loaded from the database).
+    """
+
+    def __init__(self, path, data, offset, length):
+        self.data = data
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    @property
+    def typecode(self):
+        return self.data.format
+
+
 class PersistentStream(object):
     """Binary stream persisted in the transaction log.
 
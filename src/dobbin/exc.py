@@ -42,3 +42,16 @@ class InvalidObjectReference(Exception):
 
     def __init__(self, obj):
         self.object = obj
+
+
+class ReadOnlyError(Exception):
+    """Attempt to check out an object in a read-only transaction (or
+    database)."""
+
+    def __init__(self, obj):
+        self.object = obj
+
+
+class StorageError(Exception):
+    """Error reported by a storage server (see ``dobbin.server``), or
+    an operation which isn't available through a client."""
@@ -0,0 +1,136 @@
+import threading
+
+from dobbin.manager import ROOT_OID
+from dobbin.persistent import Broken
+from dobbin.persistent import LocalType
+from dobbin.persistent import PersistentBase
+
+setattr = object.__setattr__
+
+
+class Ghost(PersistentBase):
+    """Historical object which hasn't yet been loaded.
+
+    The state is loaded from the log when the object is first used;
+    the object then gets its own class.
+    """
+
+    __slots__ = ()
+
+    # ghost subclasses are created once per class
+    _p_classes = {}
+
+    # special methods are looked up on the type (bypassing
+    # ``__getattribute__``); they must load the object, too
+    _p_special = (
+        '__bool__', '__contains__', '__eq__', '__float__', '__ge__',
+        '__getitem__', '__gt__', '__index__', '__int__', '__iter__',
+        '__le__', '__len__', '__lt__', '__ne__', '__nonzero__',
+        '__reversed__',
+        )
+
+    __hash__ = PersistentBase.__hash__
+
+    def __getattribute__(self, key):
+        if key in ('_p_oid', '_p_jar'):
+            return object.__getattribute__(self, key)
+        object.__getattribute__(self, '_p_jar')._p_load(self)
+        return getattr(self, key)
+
+    @classmethod
+    def _p_ghost_class(cls, obj_class):
+        try:
+            return cls._p_classes[obj_class]
+        except KeyError:
+            pass
+
+        d = {'__hash__': obj_class.__hash__}
+        for name in cls._p_special:
+            if hasattr(obj_class, name):
+                d[name] = _special(name)
+
+        ghost = cls._p_classes[obj_class] = LocalType(
+            "%s%s" % (cls.__name__, obj_class.__name__), (obj_class, cls), d)
+        return ghost
+
+
+def _special(name):
+    def method(self, *args):
+        Ghost.__getattribute__(self, '_p_jar')._p_load(self)
+        return getattr(self, name)(*args)
+    method.__name__ = name
+    return method
+
+
+class HistoricalView(object):
+    """Read-only view of a database as of a past transaction.
+
+    The objects are loaded from the log when they're first used: the
+    state of an object is computed from the changesets which were
+    committed until (and including) the transaction at
+    ``timestamp``; other objects are not read. The objects of a view
+    are distinct from those of the database; they're in shared state
+    and can't be checked out (or changed).
+    """
+
+    read_only = True
+
+    def __init__(self, database, timestamp):
+        self.database = database
+        self.timestamp = timestamp
+        self._objects = {}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '<%s timestamp="%s">' % (type(self).__name__, self.timestamp)
+
+    @property
+    def root(self):
+        return self.get(ROOT_OID)
+
+    def get(self, oid, cls=None):
+        """Return the object with the given oid (or ``None`` if it
+        didn't exist at the time)."""
+
+        self._lock.acquire()
+        try:
+            obj = self._objects.get(oid)
+            if obj is not None:
+                return obj
+
+            if cls is None:
+                version = self.database._load_version(
+                    self, oid, self.timestamp)
+                if version is None:
+                    return None
+                cls = version[0]
+
+            obj = Broken(oid, cls)
+            setattr(obj, '__class__', Ghost._p_ghost_class(cls))
+            setattr(obj, '_p_jar', self)
+            self._objects[oid] = obj
+            return obj
+        finally:
+            self._lock.release()
+
+    def save(self, obj):
+        raise TypeError("Can't change historical object.")
+
+    def _p_load(self, obj):
+        self._lock.acquire()
+        try:
+            # the object may have been loaded by another thread
+            if not isinstance(obj, Ghost):
+                return
+
+            oid = obj._p_oid
+            version = self.database._load_version(self, oid, self.timestamp)
+            if version is None:
+                raise KeyError(oid)
+
+            cls, serial, state = version
+            setattr(obj, '__class__', cls)
+            setattr(obj, '_p_serial', serial)
+            obj.__setstate__(state)
+        finally:
+            self._lock.release()
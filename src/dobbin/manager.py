@@ -5,9 +5,14 @@ from dobbin.exc import InvalidObjectReference
 from dobbin.exc import WriteConflictError
 from dobbin.exc import ReadConflictError
 from dobbin.exc import ConflictError
+from dobbin.exc import ReadOnlyError
+from dobbin.metrics import Metrics
+from dobbin.metrics import clock
 from dobbin.persistent import checkout
 from dobbin.persistent import Broken
-from dobbin.persistent import Persistent
+from dobbin.persistent import Local
+from dobbin.persistent import PersistentBase
+from dobbin.persistent import object_lock
 from dobbin.persistent import sync
 
 ROOT_OID = 0
@@ -28,6 +33,7 @@ class Manager(object):
 
     Subclasses can implement:
 
+    -read_checkpoint(jar, end)
     -tpc_begin
     -tpc_vote
     -tpc_abort
@@ -35,11 +41,19 @@ class Manager(object):
 
     """
 
+    read_only = False
     tx_ref = None
     tx_count = 0
+    resolve_hits = 0
+    resolve_misses = 0
     tx_timestamp = None
 
-    def __init__(self):
+    def __init__(self, metrics=None, tracer=None):
+        # metrics sink (see ``stats``) and transaction tracer (see
+        # ``dobbin.tracing``)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.tracer = tracer
+
         # define reentrant thread-lock
         l = threading.RLock()
         self.lock_acquire = l.acquire
@@ -66,6 +80,10 @@ class Manager(object):
     @property
     def root(self):
         if self._thread.timestamp is None:
+            # the synchronizer registers itself when it's first used
+            # in a thread; the transaction must have its timestamp
+            # before any object is read
+            sync.timestamp
             transaction.manager.registerSynch(self)
             tx = transaction.manager.get()
             self.newTransaction(tx)
@@ -74,8 +92,11 @@ class Manager(object):
     def abort(self, transaction):
         """Abort changes."""
 
+        committed = self._thread.committed
         self._revert(self._thread.modified)
-        self._revert(self._thread.committed)
+        self._revert([obj for obj, state in committed])
+        del committed[:]
+        self._thread.needs_to_join = True
 
     def add(self, obj):
         """Add an object to the database.
@@ -84,6 +105,9 @@ class Manager(object):
         root object graph.
         """
 
+        if self.read_only:
+            raise ReadOnlyError(obj)
+
         if obj._p_jar is None:
             obj._p_jar = self
         elif obj._p_jar is self:
@@ -102,40 +126,13 @@ class Manager(object):
     def commit(self, transaction):
         """Commit changes to disk."""
 
-        committed = self._thread.committed
-        modified = self._thread.modified
-        timestamp = self._thread.timestamp
-
-        # update transaction timestamp
-        self._thread.timestamp = sync.timestamp
-
-        while modified:
-            for obj in tuple(modified):
-                # assert that object belongs to this database
-                if obj._p_jar is not self:
-                    raise InvalidObjectReference(obj)
-
-                # if the object has been updated since we begun our
-                # transaction, it's a write-conflict.
-                if obj._p_serial is not None and obj._p_serial > timestamp:
-                    try:
-                        state = self._resolve(obj)
-                    except ConflictError:
-                        raise WriteConflictError(obj)
-                else:
-                    state = obj.__getstate__()
-
-                # make sure the object has an oid
-                oid = obj._p_oid
-                if oid is None:
-                    oid = self.new_oid(obj)
-
-                self.write(oid, obj._p_class, state)
-                committed.append((obj, state))
-                modified.remove(obj)
-
-        # update database timestamp
-        self.tx_timestamp = self._thread.timestamp
+        started = clock()
+        trace = self._thread.trace
+        if trace is not None and trace.sampled:
+            trace.run_profiled(self._commit, transaction)
+        else:
+            self._commit(transaction)
+        self._timing('commit', clock() - started)
 
     def get(self, oid, cls=None):
         obj = self._oid2obj.get(oid)
@@ -147,7 +144,7 @@ class Manager(object):
     def elect(self, obj):
         """Elect object as database root."""
 
-        if not isinstance(obj, Persistent):
+        if not isinstance(obj, PersistentBase):
             raise TypeError(
                 "Can't set non-persistent object as database root.")
 
@@ -160,14 +157,109 @@ class Manager(object):
         obj._p_oid = ROOT_OID
         self.add(obj)
 
+    def memory_report(self):
+        """Return an estimate of the memory used by the objects of the
+        database, by class.
+
+        For each class (by dotted name), the report gives the number
+        of objects (``count``) and the estimated size in bytes of
+        their shared state (``size``); for the objects in local state
+        (``local``), the number of working copies (``copies``) and
+        the changesets they keep (``changes``), along with their
+        estimated size (``copies_size`` and ``changes_size``). The
+        ``total`` entry sums up all classes.
+
+        The sizes include the values held by an object, but not the
+        persistent objects it references.
+        """
+
+        fields = (
+            'count', 'size', 'local', 'copies', 'copies_size',
+            'changes', 'changes_size')
+
+        classes = {}
+        for obj in tuple(self._oid2obj.values()):
+            lock = object_lock(obj)
+            lock.acquire()
+            try:
+                if isinstance(obj, Local):
+                    cls = obj._p_class
+                    values = (1, obj._p_sizeof(), 1) + obj._p_memory()
+                else:
+                    cls = type(obj)
+                    values = (1, obj._p_sizeof(), 0, 0, 0, 0, 0)
+            finally:
+                lock.release()
+
+            name = "%s.%s" % (cls.__module__, cls.__name__)
+            entry = classes.get(name)
+            if entry is None:
+                entry = classes[name] = dict.fromkeys(fields, 0)
+            for field, value in zip(fields, values):
+                entry[field] += value
+
+        total = dict.fromkeys(fields, 0)
+        for entry in classes.values():
+            for field in fields:
+                total[field] += entry[field]
+
+        return {'classes': classes, 'total': total}
+
     def newTransaction(self, transaction):
         """New transaction."""
 
         self._sync()
 
+    def read_checkpoint(self, jar, end=None):
+        """Return checkpoint of the database state, or ``None``.
+
+        A checkpoint is a tuple ``(record, count, objects)`` of the
+        most recent transaction record, the number of transactions it
+        covers, and an iterable of ``(oid, cls, serial, state)``
+        entries; only the transactions which follow need to be read.
+        """
+
     def save(self, obj):
         return self._register(obj)
 
+    def stats(self):
+        """Return a snapshot of the metrics and the state of the
+        database.
+
+        The ``metrics`` entry holds the counters and timings recorded
+        by the metrics sink; the other entries describe the current
+        state: the number of transactions, the number of objects
+        loaded and the number of objects in local state (checked
+        out), along with the changesets they keep and the number of
+        transactions which have working copies of them.
+        """
+
+        lock = sync._tx_lock
+        lock.acquire()
+        try:
+            connected = [
+                obj for obj in tuple(sync._connected) if obj._p_jar is self]
+        finally:
+            lock.release()
+
+        changes = active = 0
+        for obj in connected:
+            if isinstance(obj, Local):
+                obj_changes, obj_active = obj._p_stats()
+                changes += obj_changes
+                active += obj_active
+
+        return {
+            'metrics': self.metrics.snapshot(),
+            'transactions': self.tx_count,
+            'objects': len(self._oid2obj),
+            'connected': len(connected),
+            'changes': changes,
+            'active': active,
+            'resolve_hits': self.resolve_hits,
+            'resolve_misses': self.resolve_misses,
+            }
+
     def snapshot(self, database, timestamp=None):
         """Return database snapshot."""
 
@@ -235,7 +327,114 @@ class Manager(object):
         if obj not in modified:
             modified.add(obj)
 
+    def _after_fork(self):
+        # locks held by other threads of the parent process are never
+        # released in the child process
+        l = threading.RLock()
+        self.lock_acquire = l.acquire
+        self.lock_release = l.release
+        self._thread = ThreadState()
+        self.tx_ref = None
+
+    def _commit(self, transaction):
+        committed = self._thread.committed
+        modified = self._thread.modified
+        timestamp = self._thread.timestamp
+
+        # the commit timestamp is taken while we hold the commit lock
+        # (see ``Synchronizer.commit_timestamp``)
+        self._thread.timestamp = sync.commit_timestamp()
+
+        while modified:
+            for obj in tuple(modified):
+                # assert that object belongs to this database
+                if obj._p_jar is not self:
+                    raise InvalidObjectReference(obj)
+
+                # if the object has been updated since we begun our
+                # transaction, it's a write-conflict (a transaction
+                # which began while another was being committed has
+                # the same timestamp; see ``Synchronizer``)
+                if obj._p_serial is not None and obj._p_serial >= timestamp:
+                    try:
+                        state = self._resolve(obj, timestamp)
+                    except ConflictError:
+                        self.metrics.count('conflicts.write')
+                        raise WriteConflictError(obj)
+                else:
+                    state = obj.__getstate__()
+
+                # make sure the object has an oid
+                oid = obj._p_oid
+                if oid is None:
+                    oid = self.new_oid(obj)
+
+                self.write(oid, obj._p_class, state)
+                committed.append((obj, state))
+                modified.remove(obj)
+
+    def _fold(self, jar, end=None):
+        """Read all transactions, materializing only the final state
+        of each object.
+
+        The changesets of an object are combined in order using its
+        ``_p_fold`` method; the object is then loaded once, with the
+        timestamp of the most recent change.
+        """
+
+        latest = {}
+        records = []
+        start = None
+
+        checkpoint = self.read_checkpoint(jar, end)
+        if checkpoint is not None:
+            record, count, objects = checkpoint
+            for oid, cls, serial, state in objects:
+                latest[oid] = [cls, serial, state]
+
+            # the record stands in for all the transactions up to the
+            # checkpoint (see ``_sync``)
+            self.tx_count += count - 1
+            records.append(record)
+            start = record.timestamp
+
+        for record, objects in self.read(jar, start):
+            timestamp = record.timestamp
+            if end and timestamp > end:
+                break
+
+            records.append(record)
+
+            # the entries of an aborted transaction precede its record
+            if not record.status:
+                continue
+
+            for oid, cls, state, previous in objects:
+                entry = latest.get(oid)
+                if entry is None:
+                    latest[oid] = [cls, timestamp, state]
+                else:
+                    entry[0] = cls
+                    entry[1] = timestamp
+                    entry[2] = cls._p_fold(entry[2], state)
+
+        for oid, (cls, timestamp, state) in latest.items():
+            obj = jar.get(oid, cls)
+            setattr(obj, "__class__", cls)
+            setattr(obj, '_p_serial', timestamp)
+            setattr(obj, '_p_jar', jar)
+            obj.__setstate__(state)
+
+        return records
+
     def _read(self, jar, start=None, end=None):
+        # on a cold start, there are no objects in local state and we
+        # need only the final state of each object
+        if start is None:
+            for record in self._fold(jar, end):
+                yield record
+            return
+
         conflicts = set()
 
         for record, objects in self.read(jar, start):
@@ -243,48 +442,76 @@ class Manager(object):
             if end and timestamp > end:
                 break
 
-            for oid, cls, state in objects:
+            # the entries of an aborted transaction precede its record
+            if not record.status:
+                yield record
+                continue
+
+            for oid, cls, state, previous in objects:
                 obj = jar.get(oid, cls)
 
-                if obj in self._thread.modified:
-                    # if our version of the object is persistent-local
-                    # then we have a write conflict; it may be
-                    # resolved, if the object provides a conflict
-                    # resolution method; it gets called with three
-                    # arguments: (old_state, saved_state, new_state).
-                    try:
-                        state = self._resolve(obj, new_state=state)
-                    except ConflictError:
+                if isinstance(obj, Local):
+                    # if we've modified the object, we have a write
+                    # conflict; unless the object can resolve it (when
+                    # the transaction is committed), it's a read
+                    # conflict.
+                    if obj in self._thread.modified and \
+                           obj._p_resolve_conflict is None and \
+                           not obj._p_resolve_disjoint:
                         conflicts.add(obj)
+
+                    # the changeset is applied to the shared state
+                    # while preserving the local state of any thread
+                    obj._p_update(state, timestamp)
+                    obj._p_serial = timestamp
+                    obj._p_jar = jar
                 else:
                     setattr(obj, "__class__", cls)
 
-                # update timestamp
-                setattr(obj, '_p_serial', timestamp)
+                    # update timestamp
+                    setattr(obj, '_p_serial', timestamp)
 
-                # associate with this database
-                setattr(obj, '_p_jar', jar)
+                    # associate with this database
+                    setattr(obj, '_p_jar', jar)
 
-                # set shared state
-                obj.__setstate__(state)
+                    # set shared state
+                    obj.__setstate__(state)
 
             yield record
 
         if conflicts:
+            self.metrics.count('conflicts.read', len(conflicts))
             raise ReadConflictError(*conflicts)
 
-    def _resolve(self, obj, new_state=None):
+    def _resolve(self, obj, timestamp):
+        """Resolve a write conflict.
+
+        If the object provides a conflict resolution method, it gets
+        called with three arguments: (old_state, saved_state,
+        new_state). Otherwise, if the object allows it, the changes
+        are merged if they're disjoint from the changes committed
+        since ``timestamp``.
+        """
+
         self.lock_acquire()
         try:
-            if obj._p_resolve_conflict is None:
-                raise ConflictError(obj)
-            if new_state is None:
-                new_state = obj.__getstate__()
-            return obj._p_resolve_conflict(
-                obj.__oldstate__(),
-                super(type(obj), obj).__getstate__(),
-                new_state
-                )
+            try:
+                if obj._p_resolve_conflict is not None:
+                    state = obj._p_resolve_conflict(
+                        obj.__oldstate__(),
+                        obj.__savedstate__(),
+                        obj.__getstate__()
+                        )
+                elif obj._p_resolve_disjoint:
+                    state = obj._p_merge(timestamp)
+                else:
+                    raise ConflictError(obj)
+            except ConflictError:
+                self.resolve_misses += 1
+                raise
+
+            self.resolve_hits += 1
+            return state
         finally:
             self.lock_release()
 
@@ -294,9 +521,29 @@ class Manager(object):
             obj.__setstate__()
 
     def _sync(self):
-        for record in self._read(self, self.tx_timestamp):
-            self.tx_count += 1
-            self.tx_timestamp = record.timestamp
+        started = clock()
+        count = 0
+        self.lock_acquire()
+        try:
+            for record in self._read(self, self.tx_timestamp):
+                self.tx_count += 1
+                self.tx_timestamp = record.timestamp
+                count += 1
+        finally:
+            self.lock_release()
+
+        self._timing('sync', clock() - started)
+        if count:
+            self.metrics.count('sync.records', count)
+            trace = self._thread.trace
+            if trace is not None:
+                trace.records += count
+
+    def _timing(self, name, seconds):
+        self.metrics.timing(name, seconds)
+        trace = self._thread.trace
+        if trace is not None:
+            trace.phase(name, seconds)
 
     def _tpc_cleanup(self):
         """Performs cleanup operations to support ``tpc_finish`` and
@@ -311,6 +558,7 @@ class ThreadState(threading.local):
 
     needs_to_join = True
     timestamp = None
+    trace = None
 
     def __init__(self):
         self.modified = set()
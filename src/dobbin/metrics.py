@@ -0,0 +1,111 @@
+import threading
+import time
+
+# a monotonic, high-resolution clock (where available)
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Histogram(object):
+    """Histogram of durations (in seconds).
+
+    The buckets are logarithmic: bucket ``n`` counts the durations of
+    less than ``2 ** n`` microseconds (and at least half that). Adding
+    a value is cheap and the memory use is constant.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        bucket = int(value * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, p):
+        """Return the upper bound (in seconds) of the bucket which
+        holds the ``p`` percentile."""
+
+        if not self.count:
+            return 0.0
+
+        rank = self.count * p / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                break
+        return min((1 << bucket) / 1e6, self.max)
+
+    def snapshot(self):
+        count = self.count
+        return {
+            'count': count,
+            'total': self.total,
+            'mean': self.total / count if count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            }
+
+
+class Metrics(object):
+    """Metrics sink which keeps counters and histograms in memory.
+
+    A sink must implement the ``count(name, value)`` and
+    ``timing(name, seconds)`` methods; the ``snapshot`` method returns
+    the recorded metrics (see ``Manager.stats``). To forward metrics
+    to a monitoring system, pass a custom sink to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def count(self, name, value=1):
+        self._lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self._lock.release()
+
+    def timing(self, name, seconds):
+        self._lock.acquire()
+        try:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.add(seconds)
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            return {
+                'counters': dict(self.counters),
+                'timings': dict(
+                    (name, histogram.snapshot())
+                    for (name, histogram) in self.timings.items()),
+                }
+        finally:
+            self._lock.release()
+
+
+class NullMetrics(object):
+    """Metrics sink which discards all metrics."""
+
+    def count(self, name, value=1):
+        pass
+
+    def timing(self, name, seconds):
+        pass
+
+    def snapshot(self):
+        return {}
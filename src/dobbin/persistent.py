@@ -1,15 +1,27 @@
 import os
 import sys
 import copy
+import array
+import bisect
 import threading
 import transaction
 import types
 import weakref
 
+from contextlib import contextmanager
+
+try:
+    from collections.abc import ItemsView, KeysView, ValuesView
+except ImportError:
+    from collections import ItemsView, KeysView, ValuesView
+
+from dobbin.exc import ConflictError
 from dobbin.exc import ObjectGraphError
+from dobbin.exc import ReadOnlyError
 from dobbin.utils import make_timestamp
 from dobbin.utils import add_class_properties
 from dobbin.utils import marker
+from dobbin.utils import slot_names
 
 EMPTY = marker()
 MARKER = marker()
@@ -23,43 +35,208 @@ getitem = dict.__getitem__
 delitem = dict.__delitem__
 contains_item = dict.__contains__
 
-_co_lock = threading.RLock()
-_ci_lock = threading.Lock()
+# checkout and checkin are serialized per object using a fixed set of
+# lock stripes; threads working on unrelated objects will (most
+# likely) not contend for the same lock
+LOCK_STRIPES = 64
+
+_locks = tuple(threading.RLock() for i in range(LOCK_STRIPES))
+
+# the type codes of the arrays which can be persisted; the data is
+# cast to the type code when it's read (see ``PersistentArray``)
+ARRAY_TYPECODES = frozenset('bBhHiIlLqQfd')
+
+
+def object_lock(obj):
+    """Return the lock which guards the state transitions of ``obj``."""
+
+    # the lowest bits of an object address are always zero due to
+    # memory alignment
+    return _locks[(id(obj) >> 4) % LOCK_STRIPES]
 
 
 def checkout(obj):
     """Checks out the object for this thread to make local changes."""
 
-    if not isinstance(obj, Persistent):
+    if not isinstance(obj, PersistentBase):
         raise TypeError("Object %s is not type ``Persistent``." % repr(obj))
 
-    _co_lock.acquire()
+    if sync.read_only:
+        raise ReadOnlyError(obj)
+
+    # objects of a historical view (see ``Database.at``) or a
+    # read-only database can't be checked out; note that the slots
+    # of a compact object may not have been set
+    jar = getattr(obj, '_p_jar', None)
+    if jar is not None and jar.read_only:
+        raise ReadOnlyError(obj)
+
+    lock = object_lock(obj)
+    lock.acquire()
     try:
         obj._p_checkout()
+    finally:
+        lock.release()
 
-        if obj._p_jar is not None:
-            obj._p_jar.save(obj)
+    jar = obj._p_jar
+    if jar is not None:
+        jar.save(obj)
+
+
+@contextmanager
+def bulk():
+    """Construct new persistent objects in shared state.
+
+    Used by the bulk loader (see ``Database.bulk_load``); objects are
+    not checked out when constructed (their attributes are set
+    directly) and must be written using the bulk loader.
+    """
+
+    thread = threading.current_thread()
+    start = sync._tx_start.get(thread)
+    sync.bulk = True
+    try:
+        yield
     finally:
-        _co_lock.release()
+        sync.bulk = False
 
+        # objects which are checked out (e.g. containers) are
+        # registered with the synchronizer; this must not keep other
+        # objects from being checked in
+        sync._tx_start[thread] = start
 
-class Persistent(object):
-    """Persistent base class.
 
-    All persistent objects must derive from this class. Persistent
-    classes are responsible for MVCC-compliance on a thread-level.
+@contextmanager
+def read_only():
+    """Run a read-only transaction.
+
+    A new transaction is begun, pinning the snapshot timestamp. Reads
+    are served directly from the shared state of each object (or the
+    version that was current when the transaction began) without
+    making a thread-local copy; values must not be mutated. Checking
+    out an object raises ``ReadOnlyError``.
+
+    The transaction is aborted on exit.
+    """
+
+    tx = transaction.begin()
+    sync.read_only = True
+    try:
+        yield tx
+    finally:
+        sync.read_only = False
+        transaction.abort()
+
+
+def _deepcopy(value):
+    # binary values may be loaded as read-only memory views (see
+    # ``Database``); these are immutable, but can't be copied
+    if type(value) is memoryview and value.readonly:
+        return value
+    return copy.deepcopy(value)
+
+
+def _shared(state):
+    # the shared state of an object includes the persistence
+    # attributes; these are not part of the changeset
+    return dict((key, value) for (key, value) in state.items()
+                if not key.startswith('_p_'))
+
+
+def _equals(value, other):
+    if value is other:
+        return True
+    if value is DELETE or other is DELETE:
+        return False
+    try:
+        return bool(value == other)
+    except Exception:
+        return False
+
+
+def _sizeof(value, seen):
+    # estimated size of a value and the values it contains; other
+    # persistent objects are sized separately
+    if id(value) in seen or isinstance(value, PersistentBase):
+        return 0
+    seen.add(id(value))
+    return sys.getsizeof(value) + _sizeof_items(value, seen)
+
+
+def _sizeof_attrs(d, seen):
+    # attribute names are usually interned (shared between objects)
+    seen.add(id(d))
+    return sys.getsizeof(d) + sum(
+        _sizeof(value, seen) for value in dict.values(d))
+
+
+def _sizeof_items(value, seen):
+    if isinstance(value, dict):
+        return sum(
+            _sizeof(key, seen) + _sizeof(item, seen)
+            for (key, item) in dict.items(value))
+
+    if isinstance(value, list):
+        items = list.__iter__(value)
+    elif isinstance(value, set):
+        items = set.__iter__(value)
+    elif isinstance(value, (tuple, frozenset)):
+        items = iter(value)
+    else:
+        return 0
+
+    return sum(_sizeof(item, seen) for item in items)
+
+
+class SystemAttribute(object):
+    """Default value of a system attribute (e.g. ``_p_jar``).
+
+    The object may be read by another thread while it's checked out
+    or in; in between, the system attributes are kept in the
+    ``_p_state`` entry of the instance dictionary.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, inst, cls=None):
+        if inst is not None:
+            d = getattr(type(inst), '__dictoffset__', 0) and \
+                object.__getattribute__(inst, '__dict__')
+            state = d and d.get('_p_state')
+            if state:
+                return state.get(self.name)
+
+
+class PersistentBase(object):
+    """Base class of persistent objects.
+
+    Persistent objects derive from ``Persistent`` (or
+    ``CompactPersistent``). Persistent classes are responsible for
+    MVCC-compliance on a thread-level.
 
     The ``_p_checkout`` method is called once when the object is first
     checked out by any one thread, while the ``_p_checkin`` is called
     when all threads are done with the object.
+
+    During a bulk load (see ``Database.bulk_load``), new objects are
+    constructed in shared state, unless ``_p_bulk`` is false.
+
+    This class declares no instance attributes such that its
+    subclasses can do without an instance dictionary.
     """
 
-    _p_jar = None
-    _p_oid = None
-    _p_serial = None
+    __slots__ = ()
+
+    _p_bulk = True
+    _p_jar = SystemAttribute('_p_jar')
+    _p_oid = SystemAttribute('_p_oid')
+    _p_serial = SystemAttribute('_p_serial')
     _p_resolve_conflict = None
+    _p_resolve_disjoint = False
 
     def __new__(cls, *args, **kwargs):
+        requested = cls
         bases = cls.__mro__
         try:
             index = bases.index(Local)
@@ -76,8 +253,14 @@ class Persistent(object):
             factory = object.__new__
 
         inst = factory(cls)
-        checkout(inst)
-        inst.__init__(*args, **kwargs)
+        if not (sync.bulk and cls._p_bulk):
+            checkout(inst)
+
+        # the constructor is called by the type only if the instance
+        # is of the requested class
+        if not isinstance(inst, requested):
+            inst.__init__(*args, **kwargs)
+
         return inst
 
     def __deepcopy__(self, memo):
@@ -87,22 +270,77 @@ class Persistent(object):
         return id(self)
 
     def __getstate__(self):
-        return self.__dict__
+        cls = type(self)
+        slots = slot_names(cls)
+        if not slots:
+            return self.__dict__
+
+        # the system attributes of a compact object are kept in slots;
+        # they're not part of its state
+        state = dict(self.__dict__) if cls.__dictoffset__ else {}
+        for key in slots:
+            if key.startswith('_p_'):
+                continue
+            value = getattr(self, key, MARKER)
+            if value is not MARKER:
+                state[key] = value
+        return state
 
     def __delattr__(self, key):
         raise TypeError("Can't delete attribute of shared object.")
 
+    def __getattr__(self, key):
+        # the object may be read by another thread while it's checked
+        # out or in (without holding the object lock); in between,
+        # the shared state is kept in the instance dictionary rather
+        # than slots, or in the ``_p_state`` entry (see ``Local``)
+        if not type(self).__dictoffset__:
+            raise AttributeError(key)
+        d = object.__getattribute__(self, '__dict__')
+        for state in (d, d.get('_p_state')):
+            if state is not None and key in state:
+                return state[key]
+        raise AttributeError(key)
+
     def __setstate__(self, new_state={}):
-        self.__dict__.update(new_state)
+        cls = type(self)
+        slots = slot_names(cls)
+        if not slots:
+            self.__dict__.update(new_state)
+            return
+
+        d = self.__dict__ if cls.__dictoffset__ else None
+        for key, value in new_state.items():
+            if key in slots or d is None:
+                setattr(self, key, value)
+            else:
+                d[key] = value
 
     def __setattr__(self, key, value):
+        # objects constructed during a bulk load are in shared state
+        # until they've been written
+        if sync.bulk and getattr(self, '_p_serial', None) is None:
+            return setattr(self, key, value)
         raise TypeError("Can't set attribute on shared object.")
 
     def _p_checkin(self):
         raise TypeError("Object not checked out.")
 
     def _p_checkout(self):
+        cls = type(self)
+        if not cls.__dictoffset__:
+            return self._p_checkout_compact()
+
         state = self.__dict__
+
+        # the shared state of a slotted object is moved into the
+        # instance dictionary while the object is checked out
+        for key in slot_names(cls):
+            value = getattr(self, key, MARKER)
+            if value is not MARKER:
+                state[key] = value
+                delattr(self, key)
+
         setattr(self, '__dict__', {'_p_state': state})
 
         # assign new class
@@ -113,19 +351,82 @@ class Persistent(object):
         # dictionary since it may be masked by the new class
         return self._p_checkout()
 
+    def _p_checkout_compact(self):
+        # an object without an instance dictionary keeps its shared
+        # state in slots until it has the local class, which has the
+        # same layout; the state is then kept by the class
+        cls = type(self)
+        slots = slot_names(cls)
+        state = {}
+        for key in slots:
+            value = getattr(self, key, MARKER)
+            if value is not MARKER:
+                state[key] = value
+
+        wc = WorkingCopyDict(state)
+        local = self._p_class(wc)
+        local._p_state = state
+        setattr(self, '__class__', local)
+
+        for key in slots:
+            if key in state:
+                getattr(cls, key).__delete__(self)
+
+        return self._p_checkout()
+
+    def _p_checkpoint(self):
+        """Return the shared state of the object as a changeset which
+        restores it (see ``_p_fold``).
+
+        The object lock must be held.
+        """
+
+        if isinstance(self, Local):
+            return _shared(self.__savedstate__())
+        return _shared(self.__getstate__())
+
     def _p_class(self, dict):
         cls = self.__class__
         d = {'_p_class': cls, '__dict__': dict}
 
         add_class_properties(cls, Local, d)
 
-        class metacls(type):
-            def mro(cls):
-                mro = type.mro(cls)
-                mro.insert(mro.index(Persistent), Local)
-                return tuple(mro)
+        return LocalType("Local%s" % cls.__name__, (cls, Local), d)
 
-        return metacls("Local%s" % cls.__name__, (Local, cls), d)
+    @classmethod
+    def _p_fold(cls, state, new_state):
+        """Combine two consecutive changesets into one.
+
+        The returned changeset must have the same effect on the shared
+        state as applying ``state`` followed by ``new_state``. This is
+        used to load only the final state of an object when the
+        database is first read; the changesets are not otherwise used
+        and may be updated in-place.
+        """
+
+        state.update(new_state)
+        return state
+
+    def _p_sizeof(self):
+        """Return the estimated size (in bytes) of the object and its
+        shared state."""
+
+        seen = set((id(self), id(self._p_jar)))
+        size = sys.getsizeof(self) + _sizeof_items(self, seen)
+        if type(self).__dictoffset__:
+            size += _sizeof_attrs(self.__dict__, seen)
+        for key in slot_names(type(self)):
+            if not key.startswith('_p_'):
+                size += _sizeof(getattr(self, key, None), seen)
+        return size
+
+
+class Persistent(PersistentBase):
+    """Persistent base class.
+
+    The shared state of the object is kept in its instance dictionary
+    (and the slots that a subclass declares).
+    """
 
 
 class PersistentDict(Persistent, dict):
@@ -136,6 +437,7 @@ class PersistentDict(Persistent, dict):
     retrieved).
     """
 
+    _p_bulk = False
     _p_items = None
 
     def __init__(self, state=None):
@@ -159,16 +461,31 @@ class PersistentDict(Persistent, dict):
     def __delitem__(self, key, value):
         raise TypeError("Can't delete entry from shared dictionary.")
 
+    @classmethod
+    def _p_fold(cls, state, new_state):
+        attrs, items = state
+        new_attrs, new_items = new_state
+        attrs.update(new_attrs)
+        items.update(new_items)
+        return attrs, items
+
     def __setitem__(self, key, value):
         raise TypeError("Can't set entry on shared dictionary.")
 
+    def _p_checkpoint(self):
+        if isinstance(self, Local):
+            attrs, items = self.__savedstate__()
+        else:
+            attrs, items = self.__dict__, dict(self)
+        return _shared(attrs), items
+
     def _p_class(self, d):
         items = WorkingCopyDict(self)
         cls = self.__class__
         d = {'_p_class': cls, '_p_items': items, '__dict__': d}
 
         # copy dictionary methods
-        exclude = LocalDict.__dict__
+        exclude = LocalContainer.__dict__
         for key in dict.__dict__:
             if key not in exclude:
                 value = getattr(items, key, None)
@@ -176,7 +493,663 @@ class PersistentDict(Persistent, dict):
                     d[key] = staticmethod(value)
 
         add_class_properties(cls, LocalDict, d)
-        return type("Local%s" % cls.__name__, (LocalDict, cls), d)
+        return LocalType("Local%s" % cls.__name__, (cls, LocalDict), d)
+
+
+class CompactPersistent(PersistentBase):
+    """Persistent base class for compact objects.
+
+    Subclasses must declare their attributes using ``__slots__``; the
+    shared state of the object is kept entirely in slots (there's no
+    instance dictionary) which reduces the memory footprint of small
+    objects. When checked out, the object behaves like any other
+    persistent object.
+    """
+
+    __slots__ = '_p_jar', '_p_oid', '_p_serial'
+
+
+class BTreeBucket(CompactPersistent):
+    """Leaf node of a B-tree; holds sorted lists of keys and values."""
+
+    __slots__ = '_keys', '_values'
+
+    def __init__(self, keys=(), values=()):
+        self._keys = list(keys)
+        self._values = list(values)
+
+    def _delete(self, key, tree):
+        keys = self._keys
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            raise KeyError(key)
+
+        tree._counter().decrement()
+        checkout(self)
+        del self._keys[i]
+        return self._values.pop(i)
+
+    def _get(self, key):
+        keys = self._keys
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            raise KeyError(key)
+        return self._values[i]
+
+    def _insert(self, key, value, tree):
+        keys = self._keys
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if self._values[i] is not value:
+                checkout(self)
+                self._values[i] = value
+            return
+
+        tree._counter().increment()
+        checkout(self)
+        keys = self._keys
+        values = self._values
+        keys.insert(i, key)
+        values.insert(i, value)
+
+        if len(keys) > tree.max_bucket_size:
+            index = len(keys) // 2
+            right = BTreeBucket(keys[index:], values[index:])
+            del keys[index:]
+            del values[index:]
+            return right._keys[0], right
+
+    def _items(self, min, max):
+        keys = self._keys
+        values = self._values
+        lo = 0 if min is None else bisect.bisect_left(keys, min)
+        hi = len(keys) if max is None else bisect.bisect_right(keys, max)
+        return zip(keys[lo:hi], values[lo:hi])
+
+
+class BTreeNode(CompactPersistent):
+    """Interior node of a B-tree.
+
+    The child at index ``i`` holds the keys which are greater than or
+    equal to ``_keys[i - 1]`` and less than ``_keys[i]``.
+    """
+
+    __slots__ = '_keys', '_children'
+
+    def __init__(self, keys=(), children=()):
+        self._keys = list(keys)
+        self._children = list(children)
+
+    def _child(self, key):
+        return self._children[bisect.bisect_right(self._keys, key)]
+
+    def _delete(self, key, tree):
+        return self._child(key)._delete(key, tree)
+
+    def _get(self, key):
+        return self._child(key)._get(key)
+
+    def _insert(self, key, value, tree):
+        i = bisect.bisect_right(self._keys, key)
+        split = self._children[i]._insert(key, value, tree)
+        if split is None:
+            return
+
+        checkout(self)
+        keys = self._keys
+        children = self._children
+        separator, child = split
+        keys.insert(i, separator)
+        children.insert(i + 1, child)
+
+        if len(children) > tree.max_node_size:
+            index = len(keys) // 2
+            separator = keys[index]
+            right = BTreeNode(keys[index + 1:], children[index + 1:])
+            del keys[index:]
+            del children[index + 1:]
+            return separator, right
+
+    def _items(self, min, max):
+        keys = self._keys
+        children = self._children
+        start = 0 if min is None else bisect.bisect_right(keys, min)
+        for i in range(start, len(children)):
+            if max is not None and i > 0 and keys[i - 1] > max:
+                break
+            for item in children[i]._items(min, max):
+                yield item
+
+
+class PersistentBTree(Persistent):
+    """Persistent B-tree mapping.
+
+    The entries are kept in sorted order in buckets; interior nodes
+    and buckets are separate persistent objects. Changes check out
+    only the buckets (and nodes) that are touched, such that a commit
+    writes only those objects and write conflicts are detected per
+    bucket.
+
+    Keys must be orderable. The ``keys``, ``values`` and ``items``
+    methods take an optional (inclusive) key range.
+
+    The number of entries is kept by a ``PersistentCounter`` such that
+    transactions which add or remove entries in different buckets
+    don't conflict. Note that buckets are not merged when entries are
+    removed.
+    """
+
+    max_bucket_size = 64
+    max_node_size = 128
+
+    _root = None
+    _size = None
+
+    def __init__(self, items=None):
+        if items is not None:
+            self.update(items)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __delitem__(self, key):
+        root = self._root
+        if root is None:
+            raise KeyError(key)
+        root._delete(key, self)
+
+    def __getitem__(self, key):
+        root = self._root
+        if root is None:
+            raise KeyError(key)
+        return root._get(key)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        size = self._size
+        if size is None:
+            return self._count()
+        return size.value
+
+    def __setitem__(self, key, value):
+        root = self._root
+        if root is None:
+            checkout(self)
+            root = self._root = BTreeBucket()
+            self._size = PersistentCounter()
+
+        split = root._insert(key, value, self)
+        if split is not None:
+            separator, right = split
+            checkout(self)
+            self._root = BTreeNode((separator, ), (root, right))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self, min=None, max=None):
+        root = self._root
+        if root is None:
+            return iter(())
+        return iter(root._items(min, max))
+
+    def keys(self, min=None, max=None):
+        return (key for key, value in self.items(min, max))
+
+    def pop(self, key, default=MARKER):
+        root = self._root
+        try:
+            if root is None:
+                raise KeyError(key)
+            return root._delete(key, self)
+        except KeyError:
+            if default is MARKER:
+                raise
+            return default
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, MARKER)
+        if value is not MARKER:
+            return value
+        self[key] = default
+        return default
+
+    def update(self, items):
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            self[key] = value
+
+    def values(self, min=None, max=None):
+        return (value for key, value in self.items(min, max))
+
+    def _count(self):
+        count = 0
+        for key in self:
+            count += 1
+        return count
+
+    def _counter(self):
+        # a tree written by an earlier release is counted once
+        size = self._size
+        if size is None:
+            checkout(self)
+            size = self._size = PersistentCounter(self._count())
+        else:
+            checkout(size)
+        return size
+
+
+class PersistentList(Persistent, list):
+    """Persistent list.
+
+    Changes to a checked out list are recorded as a log of operations;
+    a commit writes only the operations, not the entire list.
+    Concurrent transactions which only append entries are merged
+    without conflict.
+
+    Note that entries are copied when read (like attributes); changing
+    an entry in-place is not recorded, it must be assigned again.
+    """
+
+    _p_bulk = False
+    _p_items = None
+    _p_resolve_disjoint = True
+
+    def __init__(self, iterable=()):
+        self.extend(iterable)
+
+    def __repr__(self):
+        return "<%s.%s at 0x%x>" % (
+            type(self).__module__, type(self).__name__, id(self))
+
+    def __getstate__(self):
+        return self.__dict__, [('extend', list(self))]
+
+    def __setstate__(self, updated=None):
+        if updated is None:
+            updated = {}, ()
+        new_state, ops = updated
+        self.__dict__.update(new_state)
+        for op in ops:
+            WorkingCopyList._p_perform(self, op)
+
+    def __setitem__(self, index, value):
+        raise TypeError("Can't set entry on shared list.")
+
+    def __delitem__(self, index):
+        raise TypeError("Can't delete entry from shared list.")
+
+    def __iadd__(self, other):
+        raise TypeError("Can't extend shared list.")
+
+    def __imul__(self, other):
+        raise TypeError("Can't extend shared list.")
+
+    def append(self, value):
+        raise TypeError("Can't append to shared list.")
+
+    def extend(self, values):
+        raise TypeError("Can't extend shared list.")
+
+    def insert(self, index, value):
+        raise TypeError("Can't insert into shared list.")
+
+    def pop(self, index=-1):
+        raise TypeError("Can't pop from shared list.")
+
+    def remove(self, value):
+        raise TypeError("Can't remove from shared list.")
+
+    def _p_checkpoint(self):
+        if isinstance(self, Local):
+            attrs, items = self.__savedstate__()
+        else:
+            attrs, items = self.__dict__, list(self)
+        return _shared(attrs), [('extend', items)]
+
+    def _p_class(self, d):
+        return local_container_class(self, LocalList, WorkingCopyList(self), d)
+
+    @classmethod
+    def _p_fold(cls, state, new_state):
+        # the operations are performed on a list of entries; the
+        # combined changeset extends the (empty) list
+        attrs, ops = state
+        new_attrs, new_ops = new_state
+        attrs.update(new_attrs)
+        if len(ops) == 1 and ops[0][0] == 'extend':
+            items = ops[0][1]
+        else:
+            items = []
+            for op in ops:
+                WorkingCopyList._p_perform(items, op)
+        for op in new_ops:
+            WorkingCopyList._p_perform(items, op)
+        return attrs, [('extend', items)]
+
+
+class PersistentSet(Persistent, set):
+    """Persistent set.
+
+    Changes to a checked out set are recorded as a log of additions
+    and removals; a commit writes only these. Concurrent transactions
+    are merged without conflict, unless an element is added in one
+    and removed in the other.
+
+    Note that some built-in operations read the entries of a set
+    directly (e.g. ``set(obj)``); for a checked out set, these see the
+    shared state, not the local changes. Use the methods of the
+    persistent set instead (e.g. ``obj.copy()``).
+    """
+
+    _p_bulk = False
+    _p_items = None
+    _p_resolve_disjoint = True
+
+    def __init__(self, iterable=()):
+        self.update(iterable)
+
+    def __repr__(self):
+        return "<%s.%s at 0x%x>" % (
+            type(self).__module__, type(self).__name__, id(self))
+
+    def __getstate__(self):
+        return self.__dict__, [('add', list(self))]
+
+    def __setstate__(self, updated=None):
+        if updated is None:
+            updated = {}, ()
+        new_state, ops = updated
+        self.__dict__.update(new_state)
+        for op in ops:
+            WorkingCopySet._p_perform(self, op)
+
+    def __iand__(self, other):
+        raise TypeError("Can't update shared set.")
+
+    def __ior__(self, other):
+        raise TypeError("Can't update shared set.")
+
+    def __isub__(self, other):
+        raise TypeError("Can't update shared set.")
+
+    def __ixor__(self, other):
+        raise TypeError("Can't update shared set.")
+
+    def add(self, value):
+        raise TypeError("Can't add to shared set.")
+
+    def discard(self, value):
+        raise TypeError("Can't discard from shared set.")
+
+    def pop(self):
+        raise TypeError("Can't pop from shared set.")
+
+    def remove(self, value):
+        raise TypeError("Can't remove from shared set.")
+
+    def update(self, *others):
+        raise TypeError("Can't update shared set.")
+
+    def _p_checkpoint(self):
+        if isinstance(self, Local):
+            attrs, items = self.__savedstate__()
+        else:
+            attrs, items = self.__dict__, self
+        return _shared(attrs), [('add', list(items))]
+
+    def _p_class(self, d):
+        return local_container_class(self, LocalSet, WorkingCopySet(self), d)
+
+    @classmethod
+    def _p_fold(cls, state, new_state):
+        attrs, ops = state
+        new_attrs, new_ops = new_state
+        attrs.update(new_attrs)
+        if len(ops) == 1 and type(ops[0][1]) is set:
+            items = ops[0][1]
+        else:
+            items = set()
+            for op in ops:
+                WorkingCopySet._p_perform(items, op)
+        for op in new_ops:
+            WorkingCopySet._p_perform(items, op)
+        return attrs, [('add', items)]
+
+
+class PersistentAccumulator(Persistent):
+    """Persistent accumulator.
+
+    The value is changed by applying a delta using the ``add`` method
+    (the object must be checked out first). A commit records only the
+    combined delta of the transaction; since deltas commute,
+    concurrent transactions are merged without conflict.
+
+    Subclasses may override the ``_p_combine`` and ``_p_inverse``
+    methods to accumulate values other than numbers; the operation
+    must be commutative and invertible. The initial value is
+    ``_p_zero``.
+    """
+
+    _p_bulk = False
+    _p_items = None
+    _p_resolve_disjoint = True
+    _p_zero = 0
+
+    def __init__(self, value=None):
+        if value is not None:
+            self.add(value)
+
+    def __repr__(self):
+        return "<%s.%s value=%r at 0x%x>" % (
+            type(self).__module__, type(self).__name__, self.value, id(self))
+
+    def __getstate__(self):
+        attrs = dict(self.__dict__)
+        cell = attrs.pop('_p_cell', None)
+        ops = [('add', cell[0])] if cell is not None else []
+        return attrs, ops
+
+    def __setstate__(self, updated=None):
+        if updated is None:
+            updated = {}, ()
+        new_state, ops = updated
+        self.__dict__.update(new_state)
+        cell = self.__dict__.setdefault('_p_cell', [self._p_zero])
+        for name, delta in ops:
+            cell[0] = self._p_combine(cell[0], delta)
+
+    @property
+    def value(self):
+        cell = self.__dict__.get('_p_cell')
+        if cell is None:
+            return self._p_zero
+        return cell[0]
+
+    def add(self, delta):
+        raise TypeError("Can't change shared accumulator.")
+
+    @staticmethod
+    def _p_combine(value, delta):
+        return value + delta
+
+    @staticmethod
+    def _p_inverse(delta):
+        return -delta
+
+    def _p_checkpoint(self):
+        if isinstance(self, Local):
+            attrs, (value, ) = self.__savedstate__()
+        else:
+            attrs, value = self.__dict__, self.value
+        return _shared(attrs), [('add', value)]
+
+    def _p_class(self, d):
+        state = self.__dict__['_p_state']
+        cell = state.setdefault('_p_cell', [self._p_zero])
+        items = WorkingCopyAccumulator(cell, type(self))
+        return local_container_class(self, LocalAccumulator, items, d)
+
+    @classmethod
+    def _p_fold(cls, state, new_state):
+        attrs, ops = state
+        new_attrs, new_ops = new_state
+        attrs.update(new_attrs)
+        ops = list(ops) + list(new_ops)
+        if not ops:
+            return attrs, ops
+        name, delta = ops[0]
+        for name, value in ops[1:]:
+            delta = cls._p_combine(delta, value)
+        return attrs, [('add', delta)]
+
+
+class PersistentCounter(PersistentAccumulator):
+    """Persistent counter.
+
+    Concurrent transactions may increment (or decrement) the counter
+    without conflict.
+    """
+
+    def __int__(self):
+        return self.value
+
+    def decrement(self, count=1):
+        self.add(-count)
+
+    def increment(self, count=1):
+        self.add(count)
+
+
+class QueueSegment(PersistentList):
+    """Segment of a persistent queue; entries are appended by the
+    producers until the segment is full and a new segment is linked
+    in (see ``_seal``)."""
+
+    _next = None
+
+    def _seal(self, segment):
+        checkout(self)
+        self._next = segment
+
+        # record a change which does not commute with appends; a
+        # concurrent transaction which appends to this segment now
+        # conflicts, rather than adding an entry that consumers may
+        # already have moved past
+        self[len(self):] = ()
+
+
+class QueueCursor(CompactPersistent):
+    """Position of the consumers in a persistent queue."""
+
+    __slots__ = '_segment', '_index'
+
+    def __init__(self, segment, index=0):
+        self._segment = segment
+        self._index = index
+
+
+class PersistentQueue(Persistent):
+    """Persistent first-in, first-out queue.
+
+    The entries are kept in a linked chain of segments. Producers
+    append to the tail segment while consumers advance a separate
+    cursor object over the head segment, such that adding and
+    removing entries never change the same object (and concurrent
+    producers and consumers do not conflict). Concurrent appends to
+    the same segment are merged.
+
+    A new segment is linked in when the tail segment is full; drained
+    segments are no longer referenced. Concurrent consumers always
+    conflict, as do producers which link in a new segment.
+    """
+
+    max_segment_size = 64
+
+    def __init__(self, items=()):
+        segment = QueueSegment()
+        self._head = QueueCursor(segment)
+        self._tail = segment
+        self.extend(items)
+
+    def __iter__(self):
+        cursor = self._head
+        segment = cursor._segment
+        index = cursor._index
+        while segment is not None:
+            for i in range(index, len(segment)):
+                yield segment[i]
+            segment = segment._next
+            index = 0
+
+    def __len__(self):
+        cursor = self._head
+        segment = cursor._segment
+        count = -cursor._index
+        while segment is not None:
+            count += len(segment)
+            segment = segment._next
+        return count
+
+    def append(self, value):
+        segment = self._tail
+        if len(segment) >= self.max_segment_size:
+            tail = QueueSegment()
+            segment._seal(tail)
+            checkout(self)
+            self._tail = segment = tail
+
+        checkout(segment)
+        segment.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def popleft(self):
+        cursor = self._head
+        segment = cursor._segment
+        index = cursor._index
+        while index == len(segment):
+            segment = segment._next
+            if segment is None:
+                raise IndexError("pop from an empty queue")
+            index = 0
+
+        value = segment[index]
+        checkout(cursor)
+        cursor._segment = segment
+        cursor._index = index + 1
+        return value
+
+
+def local_container_class(obj, local_cls, items, d):
+    """Return local class for a container object whose entries are
+    provided by the working copy ``items``."""
+
+    cls = obj.__class__
+    d = {'_p_class': cls, '_p_items': items, '__dict__': d}
+
+    # copy container methods
+    for key in items._p_methods:
+        d[key] = staticmethod(getattr(items, key))
+
+    # defining comparison methods would otherwise make the class
+    # unhashable
+    d['__hash__'] = Persistent.__hash__
+
+    add_class_properties(cls, local_cls, d)
+    return LocalType("Local%s" % cls.__name__, (cls, local_cls), d)
 
 
 class PersistentFile(object):
@@ -215,7 +1188,88 @@ class PersistentFile(object):
         return self.stream.read(size)
 
 
-class Local(Persistent):
+class PersistentArray(object):
+    """Persistent array of numbers.
+
+    Pass an ``array.array`` (or a sequence of numbers and a type code)
+    to persist it in the database. The data is written to the
+    transaction log as a raw buffer; when read from the database, the
+    array is backed by a read-only memory view over the (memory-mapped)
+    database file --- there's no unpickling and no copying.
+
+    :param data: array or sequence of numbers
+
+    :param typecode: numeric type code (see the ``array`` module)
+
+    Arrays are values; to change the data, assign a new array.
+    """
+
+    def __init__(self, data, typecode='d'):
+        if not isinstance(data, array.array):
+            data = array.array(typecode, data)
+        if data.typecode not in ARRAY_TYPECODES:
+            raise ValueError(
+                "Can't persist array of type code %r." % data.typecode)
+        self.data = data
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "<%s.%s typecode=%r length=%d at 0x%x>" % (
+            type(self).__module__, type(self).__name__,
+            self.typecode, len(self), id(self))
+
+    @property
+    def typecode(self):
+        return self.data.typecode
+
+    def numpy(self):
+        """Return a NumPy array which shares the data (requires
+        NumPy)."""
+
+        import numpy
+        return numpy.frombuffer(self.data, dtype=self.typecode)
+
+    def tolist(self):
+        return self.data.tolist()
+
+
+class LocalType(type):
+    """Metaclass of the classes which an object gets while it's
+    checked out (or broken, or a ghost).
+
+    The first base is the class of the object such that the two
+    classes have the same layout (a requirement for the class
+    assignment); the methods of the second base take precedence.
+    """
+
+    def __new__(metacls, name, bases, d):
+        # a class of an object without an instance dictionary must
+        # not add one
+        if not bases[0].__dictoffset__:
+            d = dict(d, __slots__=())
+        return type.__new__(metacls, name, bases, d)
+
+    def mro(cls):
+        if len(cls.__bases__) != 2:
+            return type.mro(cls)
+        shared, local = cls.__bases__
+        return (cls, ) + tuple(
+            base for base in local.__mro__ if base not in shared.__mro__
+            ) + shared.__mro__
+
+
+class Local(PersistentBase):
     """Persistent object with thread-local state.
 
     Changes can be made to the instance ``__dict__`` or any other way
@@ -245,6 +1299,8 @@ class Local(Persistent):
     case.
     """
 
+    __slots__ = ()
+
     _p_jar = property(lambda self: self._p_state.get('_p_jar'))
     _p_oid = property(lambda self: self._p_state.get('_p_oid'))
     _p_serial = property(lambda self: self._p_state.get('_p_serial'))
@@ -256,6 +1312,9 @@ class Local(Persistent):
     def __oldstate__(self):
         return self.__dict__.__oldstate__()
 
+    def __savedstate__(self):
+        return self.__dict__.__savedstate__()
+
     def __setstate__(self, new_state={}):
         self.__dict__.__setstate__(new_state)
 
@@ -264,6 +1323,12 @@ class Local(Persistent):
             return self.__dict__[key]
         except KeyError:
             raise AttributeError(key)
+        except AttributeError:
+            # the object was checked in by another thread in the
+            # meantime (a compact object then has no ``__dict__``)
+            if isinstance(self, Local):
+                raise
+            return getattr(self, key)
 
     def __setattr__(self, key, value):
         if key.startswith('_p_') or key.startswith('__'):
@@ -272,39 +1337,187 @@ class Local(Persistent):
             self.__dict__[key] = value
 
     def _p_checkin(self):
-        _ci_lock.acquire()
+        lock = object_lock(self)
+        lock.acquire()
         try:
-            setattr(self, '__class__', self._p_class)
-            setattr(self, '__dict__', self._p_state)
+            cls = self._p_class
+            state = self._p_state
+
+            # the slots of an object without an instance dictionary
+            # are set before it gets its shared class (the local class
+            # masks them)
+            if not cls.__dictoffset__:
+                for key in slot_names(cls):
+                    value = state.get(key, MARKER)
+                    if value is not MARKER:
+                        getattr(cls, key).__set__(self, value)
+                setattr(self, '__class__', cls)
+                return
+
+            setattr(self, '__class__', cls)
+            setattr(self, '__dict__', state)
+
+            slots = slot_names(cls)
+            if slots:
+                for key in slots:
+                    value = state.get(key, MARKER)
+                    if value is not MARKER:
+                        setattr(self, key, value)
+                        del state[key]
+                if not state:
+                    delattr(self, '__dict__')
         finally:
-            _ci_lock.release()
+            lock.release()
 
     def _p_checkout(self):
         self.__dict__.__init__()
         sync(self)
 
+    def _p_memory(self):
+        """Return the number of working copies of the object and their
+        estimated size (in bytes), and the same for the changesets
+        they keep.
+
+        The size of the working copies includes the local class of
+        the object.
+        """
+
+        cls = type(self)
+        copies_size = sys.getsizeof(cls) + sys.getsizeof(dict(cls.__dict__))
+        copies_size += sum(
+            sys.getsizeof(value) for value in cls.__dict__.values())
+
+        copies = changes = changes_size = 0
+        for wc in (self.__dict__, getattr(self, '_p_items', None)):
+            if wc is None:
+                continue
+            copies_size += sys.getsizeof(wc) + sys.getsizeof(wc._p_active)
+            for timestamp, d in tuple(wc._p_active.values()):
+                if timestamp is not None:
+                    copies += 1
+                copies_size += _sizeof(d, set())
+            changes += len(wc._p_changes)
+            changes_size += _sizeof(wc._p_changes, set())
+        return copies, copies_size, changes, changes_size
+
+    def _p_merge(self, start):
+        return self.__dict__._p_merge(start)
+
+    def _p_pending(self):
+        return self.__dict__._p_pending()
+
+    def _p_refresh(self):
+        self.__dict__._p_reset()
+
+    def _p_release(self):
+        self.__dict__._p_release()
+
+    def _p_sizeof(self):
+        seen = set((id(self), id(self._p_jar)))
+        size = sys.getsizeof(self) + _sizeof_items(self, seen)
+        return size + _sizeof_attrs(self._p_state, seen)
+
+    def _p_stats(self):
+        """Return the number of changesets kept by the working copies
+        of the object and the number of transactions which use them."""
+
+        changes = active = 0
+        for wc in (self.__dict__, getattr(self, '_p_items', None)):
+            if wc is None:
+                continue
+            changes += len(wc._p_changes)
+            for timestamp, d in tuple(wc._p_active.values()):
+                if timestamp is not None:
+                    active += 1
+        return changes, active
+
+    def _p_update(self, new_state, timestamp):
+        self.__dict__._p_update(new_state, timestamp)
+
+
+class LocalContainer(Local):
+    """Persistent container with thread-local state.
+
+    The entries are provided by a separate working copy (``_p_items``);
+    the state is a tuple of attributes and entries.
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return self.__dict__.__getstate__(), self._p_items.__getstate__()
+
+    def __oldstate__(self):
+        return self.__dict__.__oldstate__(), self._p_items.__oldstate__()
+
+    def __savedstate__(self):
+        return (
+            self.__dict__.__savedstate__(),
+            self._p_items.__savedstate__()
+            )
+
+    def __setstate__(self, updated=None):
+        if updated is None:
+            updated = {}, ()
+        new_state, new_items = updated
+        self.__dict__.__setstate__(new_state)
+        self._p_items.__setstate__(new_items)
+
+    def _p_merge(self, start):
+        return (
+            self.__dict__._p_merge(start),
+            self._p_items._p_merge(start)
+            )
+
+    def _p_pending(self):
+        return self.__dict__._p_pending() or self._p_items._p_pending()
+
+    def _p_refresh(self):
+        self.__dict__._p_reset()
+        self._p_items._p_reset()
+
+    def _p_release(self):
+        self.__dict__._p_release()
+        self._p_items._p_release()
+
+    def _p_update(self, updated, timestamp):
+        new_state, new_items = updated
+        self.__dict__._p_update(new_state, timestamp)
+        self._p_items._p_update(new_items, timestamp)
+
+
+class LocalDict(LocalContainer, PersistentDict):
+    """Persistent dictionary with thread-local state."""
+
+
+class LocalList(LocalContainer, PersistentList):
+    """Persistent list with thread-local state."""
+
 
-class LocalDict(Local, PersistentDict):
-    """Persistent dictionary with thread-local state."""
+class LocalSet(LocalContainer, PersistentSet):
+    """Persistent set with thread-local state."""
 
-    def __getstate__(self):
-        return self.__dict__.__getstate__(), self._p_items.__getstate__()
 
-    def __setstate__(self, updated=None):
-        if updated is None:
-            updated = {}, {}
-        new_state, new_items = updated
-        self.__dict__.__setstate__(new_state)
-        self._p_items.__setstate__(new_items)
+class LocalAccumulator(LocalContainer, PersistentAccumulator):
+    """Persistent accumulator with thread-local state."""
+
+    @property
+    def value(self):
+        return self._p_items._p_snapshot()[0]
 
 
-class Broken(Persistent):
+class Broken(PersistentBase):
     """Broken object.
 
     When a persistent object references another persistent object
     which hasn't yet been loaded, it gets this superclass.
     """
 
+    __slots__ = ()
+
+    # broken subclasses are created once per class
+    _p_classes = {}
+
     def __new__(cls, oid, obj_class):
         for base in reversed(obj_class.mro()):
             try:
@@ -314,8 +1527,12 @@ class Broken(Persistent):
                 pass
         else:
             raise
-        cls = type(cls.__name__, (cls, obj_class), {})
-        setattr(inst, "__class__", cls)
+        try:
+            broken = cls._p_classes[obj_class]
+        except KeyError:
+            broken = cls._p_classes[obj_class] = LocalType(
+                cls.__name__, (obj_class, cls), {})
+        setattr(inst, "__class__", broken)
         return inst
 
     def __init__(self, oid, cls):
@@ -340,8 +1557,8 @@ class WorkingCopyDict(threading.local):
             for key in change:
                 if key not in exclude:
                     value = change[key]
-                    key = copy.deepcopy(key)
-                    value = copy.deepcopy(value)
+                    key = _deepcopy(key)
+                    value = _deepcopy(value)
                     local[key] = value
 
     def __new__(cls, d):
@@ -389,7 +1606,9 @@ class WorkingCopyDict(threading.local):
         shared = self._p_dict
         if not contains_item(local, EMPTY):
             value = getitem(shared, key)
-            new_value = copy.deepcopy(value)
+            if sync.read_only:
+                return value
+            new_value = _deepcopy(value)
             if value is not new_value:
                 local[key] = new_value
             return new_value
@@ -400,73 +1619,195 @@ class WorkingCopyDict(threading.local):
         self.__dict__[key] = value
 
     def __iter__(self):
-        # first iterate over local entries; we record each entry so
+        # first iterate over local entries; we record each entry to
         # avoid duplicates when later iterating over shared entries
-        keys = []
-        for key, value in self.__dict__.items():
-            if key is IGNORE:
+        local = self.__dict__
+        seen = set()
+        for key, value in tuple(local.items()):
+            if key is EMPTY:
                 continue
-            if key is not DELETE:
+            if value is not DELETE:
                 yield key
-            keys.append(key)
+            seen.add(key)
+
+        if contains_item(local, EMPTY):
+            return
 
-        for key in dict.__iter__(self._p_dict):
-            if key not in keys:
+        if sync.read_only:
+            for key in tuple(dict.__iter__(self._p_dict)):
+                if key not in seen:
+                    yield key
+            return
+
+        for key in tuple(dict.__iter__(self._p_dict)):
+            if key not in seen:
                 # deep-copy the key; if it's not the same object, we
                 # set it on the local copy, with a marker value
-                new_key = copy.deepcopy(key)
+                new_key = _deepcopy(key)
                 if new_key is not key:
                     self[new_key] = IGNORE
                 yield new_key
 
+    def __len__(self):
+        local = self.__dict__
+        cleared = contains_item(local, EMPTY)
+        shared = self._p_dict
+        count = 0 if cleared else dict.__len__(shared)
+        for key, value in local.items():
+            if key is EMPTY or value is IGNORE:
+                continue
+            exists = not cleared and contains_item(shared, key)
+            if value is DELETE:
+                count -= exists
+            elif not exists:
+                count += 1
+        return count
+
     def __getstate__(self):
         return self
 
     def __oldstate__(self):
-        local = self._p_dict.copy()
-        changes = {}
-        self._p_apply(None, changes)
-        local.update(changes)
-        return local
+        state = dict.copy(self._p_dict)
+        start = self._p_start()
+        if start is not None:
+            changes = {}
+            self._p_apply(start, changes)
+            for key, value in changes.items():
+                if value is DELETE:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+        return state
+
+    def __savedstate__(self):
+        return dict.copy(self._p_dict)
 
     def __reduce__(self):
         return dict, (self.__dict__,)
 
     def __setstate__(self, new_state):
+        self._p_commit(new_state, sync.timestamp)
+        self._p_release()
+
+        # apply changeset immediately
+        local = self.__dict__
+        for timestamp, d in tuple(self._p_active.values()):
+            if d is not local and timestamp is not None:
+                self._p_apply(timestamp, d)
+
+    def _p_commit(self, new_state, timestamp):
         # if the state is a working copy dictionary, we just use the
         # local entries (see the ``__reduce__`` method)
         if isinstance(new_state, WorkingCopyDict):
             new_state = new_state.__dict__
 
-        if new_state:
-            change = {}
-            shared = self._p_dict
+        if not new_state:
+            return
+
+        change = {}
+        shared = self._p_dict
 
-            if EMPTY in new_state:
-                change.update(shared)
-                dict.clear(shared)
+        if EMPTY in new_state:
+            change.update(shared)
+            dict.clear(shared)
 
-            for key, value in new_state.items():
-                if value is IGNORE:
-                    continue
+        for key, value in new_state.items():
+            if key is EMPTY or value is IGNORE:
+                continue
 
-                change[key] = dict.get(shared, key, DELETE)
+            change[key] = dict.get(shared, key, DELETE)
 
-                if value is DELETE:
+            if value is DELETE:
+                if contains_item(shared, key):
                     delitem(shared, key)
-                elif value is not IGNORE:
-                    setitem(shared, key, value)
+            else:
+                setitem(shared, key, value)
+
+        self._p_changes.append((timestamp, change))
+
+    def _p_merge(self, start):
+        """Return the local changeset if it's disjoint from the changes
+        committed since ``start``; otherwise, raise ``ConflictError``.
+
+        Local entries which merely hold the original value of a key
+        (e.g. a copy made when it was read) are left out; a key which
+        has been changed on both sides is not a conflict if the values
+        are equal.
+        """
+
+        local = self.__dict__
+        if contains_item(local, EMPTY):
+            raise ConflictError(self)
+
+        # the first reverse change recorded for a key gives its value
+        # at the time the transaction began
+        original = {}
+        for timestamp, change in tuple(self._p_changes):
+            if timestamp < start:
+                continue
+            for key, value in change.items():
+                original.setdefault(key, value)
+
+        shared = self._p_dict
+        changes = {}
+        for key, value in local.items():
+            if value is IGNORE:
+                continue
+            if key in original:
+                if _equals(value, original[key]):
+                    continue
+                if _equals(value, dict.get(shared, key, DELETE)):
+                    continue
+                raise ConflictError(self)
+            changes[key] = value
+
+        return changes
+
+    def _p_pending(self):
+        """Return true if a thread has an on-going transaction with
+        uncommitted changes."""
+
+        for timestamp, d in tuple(self._p_active.values()):
+            if timestamp is None:
+                continue
+            for value in tuple(d.values()):
+                if value is not IGNORE:
+                    return True
 
-            self._p_changes.append((sync.timestamp, change))
+        return False
+
+    def _p_release(self):
+        """Discard the local copy of this thread and mark the thread
+        as inactive."""
 
         local = self.__dict__
         local.clear()
         self._p_active[id(local)] = None, local
 
-        # apply changeset immediately
-        for timestamp, d in self._p_active.values():
-            if d is not local:
-                self._p_apply(timestamp, d)
+    def _p_reset(self):
+        """Discard the local copy of this thread and catch up on
+        changes committed since."""
+
+        local = self.__dict__
+        local.clear()
+        self.__init__()
+
+    def _p_start(self):
+        timestamp, d = self._p_active.get(id(self.__dict__), (None, None))
+        return timestamp
+
+    def _p_update(self, new_state, timestamp):
+        """Apply a changeset which was committed elsewhere.
+
+        Unlike ``__setstate__``, the local copies (including that of
+        the current thread) are preserved.
+        """
+
+        self._p_commit(new_state, timestamp)
+
+        for start, d in tuple(self._p_active.values()):
+            if start is not None:
+                self._p_apply(start, d)
 
     def clear(self):
         local = self.__dict__
@@ -493,7 +1834,7 @@ class WorkingCopyDict(threading.local):
         return key in self
 
     def items(self):
-        return [(key, self[key]) for key in self]
+        return ItemsView(self)
 
     def iteritems(self):
         return ((key, self[key]) for key in self)
@@ -505,7 +1846,7 @@ class WorkingCopyDict(threading.local):
         return (self[key] for key in self)
 
     def keys(self):
-        return [key for key in self]
+        return KeysView(self)
 
     def pop(self, key, default=MARKER):
         shared = self._p_dict
@@ -546,7 +1887,578 @@ class WorkingCopyDict(threading.local):
             self[key] = value
 
     def values(self):
-        return [self[key] for key in self]
+        return ValuesView(self)
+
+
+class WorkingCopyLog(threading.local):
+    """Working copy of a container whose changes are recorded as a log
+    of operations.
+
+    Each thread records the operations it makes. The local view of
+    the container is computed on demand from the shared state by
+    undoing the changes committed since the transaction began (and
+    then replaying the local operations).
+
+    Subclasses must implement the ``_p_perform`` method which applies
+    an operation and returns the operation which undoes it, and the
+    ``_p_commutes`` method which determines if local operations can
+    be merged with changes committed by a concurrent transaction.
+    """
+
+    __slots__ = '_p_shared', '_p_changes', '_p_active'
+
+    _p_methods = ()
+    _p_type = None
+
+    def __new__(cls, shared):
+        inst = threading.local.__new__(cls)
+        threading.local.__setattr__(inst, '_p_shared', shared)
+        threading.local.__setattr__(inst, '_p_active', {})
+        threading.local.__setattr__(inst, '_p_changes', [])
+        return inst
+
+    def __init__(self, *args):
+        self._p_ops = []
+        self._p_data = None
+
+        local = self.__dict__
+        self._p_active[id(local)] = sync.timestamp, local
+
+    def __getstate__(self):
+        return self
+
+    def __oldstate__(self):
+        return self._p_snapshot(False)
+
+    def __reduce__(self):
+        return list, (self._p_ops, )
+
+    def __savedstate__(self):
+        return self._p_type.copy(self._p_shared)
+
+    def __setstate__(self, ops):
+        self._p_commit(ops, sync.timestamp)
+        self._p_release()
+
+    def _p_commit(self, ops, timestamp):
+        # if the state is a working copy, we use the local operations
+        # (see the ``__reduce__`` method)
+        if isinstance(ops, WorkingCopyLog):
+            ops = ops._p_ops
+
+        if not ops:
+            return
+
+        lock = object_lock(self._p_shared)
+        lock.acquire()
+        try:
+            undo = [self._p_perform(self._p_shared, op) for op in ops]
+            undo.reverse()
+            self._p_changes.append((timestamp, undo))
+        finally:
+            lock.release()
+
+    def _p_copy(self, value):
+        if sync.read_only:
+            return value
+        return _deepcopy(value)
+
+    def _p_merge(self, start):
+        """Return the local operations if they commute with the changes
+        committed since ``start``; otherwise, raise ``ConflictError``.
+        """
+
+        foreign = []
+        for timestamp, undo in tuple(self._p_changes):
+            if timestamp >= start:
+                foreign.extend(undo)
+
+        if foreign and not self._p_commutes(self._p_ops, foreign):
+            raise ConflictError(self)
+
+        return list(self._p_ops)
+
+    def _p_pending(self):
+        for timestamp, local in tuple(self._p_active.values()):
+            if timestamp is not None and local.get('_p_ops'):
+                return True
+        return False
+
+    def _p_record(self, op):
+        self._p_ops.append(op)
+        data = self._p_data
+        if data is not None:
+            self._p_perform(data, op)
+
+    def _p_release(self):
+        self._p_ops = []
+        self._p_data = None
+
+        local = self.__dict__
+        self._p_active[id(local)] = None, local
+
+    def _p_reset(self):
+        self.__init__()
+
+    def _p_snapshot(self, local=True):
+        """Return the container as seen by this thread (or as it was
+        when the transaction began, if ``local`` is false)."""
+
+        data = self._p_data
+        if data is not None and local:
+            return data
+
+        shared = self._p_shared
+        start = self._p_active.get(id(self.__dict__), (None, None))[0]
+
+        lock = object_lock(shared)
+        lock.acquire()
+        try:
+            data = self._p_type.copy(shared)
+            if start is not None:
+                for timestamp, undo in reversed(self._p_changes):
+                    if timestamp >= start:
+                        for op in undo:
+                            self._p_perform(data, op)
+        finally:
+            lock.release()
+
+        if local:
+            for op in self._p_ops:
+                self._p_perform(data, op)
+            self._p_data = data
+
+        return data
+
+    def _p_update(self, ops, timestamp):
+        """Apply operations which were committed elsewhere."""
+
+        self._p_commit(ops, timestamp)
+
+
+class WorkingCopyList(WorkingCopyLog):
+    """Working copy of a list.
+
+    Appending entries is recorded as an ``extend`` operation; all
+    other changes are recorded as a ``splice`` operation which
+    replaces a range of entries.
+    """
+
+    __slots__ = ()
+
+    _p_methods = (
+        '__add__', '__contains__', '__delitem__', '__eq__', '__ge__',
+        '__getitem__', '__gt__', '__iadd__', '__imul__', '__iter__',
+        '__le__', '__len__', '__lt__', '__mul__', '__ne__',
+        '__reversed__', '__rmul__', '__setitem__', 'append', 'clear',
+        'copy', 'count', 'extend', 'index', 'insert', 'pop', 'remove',
+        'reverse', 'sort',
+        )
+
+    _p_type = list
+
+    @staticmethod
+    def _p_commutes(ops, foreign):
+        # appends commute only with appends (which are undone by
+        # truncating the list)
+        for op in ops:
+            if op[0] != 'extend':
+                return False
+        for op in foreign:
+            if op[0] != 'truncate':
+                return False
+        return True
+
+    @staticmethod
+    def _p_perform(target, op):
+        name = op[0]
+        if name == 'extend':
+            length = list.__len__(target)
+            list.extend(target, op[1])
+            return 'truncate', length
+        if name == 'truncate':
+            index = slice(op[1], None)
+            removed = list.__getitem__(target, index)
+            list.__delitem__(target, index)
+            return 'extend', removed
+        if name == 'splice':
+            name, start, stop, values = op
+            index = slice(start, stop)
+            removed = list.__getitem__(target, index)
+            list.__setitem__(target, index, values)
+            return 'splice', start, start + len(values), removed
+        raise ValueError("Unknown operation: %s." % name)
+
+    def _p_index(self, data, index):
+        length = len(data)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("list index out of range")
+        return index
+
+    def _p_replace(self, values):
+        data = self._p_snapshot()
+        self._p_record(('splice', 0, len(data), list(values)))
+
+    def __add__(self, other):
+        return self._p_copy(self._p_snapshot() + list(other))
+
+    def __contains__(self, value):
+        return value in self._p_snapshot()
+
+    def __delitem__(self, index):
+        data = self._p_snapshot()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(data))
+            if step == 1:
+                self._p_record(('splice', start, max(start, stop), []))
+            else:
+                data = list(data)
+                del data[index]
+                self._p_replace(data)
+        else:
+            index = self._p_index(data, index)
+            self._p_record(('splice', index, index + 1, []))
+
+    def __eq__(self, other):
+        return self._p_snapshot() == other
+
+    def __ge__(self, other):
+        return self._p_snapshot() >= other
+
+    def __getitem__(self, index):
+        return self._p_copy(self._p_snapshot()[index])
+
+    def __gt__(self, other):
+        return self._p_snapshot() > other
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self._p_shared
+
+    def __imul__(self, count):
+        self._p_replace(self._p_snapshot() * count)
+        return self._p_shared
+
+    def __iter__(self):
+        data = self._p_snapshot()
+        if sync.read_only:
+            return iter(data)
+        return (_deepcopy(value) for value in data)
+
+    def __le__(self, other):
+        return self._p_snapshot() <= other
+
+    def __len__(self):
+        return len(self._p_snapshot())
+
+    def __lt__(self, other):
+        return self._p_snapshot() < other
+
+    def __mul__(self, count):
+        return self._p_copy(self._p_snapshot() * count)
+
+    def __ne__(self, other):
+        return self._p_snapshot() != other
+
+    def __reversed__(self):
+        data = self._p_snapshot()
+        return (self._p_copy(value) for value in reversed(data))
+
+    __rmul__ = __mul__
+
+    def __setitem__(self, index, value):
+        data = self._p_snapshot()
+        if isinstance(index, slice):
+            value = list(value)
+            start, stop, step = index.indices(len(data))
+            if step == 1:
+                self._p_record(('splice', start, max(start, stop), value))
+            else:
+                data = list(data)
+                data[index] = value
+                self._p_replace(data)
+        else:
+            index = self._p_index(data, index)
+            self._p_record(('splice', index, index + 1, [value]))
+
+    def append(self, value):
+        self._p_record(('extend', [value]))
+
+    def clear(self):
+        self._p_replace(())
+
+    def copy(self):
+        return self._p_copy(list(self._p_snapshot()))
+
+    def count(self, value):
+        return self._p_snapshot().count(value)
+
+    def extend(self, values):
+        values = list(values)
+        if values:
+            self._p_record(('extend', values))
+
+    def index(self, value, *args):
+        return self._p_snapshot().index(value, *args)
+
+    def insert(self, index, value):
+        length = len(self._p_snapshot())
+        if index < 0:
+            index = max(0, index + length)
+        else:
+            index = min(index, length)
+        self._p_record(('splice', index, index, [value]))
+
+    def pop(self, index=-1):
+        data = self._p_snapshot()
+        if not data:
+            raise IndexError("pop from empty list")
+        index = self._p_index(data, index)
+        value = data[index]
+        self._p_record(('splice', index, index + 1, []))
+        return self._p_copy(value)
+
+    def remove(self, value):
+        index = self._p_snapshot().index(value)
+        self._p_record(('splice', index, index + 1, []))
+
+    def reverse(self):
+        self._p_replace(reversed(self._p_snapshot()))
+
+    def sort(self, **kwargs):
+        data = list(self._p_snapshot())
+        data.sort(**kwargs)
+        self._p_replace(data)
+
+
+class WorkingCopySet(WorkingCopyLog):
+    """Working copy of a set.
+
+    Changes are recorded as ``add`` and ``discard`` operations.
+    """
+
+    __slots__ = ()
+
+    _p_methods = (
+        '__and__', '__contains__', '__eq__', '__ge__', '__gt__',
+        '__iand__', '__ior__', '__isub__', '__iter__', '__ixor__',
+        '__le__', '__len__', '__lt__', '__ne__', '__or__', '__rand__',
+        '__ror__', '__rsub__', '__rxor__', '__sub__', '__xor__', 'add',
+        'clear', 'copy', 'difference', 'difference_update', 'discard',
+        'intersection', 'intersection_update', 'isdisjoint',
+        'issubset', 'issuperset', 'pop', 'remove',
+        'symmetric_difference', 'symmetric_difference_update', 'union',
+        'update',
+        )
+
+    _p_type = set
+
+    @staticmethod
+    def _p_commutes(ops, foreign):
+        added = set()
+        discarded = set()
+        for name, values in ops:
+            if name == 'add':
+                added.update(values)
+            else:
+                discarded.update(values)
+
+        # the foreign operations undo the committed changes; elements
+        # which were added are discarded and vice versa
+        for name, values in foreign:
+            if name == 'add':
+                if not added.isdisjoint(values):
+                    return False
+            elif not discarded.isdisjoint(values):
+                return False
+
+        return True
+
+    @staticmethod
+    def _p_perform(target, op):
+        name, values = op
+        if name == 'add':
+            added = [value for value in values
+                     if not set.__contains__(target, value)]
+            set.update(target, added)
+            return 'discard', added
+        if name == 'discard':
+            removed = [value for value in values
+                       if set.__contains__(target, value)]
+            set.difference_update(target, removed)
+            return 'add', removed
+        raise ValueError("Unknown operation: %s." % name)
+
+    def __and__(self, other):
+        return self._p_snapshot() & other
+
+    def __contains__(self, value):
+        return value in self._p_snapshot()
+
+    def __eq__(self, other):
+        return self._p_snapshot() == other
+
+    def __ge__(self, other):
+        return self._p_snapshot() >= other
+
+    def __gt__(self, other):
+        return self._p_snapshot() > other
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self._p_shared
+
+    def __ior__(self, other):
+        self.update(other)
+        return self._p_shared
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self._p_shared
+
+    def __iter__(self):
+        return iter(self._p_snapshot())
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self._p_shared
+
+    def __le__(self, other):
+        return self._p_snapshot() <= other
+
+    def __len__(self):
+        return len(self._p_snapshot())
+
+    def __lt__(self, other):
+        return self._p_snapshot() < other
+
+    def __ne__(self, other):
+        return self._p_snapshot() != other
+
+    def __or__(self, other):
+        return self._p_snapshot() | other
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __rsub__(self, other):
+        return other - self._p_snapshot()
+
+    def __sub__(self, other):
+        return self._p_snapshot() - other
+
+    def __xor__(self, other):
+        return self._p_snapshot() ^ other
+
+    __rxor__ = __xor__
+
+    def add(self, value):
+        self._p_record(('add', [value]))
+
+    def clear(self):
+        self._p_record(('discard', list(self._p_snapshot())))
+
+    def copy(self):
+        return set(self._p_snapshot())
+
+    def difference(self, *others):
+        return self._p_snapshot().difference(*others)
+
+    def difference_update(self, *others):
+        for other in others:
+            self._p_record(('discard', list(other)))
+
+    def discard(self, value):
+        self._p_record(('discard', [value]))
+
+    def intersection(self, *others):
+        return self._p_snapshot().intersection(*others)
+
+    def intersection_update(self, *others):
+        data = self._p_snapshot()
+        self._p_record(('discard', list(data - data.intersection(*others))))
+
+    def isdisjoint(self, other):
+        return self._p_snapshot().isdisjoint(other)
+
+    def issubset(self, other):
+        return self._p_snapshot().issubset(other)
+
+    def issuperset(self, other):
+        return self._p_snapshot().issuperset(other)
+
+    def pop(self):
+        for value in self._p_snapshot():
+            self.discard(value)
+            return value
+        raise KeyError("pop from an empty set")
+
+    def remove(self, value):
+        if value not in self._p_snapshot():
+            raise KeyError(value)
+        self.discard(value)
+
+    def symmetric_difference(self, other):
+        return self._p_snapshot().symmetric_difference(other)
+
+    def symmetric_difference_update(self, other):
+        data = self._p_snapshot()
+        other = set(other)
+        discarded = list(data & other)
+        added = list(other - data)
+        self._p_record(('discard', discarded))
+        self._p_record(('add', added))
+
+    def union(self, *others):
+        return self._p_snapshot().union(*others)
+
+    def update(self, *others):
+        for other in others:
+            values = list(other)
+            if values:
+                self._p_record(('add', values))
+
+
+class WorkingCopyAccumulator(WorkingCopyLog):
+    """Working copy of an accumulator.
+
+    The shared value is kept in a single-item list (the cell); changes
+    are recorded as an ``add`` operation with the combined delta.
+    """
+
+    __slots__ = '_p_owner',
+
+    _p_methods = 'add',
+    _p_type = list
+
+    def __new__(cls, cell, owner):
+        inst = WorkingCopyLog.__new__(cls, cell)
+        threading.local.__setattr__(inst, '_p_owner', owner)
+        return inst
+
+    @staticmethod
+    def _p_commutes(ops, foreign):
+        return True
+
+    def _p_perform(self, target, op):
+        name, delta = op
+        owner = self._p_owner
+        target[0] = owner._p_combine(target[0], delta)
+        return name, owner._p_inverse(delta)
+
+    def add(self, delta):
+        ops = self._p_ops
+        if not ops:
+            return self._p_record(('add', delta))
+
+        # combine with the pending delta
+        name, pending = ops[-1]
+        ops[-1] = name, self._p_owner._p_combine(pending, delta)
+        data = self._p_data
+        if data is not None:
+            self._p_perform(data, ('add', delta))
 
 
 class Synchronizer(threading.local):
@@ -562,14 +2474,25 @@ class Synchronizer(threading.local):
     When a transaction is begun, the timestamp is recorded
     (``sync.timestamp``).
 
-    When a transaction is about to be committed, the timestamp is
-    updated.
+    When a transaction is committed, the timestamp is updated (see
+    ``commit_timestamp``). Until the transaction is done, it's
+    pending; a transaction which is begun in the meantime gets a
+    timestamp no later than that of the pending transaction (it must
+    not see the changes, which are not yet applied, as committed
+    before it began).
 
     When a transaction is committed, it is asserted that there are no
     unconnected objects.
 
     When a transaction ends, we determine if any connected objects can
-    return to shared state.
+    return to shared state; an object which another thread has
+    checked out in its on-going transaction remains connected (it may
+    not yet have local changes).
+
+    The ``read_only`` flag is set for the duration of a read-only
+    transaction (see the ``read_only`` context manager), and the
+    ``bulk`` flag during a bulk load (see the ``bulk`` context
+    manager).
 
     The synchronizer provides a sorting key that makes sure it is
     visited last in each transaction phase.
@@ -581,7 +2504,11 @@ class Synchronizer(threading.local):
         __slots__ += ("__weakref__", )
 
     timestamp = None
+    read_only = False
+    bulk = False
     _tx_start = weakref.WeakKeyDictionary()
+    _tx_commit = weakref.WeakKeyDictionary()
+    _tx_objects = weakref.WeakKeyDictionary()
     _tx_lock = threading.Lock()
 
     def __new__(cls):
@@ -603,39 +2530,153 @@ class Synchronizer(threading.local):
         thread = threading.current_thread()
         self._tx_start[thread] = self.timestamp
 
+        objects = self._tx_objects.get(thread)
+        if objects is None:
+            self._tx_lock.acquire()
+            try:
+                objects = self._tx_objects.setdefault(thread, set())
+            finally:
+                self._tx_lock.release()
+        objects.add(obj)
+
     def abort(self, tx):
         pass
 
     def afterCompletion(self, tx):
         connected = self._connected
+        thread = threading.current_thread()
+        self._tx_start[thread] = None
+
+        self._tx_lock.acquire()
+        try:
+            active = tuple(connected)
+            self._tx_objects.pop(thread, None)
+        finally:
+            self._tx_lock.release()
 
+        # local copies which are left over from the transaction are
+        # discarded; uncommitted changes are lost at this point
+        for obj in active:
+            lock = object_lock(obj)
+            lock.acquire()
+            try:
+                if isinstance(obj, Local):
+                    obj._p_release()
+            finally:
+                lock.release()
+
+        # the global lock is held only while we compute the earliest
+        # transaction timestamp and the candidate objects; the objects
+        # are checked in using their individual locks
         self._tx_lock.acquire()
         try:
-            # compute earliest and latest transaction timestamp
             timestamps = tuple(filter(None, self._tx_start.values()))
             earliest = min(timestamps) if timestamps else None
 
-            reconnect = set()
-            while connected:
-                obj = connected.pop()
-
-                # check if the earliest transaction began after the last
-                # change was committed to the object
+            checkin = []
+            for obj in tuple(connected):
+                # check if the earliest transaction began after the
+                # last change was committed to the object
                 last = obj._p_serial
-                if earliest is None or last is not None and earliest >= last:
-                    obj._p_checkin()
-                else:
-                    reconnect.add(obj)
-
-            connected |= reconnect
+                if earliest is None or last is not None and earliest > last:
+                    # another thread may have changes which are not
+                    # yet committed
+                    if obj._p_pending():
+                        continue
+                    checkin.append((obj, last))
         finally:
             self._tx_lock.release()
 
+        for obj, last in checkin:
+            lock = object_lock(obj)
+            lock.acquire()
+            try:
+                # the object remains connected until it's checked in
+                # (other threads must release and refresh their local
+                # copies); skip objects that were checked in, changed
+                # or checked out again while we were not holding the
+                # lock
+                self._tx_lock.acquire()
+                try:
+                    if not isinstance(obj, Local) or \
+                           obj._p_serial != last or obj._p_pending() or \
+                           any(obj in objects for objects
+                               in self._tx_objects.values()):
+                        continue
+                    connected.discard(obj)
+                finally:
+                    self._tx_lock.release()
+
+                obj._p_checkin()
+            finally:
+                lock.release()
+
         self._unconnected.clear()
-        self._tx_start[threading.current_thread()] = None
+
+        # the next transaction may be begun implicitly (without
+        # notification); it gets a new timestamp, too
+        self._tx_lock.acquire()
+        try:
+            self._tx_commit.pop(thread, None)
+            self.timestamp = self._begin()
+        finally:
+            self._tx_lock.release()
+
+    def _after_fork(self):
+        # the other threads of the parent process don't exist in the
+        # child process; their locks may be held
+        cls = type(self)
+        cls._tx_lock = threading.Lock()
+        thread = threading.current_thread()
+        for d in (self._tx_start, self._tx_commit, self._tx_objects):
+            for key in tuple(d.keys()):
+                if key is not thread:
+                    del d[key]
+
+    def _begin(self):
+        # must be called with the transaction lock held
+        timestamp = make_timestamp()
+        pending = tuple(self._tx_commit.values())
+        if pending:
+            timestamp = min(timestamp, min(pending))
+        return timestamp
+
+    def commit_timestamp(self):
+        """Return the commit timestamp of the transaction of this
+        thread; the transaction is pending until it's done.
+
+        The timestamp is taken while the commit lock is held (see
+        ``Manager._commit``), such that it's later than the timestamp
+        of any change which has been applied; a transaction which is
+        begun in the meantime is then ordered before the pending
+        transaction, but never before the changes it has itself
+        committed.
+        """
+
+        thread = threading.current_thread()
+        self._tx_lock.acquire()
+        try:
+            timestamp = self._tx_commit.get(thread)
+            if timestamp is None:
+                timestamp = self._tx_commit[thread] = make_timestamp()
+            self.timestamp = timestamp
+        finally:
+            self._tx_lock.release()
+        return timestamp
+
+    def forget(self, obj):
+        """Forget object which has been checked in directly (see
+        ``Database.bulk_load``)."""
+
+        self._unconnected.discard(obj)
+
+        self._tx_lock.acquire()
+        try:
+            self._connected.discard(obj)
+        finally:
+            self._tx_lock.release()
 
     def beforeCompletion(self, tx):
-        self.timestamp = make_timestamp()
         self._tx_start[threading.current_thread()] = None
 
         if self._unconnected:
@@ -643,13 +2684,29 @@ class Synchronizer(threading.local):
 
     def newTransaction(self, tx):
         thread = threading.current_thread()
-        self._tx_start[thread] = self.timestamp = make_timestamp()
 
-        # we check out the objects we've activated in a previous
+        self._tx_lock.acquire()
+        try:
+            self._tx_start[thread] = self.timestamp = self._begin()
+            connected = tuple(self._connected)
+        finally:
+            self._tx_lock.release()
+
+        # we refresh the objects we've activated in a previous
         # transaction and which haven't been retracted to a shared
-        # state; this allows the local state to catch up on changesets
-        for obj in self._connected:
-            obj._p_checkout()
+        # state; this discards local copies left over from a previous
+        # transaction and allows the local state to catch up on
+        # changesets
+        for obj in connected:
+            lock = object_lock(obj)
+            lock.acquire()
+            try:
+                # the object may have been checked in by another
+                # thread in the meantime
+                if isinstance(obj, Local):
+                    obj._p_refresh()
+            finally:
+                lock.release()
 
     def commit(self, tx):
         pass
@@ -678,3 +2735,12 @@ class Synchronizer(threading.local):
         pass
 
 sync = Synchronizer()
+
+
+def _after_fork():
+    global _locks
+    _locks = tuple(threading.RLock() for i in range(LOCK_STRIPES))
+    sync._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
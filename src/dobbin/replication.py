@@ -0,0 +1,435 @@
+"""Log shipping.
+
+The log of a database is only ever appended to; a standby is a copy
+of it which is kept up to date by shipping the transactions which
+have been committed since its end. Only complete transactions are
+shipped (up to and including the transaction record), along with the
+file streams and out-of-band buffers which are written to the log.
+The standby can be opened at any time as a read-only database (see
+``Database``) and promoted to take over from the primary.
+
+Transactions are shipped in frames: a header with the offset at which
+the data begins, the end of the log which precedes it (to check that
+the standby matches the primary) and the length of the data, followed
+by the data. Frames can be sent over any stream, e.g. a pipe or a
+Unix socket; a standby on the same machine (or a mounted directory)
+can be updated directly (see ``replicate``).
+
+Usage: python -m dobbin.replication <command> [options]
+
+  copy PRIMARY STANDBY      update a standby from the log
+  ship PRIMARY              write frames to standard output (or a socket)
+  receive STANDBY           read frames from standard input (or a socket)
+  offset STANDBY            print the end of a standby
+  promote STANDBY           prepare a standby to take over
+
+With ``--interval``, the ``copy`` and ``ship`` commands keep shipping
+new transactions.
+"""
+
+import argparse
+import mmap
+import os
+import pickle
+import socket
+import sys
+import time
+
+from fcntl import flock
+from fcntl import LOCK_EX
+from fcntl import LOCK_UN
+
+from dobbin.database import LOG_RECORD
+from dobbin.database import LOG_STREAM
+from dobbin.exc import IntegrityError
+
+# the end of the log which precedes the data of a frame must match the
+# end of the standby
+TAIL = 256
+
+# frames hold at most this much data, unless a transaction is larger
+FRAME_SIZE = 1 << 22
+
+PickleBuffer = getattr(pickle, 'PickleBuffer', None)
+
+
+def transactions(log, offset=0):
+    """Yield the offsets at which the complete transactions in the
+    (memory-mapped) ``log`` which follow ``offset`` end.
+
+    The segments of the log are read like the database reads them
+    (see ``Database.read``), except that the classes of the objects
+    are not imported and references to other objects are not loaded;
+    they need not be importable.
+    """
+
+    size = len(log)
+    log.seek(offset)
+
+    # out-of-band buffers precede the entries which reference them
+    buffers = []
+    unpickler = _SegmentUnpickler(log, buffers)
+    while log.tell() < size:
+        try:
+            segment_type, segment = unpickler.load()
+        except (EOFError, pickle.UnpicklingError):
+            # the tail of the log is a transaction which is being
+            # written (or was cut short)
+            return
+
+        if segment_type == LOG_STREAM:
+            name, length = segment
+            end = log.tell() + length
+            if end > size:
+                return
+            if name == 'buffer':
+                buffers.append(b'')
+            log.seek(end)
+        elif segment_type == LOG_RECORD:
+            yield log.tell()
+
+            # the pickle memory is cleared when a transaction begins
+            unpickler = _SegmentUnpickler(log, buffers)
+
+
+def frames(path, offset=0, size=FRAME_SIZE):
+    """Yield the complete transactions of the log at ``path`` which
+    follow ``offset`` as frames of ``(offset, tail, data)``."""
+
+    log = _map(path)
+    if log is None:
+        return
+
+    try:
+        if offset > len(log):
+            raise IntegrityError(
+                "Offset %d is beyond the end of the log." % offset)
+
+        start = end = offset
+        for end in transactions(log, offset):
+            if end - start >= size:
+                yield _frame(log, start, end)
+                start = end
+
+        if end > start:
+            yield _frame(log, start, end)
+    finally:
+        log.close()
+
+
+def ship(path, stream, offset=0):
+    """Write the complete transactions of the log at ``path`` which
+    follow ``offset`` to ``stream``; returns the offset at which the
+    next transaction begins."""
+
+    for offset, tail, data in frames(path, offset):
+        pickle.dump((offset, tail, len(data)), stream, pickle.HIGHEST_PROTOCOL)
+        stream.write(data)
+        offset += len(data)
+
+    stream.flush()
+    return offset
+
+
+def replicate(path, standby):
+    """Update the ``standby`` log with the transactions of the log at
+    ``path``; returns the end of the standby."""
+
+    standby = Standby(standby)
+    offset = standby.offset
+    for frame in frames(path, offset):
+        offset = standby.apply(*frame)
+    return offset
+
+
+class Standby(object):
+    """Standby copy of a database log."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return '<%s path="%s">' % (type(self).__name__, self.path)
+
+    @property
+    def offset(self):
+        """The end of the log (at which the next transaction begins)."""
+
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def apply(self, offset, tail, data):
+        """Append a frame of transactions to the log; returns the end
+        of the log."""
+
+        f = open(self.path, 'ab+')
+        try:
+            # readers of the log (see ``Database.read``) wait while
+            # it's locked, as they do while a transaction is committed
+            flock(f.fileno(), LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                if end != offset:
+                    raise IntegrityError(
+                        "Frame at offset %d does not follow the end of "
+                        "the standby (%d)." % (offset, end))
+
+                f.seek(end - len(tail))
+                if f.read(len(tail)) != tail:
+                    raise IntegrityError(
+                        "Standby does not match the log at offset %d." % (
+                            offset))
+
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                flock(f.fileno(), LOCK_UN)
+        finally:
+            f.close()
+
+        return offset + len(data)
+
+    def receive(self, stream):
+        """Apply the frames which are read from ``stream`` (until it's
+        closed); returns the end of the log."""
+
+        offset = self.offset
+        while True:
+            try:
+                offset, tail, length = pickle.load(stream)
+            except EOFError:
+                break
+
+            data = _read(stream, length)
+            if len(data) < length:
+                raise IntegrityError(
+                    "Incomplete frame at offset %d." % offset)
+
+            offset = self.apply(offset, tail, data)
+
+        return offset
+
+    def promote(self):
+        """Prepare the standby to take over from the primary.
+
+        An incomplete transaction at the end of the log (left by an
+        interrupted transfer) is truncated. Returns the end of the
+        log; the standby can then be opened as a database.
+        """
+
+        f = open(self.path, 'rb+')
+        try:
+            flock(f.fileno(), LOCK_EX)
+            try:
+                end = 0
+                log = _map(self.path)
+                if log is not None:
+                    try:
+                        for end in transactions(log):
+                            pass
+                    finally:
+                        log.close()
+
+                f.truncate(end)
+            finally:
+                flock(f.fileno(), LOCK_UN)
+        finally:
+            f.close()
+
+        return end
+
+
+def serve(standby, address):
+    """Receive transactions for ``standby`` on a Unix socket at
+    ``address``; the end of the standby is sent to a client when it
+    connects, such that shipping resumes from there."""
+
+    standby = Standby(standby)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(address)
+        server.listen(1)
+        while True:
+            conn, addr = server.accept()
+            try:
+                stream = conn.makefile('rwb')
+                try:
+                    pickle.dump(standby.offset, stream)
+                    stream.flush()
+                    standby.receive(stream)
+                finally:
+                    stream.close()
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        os.remove(address)
+
+
+def connect(address):
+    """Connect to a standby which is served at ``address`` (see
+    ``serve``); returns the stream and the end of the standby."""
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(address)
+    stream = client.makefile('rwb')
+    client.close()
+    return stream, pickle.load(stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dobbin.replication",
+        description="Ship the transactions of a database log to a standby.")
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('copy', help="update a standby")
+    command.add_argument('primary')
+    command.add_argument('standby')
+    command.add_argument(
+        '-i', '--interval', type=float,
+        help="keep shipping new transactions at this interval (in seconds)")
+
+    command = commands.add_parser(
+        'ship', help="write frames to standard output (or a socket)")
+    command.add_argument('primary')
+    command.add_argument(
+        '-o', '--offset', type=int, default=0,
+        help="the end of the standby (see the 'offset' command)")
+    command.add_argument(
+        '-s', '--socket', help="ship to a standby served at this address")
+    command.add_argument(
+        '-i', '--interval', type=float,
+        help="keep shipping new transactions at this interval (in seconds)")
+
+    command = commands.add_parser(
+        'receive', help="read frames from standard input (or a socket)")
+    command.add_argument('standby')
+    command.add_argument(
+        '-s', '--socket', help="serve the standby at this address")
+
+    command = commands.add_parser('offset', help="print the end of a standby")
+    command.add_argument('standby')
+
+    command = commands.add_parser(
+        'promote', help="prepare a standby to take over")
+    command.add_argument('standby')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("A command is required.")
+
+    try:
+        if args.command == 'copy':
+            while True:
+                replicate(args.primary, args.standby)
+                if args.interval is None:
+                    break
+                time.sleep(args.interval)
+
+        elif args.command == 'ship':
+            offset = args.offset
+            if args.socket is None:
+                stream = getattr(sys.stdout, 'buffer', sys.stdout)
+            else:
+                stream, offset = connect(args.socket)
+
+            try:
+                while True:
+                    offset = ship(args.primary, stream, offset)
+                    if args.interval is None:
+                        break
+                    time.sleep(args.interval)
+            finally:
+                if args.socket is not None:
+                    stream.close()
+
+        elif args.command == 'receive':
+            if args.socket is None:
+                stream = getattr(sys.stdin, 'buffer', sys.stdin)
+                Standby(args.standby).receive(stream)
+            else:
+                serve(args.standby, args.socket)
+
+        elif args.command == 'offset':
+            print(Standby(args.standby).offset)
+
+        elif args.command == 'promote':
+            print(Standby(args.standby).promote())
+
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def _frame(log, start, end):
+    return start, log[max(0, start - TAIL):start], log[start:end]
+
+
+def _map(path):
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return
+
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return
+    finally:
+        f.close()
+
+
+class _Placeholder(dict):
+    # stands in for the classes and functions which a segment
+    # references, and the objects which they construct
+
+    def __new__(cls, *args, **kwargs):
+        return dict.__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+    def append(self, value):
+        pass
+
+    extend = append
+
+
+class _SegmentUnpickler(pickle.Unpickler):
+    def __init__(self, log, buffers):
+        if PickleBuffer is None:
+            pickle.Unpickler.__init__(self, log)
+        else:
+            pickle.Unpickler.__init__(
+                self, log, buffers=iter(lambda: buffers.pop(0), None))
+
+    def find_class(self, module, name):
+        return _Placeholder
+
+    def persistent_load(self, pid):
+        return None
+
+
+def _read(stream, length):
+    chunks = []
+    while length:
+        chunk = stream.read(length)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
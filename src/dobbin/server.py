@@ -0,0 +1,638 @@
+"""Storage server.
+
+A storage server owns the log of a database: it holds the objects in
+memory (as a database does) and serves their state to clients which
+connect on a Unix socket; new object identifiers are allocated and
+transactions are committed by the server, one at a time.
+
+A client (see ``ClientStorage``) loads an object from the server when
+it's first used, such that it holds only the objects that it uses.
+When a transaction begins, the server tells the client which objects
+were changed by the transactions committed since; only a transaction
+which changed an object that the client has loaded is read from the
+log (and the changes applied). Clients and server must therefore run
+on the same machine.
+
+A transaction is committed in two phases: when a client votes, the
+server checks the changes for conflicts and holds them (and the
+commit lock); they're written to the log when the client finishes
+the transaction.
+
+Usage: python -m dobbin.server PATH SOCKET
+"""
+
+import argparse
+import collections
+import os
+import pickle
+import socket
+import socketserver
+import sys
+import threading
+
+from io import BytesIO
+
+from dobbin.database import Database
+from dobbin.database import LOG_RECORD
+from dobbin.database import LOG_VERSION
+from dobbin.database import PersistentBuffer
+from dobbin.database import TransactionRecord
+from dobbin.exc import StorageError
+from dobbin.exc import WriteConflictError
+from dobbin.history import Ghost
+from dobbin.manager import Manager
+from dobbin.persistent import Broken
+from dobbin.persistent import PersistentArray
+from dobbin.persistent import PersistentFile
+from dobbin.utils import make_timestamp
+
+setattr = object.__setattr__
+
+
+class StorageServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """Serve the database at ``path`` on a Unix socket at ``address``.
+
+    Each client connection is handled by a thread; requests and
+    replies are pickled tuples. Keyword arguments are passed on to
+    the database (see ``ServerDatabase``).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, address, **kwargs):
+        self.database = ServerDatabase(path, **kwargs)
+        self._staged = threading.local()
+        socketserver.UnixStreamServer.__init__(self, address, RequestHandler)
+
+    def __repr__(self):
+        return '<%s address="%s">' % (type(self).__name__, self.server_address)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.database.close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def hello(self):
+        """Return the path of the log and the position of the database
+        as ``(path, timestamp, count, offset)``."""
+
+        database = self.database
+        database.lock_acquire()
+        try:
+            database._sync()
+            return (
+                database._path, database.tx_timestamp, database.tx_count,
+                database._index_end)
+        finally:
+            database.lock_release()
+
+    def load(self, oid, timestamp):
+        """Return the state of an object as of the transaction at
+        ``timestamp`` (the position of the client) as ``(cls, serial,
+        data)``, where the state is pickled into ``data``; or ``None``
+        if there was no such object."""
+
+        if timestamp is None:
+            return
+
+        database = self.database
+        database.lock_acquire()
+        try:
+            database._sync()
+            obj = database.get(oid)
+            if obj is None:
+                return
+
+            # the server never checks out objects; they're in shared
+            # state, unless the object has been changed since, in
+            # which case the version is read from the log
+            if obj._p_serial > timestamp:
+                version = database._load_version(database, oid, timestamp)
+                if version is None:
+                    return
+                cls, serial, state = version
+            else:
+                cls, serial, state = (
+                    type(obj), obj._p_serial, obj._p_checkpoint())
+
+            stream = BytesIO()
+            pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = database.persistent_id
+            pickler.dump(state)
+            return cls, serial, stream.getvalue()
+        finally:
+            database.lock_release()
+
+    def new_oid(self):
+        database = self.database
+        database.lock_acquire()
+        try:
+            database._sync()
+            oid = database._oid = database._oid + 1
+            return oid
+        finally:
+            database.lock_release()
+
+    def vote(self, data):
+        """Stage the changes pickled into ``data`` by a client (see
+        ``ClientStorage.write``).
+
+        Each change carries the serial of the object which it's based
+        on; if the object has since been changed, nothing is staged.
+        Returns ``(timestamp, conflicts)``; if there are no conflicts,
+        the commit lock is held until the transaction is finished or
+        aborted by the same client (see ``finish`` and ``abort``).
+        """
+
+        database = self.database
+        database._begin_write()
+        try:
+            # catch up on transactions committed by other processes
+            database._sync()
+
+            stream = BytesIO(data)
+            unpickler = database._unpickler(
+                ServerJar(database), stream, database._open_mmap(), [])
+            entries = []
+            while stream.tell() < len(data):
+                segment_type, entry = unpickler.load()
+                entries.append(entry)
+
+            conflicts = []
+            for oid, cls, state, serial in entries:
+                obj = database.get(oid)
+                if obj is not None and obj._p_serial != serial:
+                    conflicts.append(oid)
+
+            if conflicts:
+                database._end_write()
+                return None, conflicts
+
+            timestamp = make_timestamp()
+            for oid, cls, state, serial in entries:
+                database.write(oid, cls, state)
+        except:
+            self._discard()
+            database._end_write()
+            raise
+
+        self._staged.timestamp = timestamp
+        return timestamp, ()
+
+    def finish(self):
+        """Write the staged transaction to the log; returns the offset
+        at which it ends."""
+
+        database = self.database
+        timestamp = getattr(self._staged, 'timestamp', None)
+        if timestamp is None:
+            raise StorageError("No transaction to finish.")
+
+        try:
+            database._write(LOG_RECORD, TransactionRecord(timestamp, True))
+            database._drain()
+            offset = database._wstream.tell()
+        finally:
+            self._discard()
+            database._end_write()
+
+        # the transaction is read back from the log, as if it were
+        # committed by another process
+        database._sync()
+        return offset
+
+    def abort(self):
+        """Discard the staged transaction (if any)."""
+
+        if getattr(self._staged, 'timestamp', None) is not None:
+            self._discard()
+            self.database._end_write()
+
+    def invalidations(self, offset):
+        """Return the transactions which were committed after the one
+        which ends at ``offset`` as a list of ``(end, record, oids)``,
+        where ``oids`` are the objects changed by the transaction that
+        ends at ``end``; or ``None`` if they're no longer kept (see
+        ``ServerDatabase``)."""
+
+        database = self.database
+        database.lock_acquire()
+        try:
+            database._sync()
+            if offset == database._index_end:
+                return []
+
+            changes = [
+                change for change in database._changes if change[1] > offset]
+            if not changes or changes[0][0] != offset:
+                return
+
+            return [change[1:] for change in changes]
+        finally:
+            database.lock_release()
+
+    def _discard(self):
+        self._staged.timestamp = None
+        database = self.database
+        database._buffer.seek(0)
+        database._buffer.truncate()
+        del database._written[:]
+
+
+class ServerDatabase(Database):
+    """Database which keeps the objects changed by the most recent
+    transactions (up to ``history``), such that a client can tell
+    which of its objects are current (see ``ClientStorage.read``)."""
+
+    def __init__(self, path, history=1000, **kwargs):
+        self._changes = collections.deque(maxlen=history)
+        super(ServerDatabase, self).__init__(path, **kwargs)
+
+    def read(self, jar, timestamp):
+        changes = self._changes
+        start = self._index_end
+        for record, entries in super(ServerDatabase, self).read(
+                jar, timestamp):
+            # a transaction may be read more than once; it's new if
+            # the end of the log has moved
+            end = self._index_end
+            if end > start:
+                if record.status:
+                    oids = tuple(set(entry[0] for entry in entries))
+                else:
+                    oids = ()
+                changes.append((start, end, record, oids))
+                start = end
+            yield record, entries
+
+
+class ServerJar(object):
+    """Resolves the references of the changes committed by a client;
+    new objects are not added to the database until the transaction
+    is read back from the log."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def get(self, oid, cls=None):
+        obj = self.database.get(oid)
+        if obj is None:
+            obj = Broken(oid, cls)
+            setattr(obj, '__class__', cls)
+            setattr(obj, '_p_jar', self.database)
+        return obj
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    methods = (
+        'hello', 'load', 'new_oid', 'vote', 'finish', 'abort',
+        'invalidations')
+
+    def handle(self):
+        try:
+            self._handle()
+        finally:
+            # a transaction staged by a client which disconnects is
+            # aborted
+            self.server.abort()
+
+    def _handle(self):
+        while True:
+            try:
+                name, args = pickle.load(self.rfile)
+            except EOFError:
+                break
+
+            try:
+                if name not in self.methods:
+                    raise ValueError("Unknown method: %s." % name)
+                reply = True, getattr(self.server, name)(*args)
+            except Exception as e:
+                reply = False, "%s: %s" % (type(e).__name__, e)
+
+            pickle.dump(reply, self.wfile, pickle.HIGHEST_PROTOCOL)
+            self.wfile.flush()
+
+
+class ClientStorage(Database):
+    """Database whose objects are served by a storage server at
+    ``address`` (see ``StorageServer``).
+
+    Objects are loaded when they're first used, as of the most recent
+    transaction which the client has read (such that a transaction
+    sees a consistent state); until then, they're ghosts (see
+    ``dobbin.history``). Transactions are committed by the
+    server; a change to an object which was changed by another client
+    since it was loaded (or last updated) is a write conflict (when the
+    transaction is voted on).
+
+    Files and arrays can't be stored through a client; historical
+    views, checkpoints and bulk loads are not available.
+    """
+
+    def __init__(self, address, metrics=None, tracer=None):
+        self.address = address
+        self._connect()
+
+        # the oids of the loaded objects, mapped to the offset in the
+        # log as of which they're current (see ``read``)
+        self._loaded = {}
+        self._voted = False
+
+        path, timestamp, count, offset = self._call('hello')
+        self._position = timestamp, count, offset
+        super(ClientStorage, self).__init__(
+            path, metrics=metrics, tracer=tracer)
+
+    def __copy__(self):
+        return type(self)(self.address)
+
+    def __repr__(self):
+        return '<%s address="%s">' % (type(self).__name__, self.address)
+
+    def at(self, timestamp):
+        raise StorageError(
+            "Historical views are not available through a client.")
+
+    def bulk_load(self, objects, chunk_size=10000):
+        raise StorageError(
+            "Bulk loads are not available through a client.")
+
+    def checkpoint(self):
+        raise StorageError(
+            "Checkpoints are written by the server.")
+
+    def close(self):
+        super(ClientStorage, self).close()
+        self._stream.close()
+
+    def get(self, oid, cls=None):
+        self.lock_acquire()
+        try:
+            obj = self._oid2obj.get(oid)
+            if obj is not None:
+                return obj
+
+            if cls is None:
+                result = self._call('load', oid, self.tx_timestamp)
+                if result is None:
+                    return None
+                obj = self._ghost(oid, result[0])
+                self._set_state(obj, *result)
+            else:
+                obj = self._ghost(oid, cls)
+
+            return obj
+        finally:
+            self.lock_release()
+
+    def new_oid(self, obj):
+        oid = obj._p_oid = self._call('new_oid')
+        return oid
+
+    def newTransaction(self, transaction):
+        # a closed client may still be registered with the transaction
+        # manager of a thread
+        if not self._stream.closed:
+            super(ClientStorage, self).newTransaction(transaction)
+
+    def object_history(self, obj):
+        raise StorageError(
+            "Object histories are not available through a client.")
+
+    def persistent_id(self, obj):
+        if isinstance(obj, PersistentFile) or (
+                isinstance(obj, PersistentArray) and not (
+                    isinstance(obj, PersistentBuffer) and
+                    obj.path == self._path)):
+            raise TypeError("Can't store files or arrays through a client.")
+
+        return super(ClientStorage, self).persistent_id(obj)
+
+    def read(self, jar, timestamp):
+        """Read transactions newer than ``timestamp`` (see
+        ``Database.read``).
+
+        Only the changes to objects which are loaded (and not yet
+        current) are applied; the other objects are loaded as of the
+        position of the client when they're first used. The server
+        tells which objects were changed by each transaction, such
+        that only the transactions which changed a loaded object are
+        read from the log.
+        """
+
+        loaded = self._loaded
+        changes = self._call('invalidations', self._index_end)
+
+        # the server no longer keeps the changes since our position;
+        # we read the log
+        if changes is None:
+            for record, entries in super(ClientStorage, self).read(
+                    jar, timestamp):
+                end = self._index_end
+                entries[:] = [
+                    entry for entry in entries
+                    if loaded.get(entry[0], end) < end]
+                yield record, entries
+            return
+
+        for end, record, oids in changes:
+            entries = ()
+            for oid in oids:
+                if loaded.get(oid, end) < end:
+                    record, entries, end = self._read_transaction(
+                        jar, self._index_end)
+                    entries = [
+                        entry for entry in entries
+                        if loaded.get(entry[0], end) < end]
+                    break
+
+            self._index.add(record.timestamp, end)
+            self._index_end = end
+            yield record, entries
+
+    def read_checkpoint(self, jar, end=None):
+        # the client begins at the position of the database when it
+        # connected; the objects are loaded on demand
+        timestamp, count, offset = self._position
+        if timestamp is None:
+            return
+
+        self._index.add(timestamp, offset)
+        self._index_end = offset
+        return TransactionRecord(timestamp, True), count, ()
+
+    def write(self, oid, cls, state):
+        # the serial of the object is checked by the server (see
+        # ``StorageServer.vote``); the changes are sent when the
+        # transaction is voted on
+        obj = self._oid2obj.get(oid)
+        serial = None if obj is None else obj._p_serial
+        self.metrics.count('write.records')
+        self._pickler.dump((LOG_VERSION, (oid, cls, state, serial)))
+
+    def tpc_abort(self, transaction):
+        self.lock_acquire()
+        try:
+            if transaction is not self.tx_ref:
+                return
+            try:
+                if self._voted:
+                    self._call('abort')
+            finally:
+                self.tx_ref = None
+                self._voted = False
+                self._buffer.seek(0)
+                self._buffer.truncate()
+                self._commit_lock.release()
+        finally:
+            self.lock_release()
+
+        Manager.tpc_abort(self, transaction)
+
+    def tpc_begin(self, transaction):
+        if self.tx_ref is transaction:
+            return
+
+        self._commit_lock.acquire()
+        self.lock_acquire()
+        try:
+            self.tx_ref = transaction
+            self._pickler.clear_memo()
+        finally:
+            self.lock_release()
+
+        Manager.tpc_begin(self, transaction)
+
+    def tpc_vote(self, transaction):
+        self.lock_acquire()
+        try:
+            if transaction is not self.tx_ref:
+                return
+            data = self._buffer.getvalue()
+        finally:
+            self.lock_release()
+
+        # the changes are staged by the server (which holds the
+        # commit lock) until the transaction is finished or aborted
+        timestamp, conflicts = self._call('vote', data)
+        if conflicts:
+            self.metrics.count('conflicts.write')
+            raise WriteConflictError(self._oid2obj.get(conflicts[0]))
+
+        self._voted = True
+        self._thread.timestamp = timestamp
+
+    def tpc_finish(self, transaction):
+        self.lock_acquire()
+        try:
+            if transaction is not self.tx_ref:
+                return
+            try:
+                offset = self._call('finish')
+
+                # the committed objects are current as of the end of
+                # the transaction; it's skipped when read (see
+                # ``read``)
+                for obj, state in self._thread.committed:
+                    self._loaded[obj._p_oid] = offset
+
+                Manager.tpc_finish(self, transaction)
+            finally:
+                self.tx_ref = None
+                self._voted = False
+                self._buffer.seek(0)
+                self._buffer.truncate()
+                self._commit_lock.release()
+        finally:
+            self.lock_release()
+
+    def _after_fork(self):
+        super(ClientStorage, self)._after_fork()
+
+        # the connection is shared with the parent process
+        self._connect()
+
+    def _call(self, name, *args):
+        self._call_lock.acquire()
+        try:
+            pickle.dump((name, args), self._stream, pickle.HIGHEST_PROTOCOL)
+            self._stream.flush()
+            try:
+                success, result = pickle.load(self._stream)
+            except EOFError:
+                raise StorageError("Connection to server lost.")
+        finally:
+            self._call_lock.release()
+
+        if not success:
+            raise StorageError(result)
+        return result
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+            self._stream = sock.makefile('rwb')
+        finally:
+            sock.close()
+        self._call_lock = threading.Lock()
+
+    def _ghost(self, oid, cls):
+        obj = Broken(oid, cls)
+        setattr(obj, '__class__', Ghost._p_ghost_class(cls))
+        setattr(obj, '_p_jar', self)
+        self._oid2obj[oid] = obj
+        return obj
+
+    def _p_load(self, obj):
+        self.lock_acquire()
+        try:
+            # the object may have been loaded by another thread
+            if not isinstance(obj, Ghost):
+                return
+
+            oid = obj._p_oid
+            result = self._call('load', oid, self.tx_timestamp)
+            if result is None:
+                raise KeyError(oid)
+            self._set_state(obj, *result)
+        finally:
+            self.lock_release()
+
+    def _set_state(self, obj, cls, serial, data):
+        unpickler = self._unpickler(
+            self, BytesIO(data), self._open_mmap(), [])
+        state = unpickler.load()
+        setattr(obj, '__class__', cls)
+        setattr(obj, '_p_serial', serial)
+        obj.__setstate__(state)
+
+        # the object is loaded as of our position (later changes are
+        # applied when they're read)
+        self._loaded[obj._p_oid] = self._index_end
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dobbin.server",
+        description="Serve a database to clients on a Unix socket.")
+    parser.add_argument('path')
+    parser.add_argument('socket')
+    args = parser.parse_args(argv)
+
+    server = StorageServer(args.path, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
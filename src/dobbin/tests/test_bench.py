@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# the smallest parameters which exercise each scenario
+PARAMS = {
+    'size': 1,
+    'count': 10,
+    'reads': 10,
+    'updates': 1,
+    'threads': 2,
+    'processes': 2,
+    'commits': 2,
+    'producers': 1,
+    'consumers': 1,
+    }
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_percentile(self):
+        from dobbin.bench import percentile
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([1.0], 99), 1.0)
+        self.assertEqual(percentile([1.0, 2.0, 3.0], 50), 2.0)
+        self.assertEqual(percentile([1.0, 2.0], 50), 1.5)
+
+    def test_summarize(self):
+        from dobbin.bench import summarize
+
+        # one operation in the first run and four in the second, each
+        # run taking a second
+        result = summarize([1.0, 0.25], 5, 2.0)
+        self.assertEqual(result['mean'], 0.625)
+        self.assertEqual(result['ops_per_second'], 2.5)
+        self.assertEqual(summarize([0.0], 1, 0.0)['ops_per_second'], 0.0)
+
+    def test_unknown_parameter(self):
+        from dobbin.bench import Scenario
+        self.assertRaises(TypeError, Scenario, 'path', size=1)
+
+    def test_run(self):
+        from dobbin import bench
+        bench.load_scenarios()
+
+        names = sorted(
+            name for (name, cls) in bench.SCENARIOS.items()
+            if cls.group == 'macro' and (
+                name != 'process_contention' or hasattr(os, 'fork')))
+
+        report = bench.run(names, params=PARAMS, warmup=1, iterations=2)
+        self.assertEqual(sorted(report['results']), names)
+
+        for name, result in report['results'].items():
+            self.assertEqual(result['samples'], 2)
+            self.assertTrue(0 < result['min'] <= result['p50'])
+            self.assertTrue(result['p50'] <= result['max'])
+
+        # the report can be saved as JSON
+        json.dumps(report)
+
+    def test_micro(self):
+        from dobbin import bench
+        params = {'size': 2, 'objects': 3}
+        for threads in (1, 2):
+            params['threads'] = threads
+            report = bench.run(
+                group='micro', params=params, warmup=1, iterations=2)
+            self.assertTrue('checkout' in report['results'])
+            for name, result in report['results'].items():
+                self.assertEqual(result['params'], params)
+                self.assertTrue(result['operations'] > 0)
+
+    def test_memory(self):
+        from dobbin import bench
+        report = bench.run(group='memory', params={'count': 10})
+        for name in ('memory_persistent', 'memory_compact', 'memory_dict'):
+            result = report['results'][name]
+            for state in ('shared', 'local'):
+                self.assertTrue(result[state]['traced'] > 0)
+                self.assertTrue(result[state]['estimated'] > 0)
+
+    def test_compare(self):
+        from dobbin.bench import compare
+
+        def report(**results):
+            return {'results': dict(
+                (name, {'p50': value}) for (name, value) in results.items())}
+
+        rows = compare(
+            report(a=1.0, b=1.0, c=1.0),
+            report(a=1.04, b=1.2, d=1.0))
+
+        self.assertEqual([row[0] for row in rows], ['a', 'b'])
+        self.assertFalse(rows[0][4])
+        self.assertTrue(rows[1][4])
+        self.assertAlmostEqual(rows[1][3], 1.2)
+
+    def test_main(self):
+        from dobbin.bench.__main__ import main
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'baseline.json')
+        args = ['-q', '-n', '1', '-w', '0', '-p', 'count=10', 'commit_many']
+        try:
+            self.assertEqual(main(args + ['-o', path]), 0)
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertTrue('commit_many' in baseline['results'])
+
+            # a baseline which is much faster is a regression
+            baseline['results']['commit_many']['p50'] /= 1000.0
+            with open(path, 'w') as f:
+                json.dump(baseline, f)
+
+            stdout = StringIO()
+            saved = sys.stdout
+            sys.stdout = stdout
+            try:
+                status = main(args + ['-c', path])
+            finally:
+                sys.stdout = saved
+
+            self.assertEqual(status, 1)
+            self.assertTrue('REGRESSION' in stdout.getvalue())
+        finally:
+            os.remove(path)
+            os.rmdir(directory)
@@ -0,0 +1,589 @@
+import os
+import signal
+import unittest
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+try:
+    from pickle import PickleBuffer
+except ImportError:
+    PickleBuffer = None
+
+class DatabaseTestCase(BaseTestCase):
+    def _get_root(self):
+        assert self.database.root is None
+        from dobbin.persistent import Persistent
+        root = Persistent()
+        self.database.elect(root)
+        return root
+
+
+@unittest.skipIf(PickleBuffer is None, "Pickle protocol 5 not available.")
+class BufferTestCase(DatabaseTestCase):
+    def setUp(self):
+        super(BufferTestCase, self).setUp()
+        from dobbin.database import Database
+        self.database.close()
+        self.database = Database(self._tempfile.name, buffer_threshold=64)
+
+    def test_out_of_band(self):
+        root = self._get_root()
+        root.data = b'x' * 1000
+        root.small = b'abc'
+        root.array = bytearray(b'y' * 100)
+        transaction.commit()
+
+        # large values are loaded from out-of-band buffers
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            new_root = new_db.root
+            self.assertEqual(new_root.small, b'abc')
+            self.assertTrue(isinstance(new_root.data, memoryview))
+            self.assertTrue(new_root.data.readonly)
+            self.assertEqual(bytes(new_root.data), b'x' * 1000)
+            self.assertEqual(bytes(new_root.array), b'y' * 100)
+
+            # checked out, the value is not copied
+            from dobbin.persistent import checkout
+            checkout(new_root)
+            self.assertTrue(isinstance(new_root.data, memoryview))
+            new_root.other = b'z' * 100
+            transaction.commit()
+        finally:
+            new_db.close()
+
+        new_db = copy(self.database)
+        try:
+            self.assertEqual(bytes(new_db.root.data), b'x' * 1000)
+            self.assertEqual(bytes(new_db.root.other), b'z' * 100)
+        finally:
+            new_db.close()
+
+    def test_checkpoint(self):
+        import os
+        root = self._get_root()
+        root.data = b'x' * 1000
+        transaction.commit()
+
+        # the value is loaded as a memory view; it's written to the
+        # checkpoint as an out-of-band buffer
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            self.assertTrue(isinstance(new_db.root.data, memoryview))
+            new_db.checkpoint()
+        finally:
+            new_db.close()
+
+        path = self._tempfile.name + '.checkpoint'
+        self.addCleanup(os.remove, path)
+        new_db = copy(self.database)
+        try:
+            self.assertTrue(isinstance(new_db.root.data, memoryview))
+            self.assertEqual(bytes(new_db.root.data), b'x' * 1000)
+        finally:
+            new_db.close()
+
+    def test_container(self):
+        from dobbin.persistent import PersistentList
+        root = PersistentList([b'x' * 1000])
+        self.database.elect(root)
+        transaction.commit()
+
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            self.assertEqual(list(new_db.root), [b'x' * 1000])
+        finally:
+            new_db.close()
+
+
+class BulkLoadTestCase(DatabaseTestCase):
+    def _records(self, count):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import PersistentList
+        for i in range(count):
+            obj = Persistent()
+            obj.number = i
+            obj.tags = PersistentList([str(i)])
+            yield obj
+
+    def test_bulk_load(self):
+        root = self._get_root()
+        root.records = []
+        transaction.commit()
+
+        records = []
+
+        def collect(objects):
+            for obj in objects:
+                records.append(obj)
+                yield obj
+
+        count = self.database.bulk_load(collect(self._records(25)), 10)
+        self.assertEqual(count, 50)
+        self.assertEqual(len(self.database), 51)
+
+        # the loaded objects are in shared state
+        from dobbin.persistent import Local
+        for obj in records:
+            self.assertFalse(isinstance(obj, Local))
+            self.assertFalse(isinstance(obj.tags, Local))
+            self.assertTrue(obj._p_jar is self.database)
+
+        # connect the objects to the object graph
+        from dobbin.persistent import checkout
+        checkout(root)
+        root.records = records
+        transaction.commit()
+
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            new_records = new_db.root.records
+            self.assertEqual(
+                [obj.number for obj in new_records], list(range(25)))
+            self.assertEqual(
+                [list(obj.tags) for obj in new_records],
+                [[str(i)] for i in range(25)])
+        finally:
+            new_db.close()
+
+    def test_compact(self):
+        from dobbin.tests.test_persistent import Point
+        from dobbin.persistent import Local
+        from dobbin.persistent import bulk
+
+        with bulk():
+            point = Point(1, 2)
+        self.assertFalse(isinstance(point, Local))
+        self.database.bulk_load([point])
+        self.assertTrue(point._p_oid is not None)
+
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            self.assertEqual(len(new_db), 1)
+        finally:
+            new_db.close()
+
+    def test_already_added(self):
+        records = list(self._records(1))
+        self.database.bulk_load(records)
+        self.assertRaises(RuntimeError, self.database.bulk_load, records)
+
+    def test_oid_after_reopen(self):
+        records = list(self._records(2))
+        self.database.bulk_load(records)
+
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            new_records = list(self._records(1))
+            new_db.bulk_load(new_records)
+        finally:
+            new_db.close()
+
+        # object identifiers are not reused
+        oids = set(obj._p_oid for obj in records + new_records)
+        self.assertEqual(len(oids), 3)
+
+
+class ColdStartTestCase(DatabaseTestCase):
+    def _reopen(self):
+        from copy import copy
+        new_db = copy(self.database)
+        self.addCleanup(new_db.close)
+        return new_db
+
+    def test_final_state(self):
+        from dobbin.persistent import checkout
+        from dobbin.persistent import PersistentCounter
+        from dobbin.persistent import PersistentDict
+        from dobbin.persistent import PersistentList
+        from dobbin.persistent import PersistentSet
+
+        root = self._get_root()
+        root.entries = PersistentList()
+        root.tags = PersistentSet()
+        root.mapping = PersistentDict()
+        root.counter = PersistentCounter()
+        transaction.commit()
+
+        for i in range(10):
+            for obj in (root, root.entries, root.tags, root.mapping,
+                        root.counter):
+                checkout(obj)
+            root.value = i
+            root.entries.extend([i, i])
+            root.entries.pop(0)
+            root.entries.insert(1, -i)
+            root.tags.add(i)
+            root.tags.discard(i - 2)
+            root.mapping[i % 3] = i
+            root.counter.increment(i)
+            transaction.commit()
+
+        new_root = self._reopen().root
+        self.assertEqual(new_root.value, 9)
+        self.assertEqual(list(new_root.entries), list(root.entries))
+        self.assertEqual(set(new_root.tags), set([8, 9]))
+        self.assertEqual(dict(new_root.mapping), {0: 9, 1: 7, 2: 8})
+        self.assertEqual(new_root.counter.value, 45)
+
+        # the object has the timestamp of the most recent change
+        self.assertEqual(new_root._p_serial, root._p_serial)
+        self.assertEqual(
+            new_root.entries._p_serial, root.entries._p_serial)
+
+        # the database is in sync
+        new_db = new_root._p_jar
+        self.assertEqual(new_db.tx_count, self.database.tx_count)
+        checkout(new_root)
+        new_root.value = 10
+        transaction.commit()
+        self.database._sync()
+        self.assertEqual(root.value, 10)
+
+    def test_aborted(self):
+        from dobbin.persistent import checkout
+        from dobbin.persistent import PersistentCounter
+
+        root = self._get_root()
+        root.value = 1
+        root.counter = PersistentCounter(1)
+        transaction.commit()
+        self.database.checkpoint()
+
+        # the changes are written to the log before the transaction
+        # is aborted
+        checkout(root)
+        root.value = 2
+        checkout(root.counter)
+        root.counter.increment()
+        tx = transaction.get()
+        self.database.tpc_begin(tx)
+        self.database.commit(tx)
+        self.database.tpc_abort(tx)
+        transaction.abort()
+
+        # the entries of the aborted transaction are not folded into
+        # the state of the checkpoint (or the log)
+        new_db = self._reopen()
+        self.assertEqual(new_db.root.value, 1)
+        self.assertEqual(new_db.root.counter.value, 1)
+
+        os.remove(self._tempfile.name + '.checkpoint')
+        new_db = self._reopen()
+        self.assertEqual(new_db.root.value, 1)
+        self.assertEqual(new_db.root.counter.value, 1)
+        self.assertEqual(new_db.tx_count, self.database.tx_count)
+
+    def test_broken_class(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import Broken
+        first = Broken(1, Persistent)
+        second = Broken(2, Persistent)
+        self.assertTrue(type(first) is type(second))
+
+
+class CheckpointTestCase(DatabaseTestCase):
+    def setUp(self):
+        super(CheckpointTestCase, self).setUp()
+        self.addCleanup(self._remove, self._tempfile.name)
+
+    def _remove(self, path):
+        import os
+        path += '.checkpoint'
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _reopen(self):
+        from copy import copy
+        new_db = copy(self.database)
+        self.addCleanup(new_db.close)
+        return new_db
+
+    def test_checkpoint(self):
+        from dobbin.persistent import checkout
+        from dobbin.persistent import PersistentCounter
+        from dobbin.persistent import PersistentDict
+        from dobbin.persistent import PersistentList
+        from dobbin.persistent import PersistentSet
+        from dobbin.tests.test_persistent import Point
+
+        self.assertEqual(self.database.checkpoint(), None)
+
+        root = self._get_root()
+        root.entries = PersistentList([1, 2, 3])
+        root.tags = PersistentSet(['a'])
+        root.mapping = PersistentDict()
+        root.mapping['a'] = 1
+        root.counter = PersistentCounter(5)
+        root.point = Point(1, 2)
+        transaction.commit()
+
+        # the list is checked out when the checkpoint is written; the
+        # uncommitted change is not included
+        checkout(root.entries)
+        root.entries.append(4)
+        timestamp = self.database.checkpoint()
+        self.assertEqual(timestamp, root._p_serial)
+        transaction.commit()
+
+        new_db = self._reopen()
+        self.assertEqual(new_db.tx_count, self.database.tx_count)
+        self.assertEqual(len(new_db), len(self.database))
+        new_root = new_db.root
+        self.assertEqual(list(new_root.entries), [1, 2, 3, 4])
+        self.assertEqual(set(new_root.tags), set(['a']))
+        self.assertEqual(dict(new_root.mapping), {'a': 1})
+        self.assertEqual(new_root.counter.value, 5)
+        self.assertEqual(new_root.point.x, 1)
+        self.assertEqual(new_root._p_serial, timestamp)
+
+        # new objects are given unused identifiers
+        from dobbin.persistent import Persistent
+        checkout(new_root)
+        new_root.other = Persistent()
+        transaction.commit()
+        self.database._sync()
+        self.assertEqual(len(self.database), 7)
+
+    def test_transaction_index(self):
+        from dobbin.persistent import checkout
+
+        root = self._get_root()
+        root.value = 0
+        transaction.commit()
+        timestamps = [root._p_serial]
+        for i in range(1, 3):
+            checkout(root)
+            root.value = i
+            transaction.commit()
+            timestamps.append(root._p_serial)
+
+        self.database.checkpoint()
+        checkout(root)
+        root.value = 3
+        transaction.commit()
+
+        # the index of transactions up to the checkpoint is restored
+        new_db = self._reopen()
+        index = new_db._index
+        self.assertEqual(len(index), 4)
+        self.assertEqual(
+            list(index.timestamps), list(self.database._index.timestamps))
+
+        # transactions can be read from any point in time
+        between = (timestamps[0] + timestamps[1]) / 2
+        records = [
+            record.timestamp for (record, entries)
+            in new_db.read(new_db, between)
+            ]
+        self.assertEqual(records, timestamps[1:] + [new_db.tx_timestamp])
+
+    def test_other_log(self):
+        root = self._get_root()
+        root.value = 1
+        transaction.commit()
+        self.database.checkpoint()
+
+        # the checkpoint of another log is ignored
+        import shutil
+        import tempfile
+        from dobbin.database import Database
+        from dobbin.persistent import Persistent
+        f = tempfile.NamedTemporaryFile()
+        self.addCleanup(f.close)
+        self.addCleanup(self._remove, f.name)
+        database = Database(f.name)
+        other = Persistent()
+        database.elect(other)
+        other.value = 2
+        transaction.commit()
+        database.close()
+
+        shutil.copy(
+            self._tempfile.name + '.checkpoint', f.name + '.checkpoint')
+        database = Database(f.name)
+        try:
+            self.assertEqual(database.root.value, 2)
+        finally:
+            database.close()
+
+    def test_checkpointer(self):
+        import os
+        import time
+        from dobbin.database import Database
+        root = self._get_root()
+        root.value = 1
+        transaction.commit()
+
+        path = self._tempfile.name + '.checkpoint'
+        database = Database(self._tempfile.name, checkpoint_interval=0.01)
+        try:
+            for i in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            else:
+                self.fail("Checkpoint not written.")
+        finally:
+            database.close()
+
+
+@unittest.skipIf(
+    not hasattr(os, 'register_at_fork'), "Fork handlers not available.")
+class ForkTestCase(DatabaseTestCase):
+    def test_prefork(self):
+        import threading
+        from dobbin.persistent import checkout
+        from dobbin.persistent import object_lock
+
+        root = self._get_root()
+        root.value = 1
+        transaction.commit()
+        self.database.prefork()
+
+        # the object lock is held by another thread while we fork
+        acquired = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            lock = object_lock(root)
+            lock.acquire()
+            acquired.set()
+            release.wait()
+            lock.release()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                signal.alarm(10)
+                transaction.begin()
+                checkout(root)
+                root.value = 2
+                transaction.commit()
+                status = 0
+            finally:
+                os._exit(status)
+
+        release.set()
+        thread.join()
+
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+        transaction.begin()
+        self.assertEqual(root.value, 2)
+
+
+class PartialWriteTestCase(DatabaseTestCase):
+    def _write_partial(self):
+        from dobbin.database import Database
+        from dobbin.persistent import checkout
+
+        root = self._get_root()
+        root.value = 1
+        transaction.commit()
+        size = os.path.getsize(self._tempfile.name)
+
+        # commit a transaction using another database instance; then
+        # cut it in half such that only a part of it is in the log
+        database = Database(self._tempfile.name)
+        transaction.begin()
+        other = database.root
+        checkout(other)
+        other.value = 2
+        transaction.commit()
+        database.close()
+
+        f = open(self._tempfile.name, 'rb+')
+        f.seek(size)
+        data = f.read()
+        f.truncate(size + len(data) // 2)
+        return f
+
+    def test_write_in_progress(self):
+        from fcntl import flock
+        from fcntl import LOCK_EX
+        from fcntl import LOCK_UN
+
+        f = self._write_partial()
+        try:
+            # the log is locked while a transaction is written
+            flock(f.fileno(), LOCK_EX)
+            transaction.begin()
+            self.assertEqual(self.database.root.value, 1)
+            flock(f.fileno(), LOCK_UN)
+        finally:
+            f.close()
+
+    def test_incomplete_entry(self):
+        from dobbin.exc import IntegrityError
+        self._write_partial().close()
+        self.assertRaises(IntegrityError, transaction.begin)
+
+
+class TransactionIndexTestCase(unittest.TestCase):
+    def _make_index(self):
+        from dobbin.database import TransactionIndex
+
+        # the transaction at 2.0 is written after the one at 3.0
+        index = TransactionIndex()
+        for timestamp, offset in ((1.0, 10), (3.0, 20), (2.0, 30), (4.0, 40)):
+            index.add(timestamp, offset)
+        return index
+
+    def test_offset(self):
+        index = self._make_index()
+        self.assertEqual(list(index.timestamps), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(list(index.highs), [1.0, 3.0, 3.0, 4.0])
+        self.assertEqual(index.offset(2.0), 30)
+        self.assertEqual(index.offset(4.0), 40)
+        self.assertRaises(KeyError, index.offset, 2.5)
+
+        # an aborted transaction takes precedence
+        index.add(4.0, 50)
+        self.assertEqual(index.offset(4.0), 50)
+
+    def test_after(self):
+        index = self._make_index()
+        self.assertEqual(index.after(0.5), 0)
+        self.assertEqual(index.after(1.0), 10)
+
+        # the transaction at 3.0 is written before the one at 2.0
+        self.assertEqual(index.after(2.0), 10)
+        self.assertEqual(index.after(2.5), 10)
+        self.assertEqual(index.after(3.0), 30)
+        self.assertEqual(index.after(5.0), 40)
+
+    def test_after_displaced(self):
+        from dobbin.database import TransactionIndex
+
+        # the transaction at 99.0 is written before all the others
+        index = TransactionIndex()
+        for timestamp, offset in (
+                (99.0, 10), (13.0, 20), (20.0, 30), (47.0, 40),
+                (50.0, 50), (56.0, 60)):
+            index.add(timestamp, offset)
+
+        self.assertEqual(index.after(13.0), 0)
+        self.assertEqual(index.after(56.0), 0)
+        self.assertEqual(index.after(99.0), 60)
+
+    def test_pickle(self):
+        import pickle
+        index = pickle.loads(pickle.dumps(self._make_index()))
+        self.assertEqual(list(index.offsets), [10, 30, 20, 40])
+        self.assertEqual(list(index.highs), [1.0, 3.0, 3.0, 4.0])
+        self.assertEqual(index.end, 40)
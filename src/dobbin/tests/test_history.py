@@ -0,0 +1,223 @@
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+
+class HistoryTestCase(BaseTestCase):
+    def _commit_versions(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import PersistentDict
+        from dobbin.persistent import PersistentList
+        from dobbin.persistent import checkout
+
+        root = Persistent()
+        self.database.elect(root)
+        root.value = 1
+        root.mapping = PersistentDict()
+        root.mapping['a'] = 1
+        root.items = PersistentList([1])
+        transaction.commit()
+        first = self.database.tx_timestamp
+
+        transaction.begin()
+        checkout(root)
+        root.value = 2
+        checkout(root.mapping)
+        root.mapping['a'] = 2
+        root.mapping['b'] = 3
+        checkout(root.items)
+        root.items.append(2)
+        transaction.commit()
+        second = self.database.tx_timestamp
+
+        return root, first, second
+
+    def test_at(self):
+        root, first, second = self._commit_versions()
+
+        view = self.database.at(first)
+        self.assertEqual(view.timestamp, first)
+        self.assertEqual(view.root.value, 1)
+        self.assertEqual(dict(view.root.mapping), {'a': 1})
+        self.assertEqual(list(view.root.items), [1])
+
+        view = self.database.at(second)
+        self.assertEqual(view.root.value, 2)
+        self.assertEqual(dict(view.root.mapping), {'a': 2, 'b': 3})
+        self.assertEqual(list(view.root.items), [1, 2])
+
+        # a time in between transactions gives the state as of the
+        # earlier transaction
+        view = self.database.at((first + second) / 2)
+        self.assertEqual(view.root.value, 1)
+        self.assertEqual(view.root._p_serial, first)
+
+        # the database didn't exist yet
+        self.assertEqual(self.database.at(first - 1).root, None)
+
+        # the objects of the database are unaffected
+        transaction.begin()
+        self.assertEqual(root.value, 2)
+
+    def test_lazy(self):
+        from dobbin.history import Ghost
+        from dobbin.persistent import PersistentDict
+
+        root, first, second = self._commit_versions()
+        view = self.database.at(first)
+
+        # the referenced objects are loaded when they're used
+        mapping = view.root.mapping
+        self.assertTrue(isinstance(mapping, Ghost))
+        self.assertTrue(isinstance(mapping, PersistentDict))
+        self.assertEqual(len(mapping), 1)
+        self.assertFalse(isinstance(mapping, Ghost))
+        self.assertTrue(view.root.mapping is mapping)
+        self.assertFalse(mapping is root.mapping)
+
+    def test_read_only(self):
+        from dobbin.exc import ReadOnlyError
+        from dobbin.persistent import checkout
+
+        root, first, second = self._commit_versions()
+        view = self.database.at(first)
+        self.assertRaises(ReadOnlyError, checkout, view.root)
+        self.assertRaises(TypeError, setattr, view.root, 'value', 3)
+
+    def test_later_transactions(self):
+        from dobbin.database import Database
+        from dobbin.persistent import checkout
+
+        root, first, second = self._commit_versions()
+        self.assertEqual(self.database.at(second).root.value, 2)
+
+        # the index of versions is kept up to date; transactions
+        # committed by another database are read first
+        database = Database(self._tempfile.name)
+        transaction.begin()
+        checkout(database.root)
+        database.root.value = 3
+        transaction.commit()
+        third = database.tx_timestamp
+        database.close()
+
+        self.assertEqual(self.database.at(third).root.value, 3)
+        self.assertEqual(self.database.at(second).root.value, 2)
+
+        # the index is built from the log
+        database = Database(self._tempfile.name)
+        try:
+            self.assertEqual(database.at(first).root.value, 1)
+            self.assertEqual(database.at(third).root.value, 3)
+        finally:
+            database.close()
+
+    def test_object_history(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root, first, second = self._commit_versions()
+
+        # an unrelated object is changed in between
+        transaction.begin()
+        checkout(root)
+        root.other = Persistent()
+        transaction.commit()
+        third = self.database.tx_timestamp
+
+        # a dictionary has a state of attributes and entries
+        history = list(self.database.object_history(root.mapping))
+        self.assertEqual(history, [
+            (second, ({}, {'a': 2, 'b': 3})), (first, ({}, {'a': 1}))])
+
+        # only the transactions which changed the object are read
+        offsets = []
+        read_transaction = self.database._read_transaction
+
+        def recording_read_transaction(jar, offset):
+            offsets.append(offset)
+            return read_transaction(jar, offset)
+
+        self.database._read_transaction = recording_read_transaction
+        history = list(self.database.object_history(root))
+        self.assertEqual(
+            [timestamp for (timestamp, state) in history],
+            [third, second, first])
+        self.assertEqual(len(offsets), 3)
+
+        offsets[:] = []
+        list(self.database.object_history(root.items))
+        self.assertEqual(len(offsets), 2)
+
+        # objects which haven't been committed have no history
+        self.assertEqual(list(self.database.object_history(Persistent())), [])
+
+    def test_aborted(self):
+        from dobbin.persistent import checkout
+
+        root, first, second = self._commit_versions()
+
+        transaction.begin()
+        checkout(root)
+        root.value = 3
+        self.database.tpc_begin(transaction.get())
+        self.database.commit(transaction.get())
+        self.database.tpc_abort(transaction.get())
+        transaction.abort()
+
+        history = list(self.database.object_history(root))
+        self.assertEqual(
+            [timestamp for (timestamp, state) in history], [second, first])
+
+    def test_checkpoint(self):
+        from dobbin.database import Database
+
+        root, first, second = self._commit_versions()
+        self.database.checkpoint()
+
+        # the most recent versions are kept in the checkpoint
+        database = Database(self._tempfile.name)
+        try:
+            history = list(database.object_history(database.root))
+            self.assertEqual(
+                [timestamp for (timestamp, state) in history],
+                [second, first])
+            self.assertEqual(database.at(first).root.value, 1)
+        finally:
+            database.close()
+
+    def test_legacy_versions(self):
+        from dobbin.database import Database
+        from dobbin.database import LOG_VERSION
+        from dobbin.persistent import checkout
+
+        # versions written by earlier releases have no back-pointer
+        write = self.database._write
+
+        def legacy_write(segment_type, data):
+            if segment_type == LOG_VERSION:
+                data = data[:3]
+            return write(segment_type, data)
+
+        self.database._write = legacy_write
+        root, first, second = self._commit_versions()
+        del self.database._write
+
+        transaction.begin()
+        checkout(root)
+        root.value = 3
+        transaction.commit()
+        third = self.database.tx_timestamp
+
+        database = Database(self._tempfile.name)
+        try:
+            self.assertEqual(database.root.value, 3)
+            history = list(database.object_history(database.root))
+            self.assertEqual(
+                [timestamp for (timestamp, state) in history],
+                [third, second, first])
+            self.assertEqual(database.at(second).root.value, 2)
+            self.assertEqual(
+                dict(database.at(first).root.mapping), {'a': 1})
+        finally:
+            database.close()
@@ -0,0 +1,164 @@
+import unittest
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentile(self):
+        from dobbin.metrics import Histogram
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+        for i in range(99):
+            histogram.add(0.000010)
+        histogram.add(0.5)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['max'], 0.5)
+        self.assertTrue(0.000010 <= snapshot['p50'] < 0.000020)
+        self.assertTrue(0.000010 <= snapshot['p99'] < 0.000020)
+        self.assertEqual(histogram.percentile(100), 0.5)
+
+
+class MetricsTestCase(BaseTestCase):
+    def _get_root(self):
+        from dobbin.persistent import Persistent
+        root = Persistent()
+        self.database.elect(root)
+        return root
+
+    def test_stats(self):
+        root = self._get_root()
+        root.value = 1
+        transaction.commit()
+
+        stats = self.database.stats()
+        self.assertEqual(stats['transactions'], 1)
+        self.assertEqual(stats['objects'], 1)
+
+        timings = stats['metrics']['timings']
+        for name in ('tpc_begin', 'commit', 'tpc_vote', 'tpc_finish',
+                     'commit_lock', 'sync'):
+            self.assertTrue(timings[name]['count'] > 0, name)
+
+        counters = stats['metrics']['counters']
+        self.assertEqual(counters['write.records'], 1)
+        self.assertTrue(counters['write.bytes'] > 0)
+
+        # the object is in local state until the transaction is
+        # checked in; it keeps one changeset
+        from dobbin.persistent import checkout
+        checkout(root)
+        stats = self.database.stats()
+        self.assertEqual(stats['connected'], 1)
+        self.assertEqual(stats['active'], 1)
+
+    def test_conflicts(self):
+        import threading
+        from dobbin.persistent import checkout
+        root = self._get_root()
+        transaction.commit()
+
+        checkout(root)
+        root.value = 1
+
+        def run():
+            transaction.begin()
+            checkout(root)
+            root.value = 2
+            transaction.commit()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        stats = self.database.stats()
+        self.assertEqual(stats['metrics']['counters']['conflicts.write'], 1)
+
+    def test_sink(self):
+        calls = []
+
+        class Sink(object):
+            def count(self, name, value=1):
+                calls.append(name)
+
+            def timing(self, name, seconds):
+                calls.append(name)
+
+            def snapshot(self):
+                return {}
+
+        from dobbin.database import Database
+        self.database.close()
+        self.database = Database(self._tempfile.name, metrics=Sink())
+        root = self._get_root()
+        transaction.commit()
+        self.assertTrue('tpc_finish' in calls)
+        self.assertEqual(self.database.stats()['metrics'], {})
+
+    def test_memory_report(self):
+        from dobbin.persistent import PersistentDict
+        from dobbin.persistent import checkout
+        root = self._get_root()
+        root.mapping = PersistentDict()
+        root.mapping['data'] = 'x' * 1000
+        transaction.commit()
+
+        report = self.database.memory_report()
+        self.assertEqual(report['total']['count'], 2)
+        self.assertEqual(report['total']['local'], 0)
+
+        mapping = report['classes']['dobbin.persistent.PersistentDict']
+        self.assertEqual(mapping['count'], 1)
+        self.assertTrue(mapping['size'] > 1000)
+
+        # the persistent object which is referenced by the root object
+        # is not included in its size
+        self.assertTrue(
+            report['classes']['dobbin.persistent.Persistent']['size'] < 1000)
+
+        # checked out objects have working copies
+        transaction.begin()
+        checkout(root.mapping)
+        root.mapping['data'] = 'y'
+        report = self.database.memory_report()
+        mapping = report['classes']['dobbin.persistent.PersistentDict']
+        self.assertEqual(mapping['local'], 1)
+        self.assertEqual(mapping['copies'], 2)
+        self.assertTrue(mapping['copies_size'] > 0)
+
+        # the change is committed while another thread has a
+        # transaction; the reverse changeset (which holds the previous
+        # value) is kept until that transaction ends
+        import threading
+        begun = threading.Event()
+        done = threading.Event()
+
+        def run():
+            transaction.begin()
+            checkout(root)
+            begun.set()
+            done.wait()
+            transaction.abort()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        begun.wait()
+        try:
+            transaction.commit()
+            report = self.database.memory_report()
+        finally:
+            done.set()
+            thread.join()
+
+        mapping = report['classes']['dobbin.persistent.PersistentDict']
+        self.assertEqual(mapping['local'], 1)
+        self.assertEqual(mapping['changes'], 1)
+        self.assertTrue(mapping['changes_size'] > 1000)
@@ -1,7 +1,18 @@
 from dobbin.tests.base import BaseTestCase
+from dobbin.persistent import Persistent
+from dobbin.persistent import PersistentDict
 
 import transaction
 
+
+class Disjoint(Persistent):
+    _p_resolve_disjoint = True
+
+
+class DisjointDict(PersistentDict):
+    _p_resolve_disjoint = True
+
+
 class PersistentMVCCTestCase(BaseTestCase):
     def setUp(self):
         super(PersistentMVCCTestCase, self).setUp()
@@ -84,6 +95,221 @@ class PersistentMVCCTestCase(BaseTestCase):
 
         self.assertEqual(obj.name, 'Bob')
 
+    def test_disjoint_changes(self):
+        obj = Disjoint()
+        self.database.elect(obj)
+        transaction.commit()
+
+        thread = self._get_thread(obj)
+
+        from dobbin.persistent import checkout
+        checkout(obj)
+        obj.age = 42
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(obj.name, 'Bob')
+        self.assertEqual(obj.age, 42)
+        self.assertEqual(self.database.resolve_hits, 1)
+
+    def test_disjoint_own_changes(self):
+        root = Disjoint()
+        self.database.elect(root)
+        objects = root.objects = [Disjoint() for i in range(4)]
+        transaction.commit()
+
+        from dobbin.persistent import checkout
+
+        def run(obj):
+            for i in range(50):
+                transaction.begin()
+                checkout(obj)
+                setattr(obj, 'even' if i % 2 else 'odd', i)
+                transaction.commit()
+
+        import threading
+        threads = [
+            threading.Thread(target=run, args=(obj, )) for obj in objects]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the changes which a thread has committed itself are not
+        # merged with its next transaction
+        self.assertEqual(self.database.resolve_hits, 0)
+        self.assertEqual(self.database.resolve_misses, 0)
+
+    def test_disjoint_conflict(self):
+        obj = Disjoint()
+        self.database.elect(obj)
+        transaction.commit()
+
+        thread = self._get_thread(obj)
+
+        from dobbin.persistent import checkout
+        checkout(obj)
+        obj.name = 'Bill'
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(obj.name, 'Bob')
+        self.assertEqual(self.database.resolve_misses, 1)
+
+    def test_disjoint_equal_values(self):
+        obj = Disjoint()
+        self.database.elect(obj)
+        transaction.commit()
+
+        thread = self._get_thread(obj)
+
+        from dobbin.persistent import checkout
+        checkout(obj)
+        obj.name = 'Bob'
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(obj.name, 'Bob')
+
+    def test_disjoint_read_changes(self):
+        from copy import copy
+        obj = Disjoint()
+        self.database.elect(obj)
+        transaction.commit()
+
+        new_db = copy(obj._p_jar)
+        thread = self._get_thread(new_db.root)
+
+        from dobbin.persistent import checkout
+        checkout(obj)
+        obj.age = 42
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(obj.name, 'Bob')
+        self.assertEqual(obj.age, 42)
+
+        # the merged state is what's been written to the database
+        newer_db = copy(obj._p_jar)
+        self.assertEqual(newer_db.root.name, 'Bob')
+        self.assertEqual(newer_db.root.age, 42)
+
+    def test_disjoint_keys(self):
+        d = DisjointDict()
+        self.database.elect(d)
+        transaction.commit()
+
+        flag = self._flag
+        from dobbin.persistent import checkout
+
+        def run():
+            checkout(d)
+            d['foo'] = 'bar'
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        import threading
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        checkout(d)
+        d['bar'] = 'boo'
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(d['foo'], 'bar')
+        self.assertEqual(d['bar'], 'boo')
+
+    def test_read_modify_write(self):
+        root = self._get_root()
+
+        from dobbin.exc import ConflictError
+        from dobbin.persistent import checkout
+
+        checkout(root)
+        root.count = 0
+        transaction.commit()
+
+        seen = []
+
+        def run():
+            while True:
+                transaction.begin()
+                count = root.count
+                if count >= 100:
+                    break
+                checkout(root)
+                root.count = count + 1
+                try:
+                    transaction.commit()
+                except ConflictError:
+                    transaction.abort()
+                else:
+                    seen.append(count)
+            transaction.abort()
+
+        import threading
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # every value was read (and then incremented) exactly once
+        self.assertEqual(sorted(seen), list(range(100)))
+
+    def test_own_objects(self):
+        root = self._get_root()
+
+        from dobbin.exc import ConflictError
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        checkout(root)
+        objects = root.objects = [Persistent() for i in range(4)]
+        transaction.commit()
+
+        conflicts = []
+
+        def run(obj):
+            for i in range(50):
+                transaction.begin()
+                checkout(obj)
+                obj.value = i
+                try:
+                    transaction.commit()
+                except ConflictError:
+                    conflicts.append(obj)
+                    transaction.abort()
+
+        import threading
+        threads = [
+            threading.Thread(target=run, args=(obj, )) for obj in objects]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # a thread never conflicts with its own changes, even if it
+        # begins a transaction while another is being committed
+        self.assertEqual(conflicts, [])
+
     def tearDown(self):
         self._flag.release()
         super(PersistentMVCCTestCase, self).tearDown()
@@ -1,4 +1,14 @@
 from dobbin.tests.base import BaseTestCase
+from dobbin.persistent import CompactPersistent
+
+
+class Point(CompactPersistent):
+    __slots__ = 'x', 'y'
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
 
 class PersistentTestCase(BaseTestCase):
     def _get_root(self, cls):
@@ -38,6 +48,86 @@ class PersistentTestCase(BaseTestCase):
         finally:
             del module.Dummy
 
+    def test_slots(self):
+        import transaction
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root = self._get_root(Persistent)
+        root.point = point = Point(1, 2)
+        transaction.commit()
+
+        # shared state is kept in slots
+        self.assertEqual((point.x, point.y), (1, 2))
+        self.assertFalse(hasattr(point, '__dict__'))
+        self.assertTrue(point._p_jar is self.database)
+
+        # the system attributes are not part of the state
+        state = point.__getstate__()
+        self.assertEqual(state, {'x': 1, 'y': 2})
+        new_point = object.__new__(Point)
+        new_point.__setstate__(state)
+        self.assertEqual(new_point.__getstate__(), state)
+
+        # local
+        checkout(point)
+        point.x = 3
+        self.assertEqual((point.x, point.y), (3, 2))
+
+        # shared
+        transaction.commit()
+        self.assertEqual((point.x, point.y), (3, 2))
+        self.assertFalse(hasattr(point, '__dict__'))
+
+        from copy import copy
+        new_db = copy(self.database)
+        try:
+            new_point = new_db.root.point
+            self.assertEqual((new_point.x, new_point.y), (3, 2))
+        finally:
+            new_db.close()
+
+    def test_slots_memory(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            return
+
+        import gc
+        import transaction
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root = self._get_root(Persistent)
+        transaction.commit()
+
+        def make_persistent(i):
+            obj = Persistent()
+            obj.x = obj.y = i
+            return obj
+
+        count = 1000
+        sizes = []
+        tracemalloc.start()
+        try:
+            for factory in (make_persistent, lambda i: Point(i, i)):
+                transaction.begin()
+                gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+                items = [factory(i) for i in range(count)]
+                checkout(root)
+                root.items = items
+                transaction.commit()
+                gc.collect()
+                sizes.append(tracemalloc.get_traced_memory()[0] - before)
+                del items
+        finally:
+            tracemalloc.stop()
+
+        # a shared compact object has no instance dictionary
+        self.assertFalse(hasattr(root.items[0], '__dict__'))
+        self.assertTrue(sizes[1] < sizes[0])
+
     def test_custom_setattr(self):
         marker = []
         from dobbin.persistent import Persistent
@@ -76,3 +166,45 @@ class PersistentTestCase(BaseTestCase):
             self.assertEqual(inst.dummy, 2)
         finally:
             del module.Dummy
+
+    def test_read_only(self):
+        import threading
+        import transaction
+        from dobbin.exc import ReadOnlyError
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+        from dobbin.persistent import read_only
+
+        inst = self._get_root(Persistent)
+        inst.items = [1]
+        transaction.commit()
+
+        # keep the object checked out in another thread
+        started = threading.Event()
+        done = threading.Event()
+
+        def run():
+            checkout(inst)
+            inst.items.append(2)
+            started.set()
+            done.wait()
+            transaction.abort()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait()
+
+        try:
+            with read_only():
+                items = inst.items
+                self.assertEqual(items, [1])
+
+                # the shared value is returned (no copy is made)
+                self.assertTrue(inst.items is items)
+                self.assertRaises(ReadOnlyError, checkout, inst)
+        finally:
+            done.set()
+            thread.join()
+
+        checkout(inst)
+        transaction.abort()
@@ -0,0 +1,90 @@
+import unittest
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class PersistentArrayTestCase(BaseTestCase):
+    def _get_root(self):
+        assert self.database.root is None
+        from dobbin.persistent import Persistent
+        root = Persistent()
+        self.database.elect(root)
+        return root
+
+    def _reopen(self):
+        from copy import copy
+        return copy(self.database).root
+
+    def test_roundtrip(self):
+        root = self._get_root()
+
+        import array
+        from dobbin.persistent import PersistentArray
+        root.values = PersistentArray([1.5, 2.5, 3.5])
+        root.counts = PersistentArray(array.array('i', range(10)))
+        transaction.commit()
+
+        self.assertEqual(root.values.tolist(), [1.5, 2.5, 3.5])
+
+        root = self._reopen()
+        self.assertEqual(root.values.tolist(), [1.5, 2.5, 3.5])
+        self.assertEqual(root.values.typecode, 'd')
+        self.assertEqual(len(root.counts), 10)
+        self.assertEqual(root.counts[3], 3)
+        self.assertEqual(list(root.counts), list(range(10)))
+
+    def test_typecode(self):
+        import array
+        from dobbin.persistent import PersistentArray
+        self.assertRaises(
+            ValueError, PersistentArray, array.array('u', 'hi'))
+        self.assertRaises(ValueError, PersistentArray, 'hi', 'u')
+
+    def test_zero_copy(self):
+        root = self._get_root()
+
+        from dobbin.persistent import PersistentArray
+        root.values = PersistentArray(range(100))
+        transaction.commit()
+
+        values = self._reopen().values
+        self.assertTrue(isinstance(values.data, memoryview))
+        self.assertTrue(values.data.readonly)
+        self.assertEqual(values.offset % 8, 0)
+        self.assertEqual(values.length, 800)
+
+    def test_reference(self):
+        root = self._get_root()
+
+        from dobbin.persistent import PersistentArray
+        root.values = PersistentArray(range(100))
+        transaction.commit()
+
+        size = len(self._tempfile.read())
+
+        # assigning the array again does not write the data again
+        from dobbin.persistent import checkout
+        checkout(root)
+        root.copy = root.values
+        transaction.commit()
+
+        self.assertTrue(len(self._tempfile.read()) < 800)
+        root = self._reopen()
+        self.assertEqual(root.copy.offset, root.values.offset)
+
+    @unittest.skipIf(numpy is None, "NumPy not available.")
+    def test_numpy(self):
+        root = self._get_root()
+
+        from dobbin.persistent import PersistentArray
+        root.values = PersistentArray([1.0, 2.0, 3.0])
+        transaction.commit()
+
+        values = self._reopen().values.numpy()
+        self.assertEqual(values.sum(), 6.0)
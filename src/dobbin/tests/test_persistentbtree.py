@@ -0,0 +1,156 @@
+import random
+
+from dobbin.tests.base import BaseTestCase
+from dobbin.persistent import PersistentBTree
+
+import transaction
+
+
+class SmallTree(PersistentBTree):
+    max_bucket_size = 4
+    max_node_size = 4
+
+
+class PersistentBTreeTestCase(BaseTestCase):
+    def _get_root(self, keys=()):
+        tree = SmallTree()
+        for key in keys:
+            tree[key] = str(key)
+        self.database.elect(tree)
+        transaction.commit()
+        return tree
+
+    def test_mapping(self):
+        keys = list(range(100))
+        random.seed(42)
+        random.shuffle(keys)
+        tree = self._get_root(keys)
+
+        self.assertEqual(list(tree), list(range(100)))
+        self.assertEqual(len(tree), 100)
+        self.assertEqual(tree[42], '42')
+        self.assertEqual(tree.get(100), None)
+        self.assertTrue(42 in tree)
+        self.assertFalse(100 in tree)
+        self.assertRaises(KeyError, tree.__getitem__, 100)
+
+        tree[42] = 'fortytwo'
+        del tree[0]
+        self.assertEqual(tree.pop(1), '1')
+        self.assertEqual(tree.pop(1, None), None)
+        self.assertRaises(KeyError, tree.__delitem__, 0)
+        self.assertEqual(tree.setdefault(0, 'zero'), 'zero')
+        transaction.commit()
+
+        self.assertEqual(tree[42], 'fortytwo')
+        self.assertEqual(tree[0], 'zero')
+        self.assertEqual(len(tree), 99)
+
+    def test_range(self):
+        tree = self._get_root(range(0, 100, 2))
+        self.assertEqual(list(tree.keys(10, 20)), [10, 12, 14, 16, 18, 20])
+        self.assertEqual(list(tree.keys(11, 19)), [12, 14, 16, 18])
+        self.assertEqual(list(tree.keys(max=4)), [0, 2, 4])
+        self.assertEqual(list(tree.keys(min=95)), [96, 98])
+        self.assertEqual(list(tree.values(50, 52)), ['50', '52'])
+        self.assertEqual(list(tree.items(50, 52)), [(50, '50'), (52, '52')])
+        self.assertEqual(list(tree.keys(200)), [])
+
+    def test_empty(self):
+        tree = self._get_root()
+        self.assertEqual(list(tree.items()), [])
+        self.assertEqual(len(tree), 0)
+        self.assertRaises(KeyError, tree.__getitem__, 0)
+        self.assertRaises(KeyError, tree.__delitem__, 0)
+
+    def test_commit_touched_buckets(self):
+        tree = self._get_root(range(100))
+
+        written = []
+        write = self.database.write
+
+        def counting_write(oid, cls, state):
+            written.append(cls)
+            return write(oid, cls, state)
+
+        self.database.write = counting_write
+        tree[50] = 'fifty'
+        transaction.commit()
+
+        from dobbin.persistent import BTreeBucket
+        self.assertEqual(written, [BTreeBucket])
+
+    def test_persistence(self):
+        tree = self._get_root(range(100))
+        from copy import copy
+        new_db = copy(tree._p_jar)
+        self.assertEqual(list(new_db.root.items()), list(tree.items()))
+
+    def test_disjoint_buckets(self):
+        tree = self._get_root(range(100))
+
+        import threading
+        flag = threading.Semaphore()
+        flag.acquire()
+
+        def run():
+            tree[0] = 'zero'
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        tree[99] = 'ninety-nine'
+        flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(tree[0], 'zero')
+        self.assertEqual(tree[99], 'ninety-nine')
+
+    def test_len(self):
+        tree = self._get_root(range(0, 100, 2))
+
+        import threading
+        flag = threading.Semaphore()
+        flag.acquire()
+
+        def run():
+            tree[1] = 'one'
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        # the entries are counted without conflict
+        tree[97] = 'ninety-seven'
+        del tree[98]
+        self.assertEqual(len(tree), 50)
+        flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(len(tree), 51)
+
+        from copy import copy
+        new_db = copy(tree._p_jar)
+        self.assertEqual(len(new_db.root), 51)
+
+        # a tree written without a counter is counted once
+        from dobbin.persistent import checkout
+        checkout(tree)
+        tree._size = None
+        transaction.commit()
+        self.assertEqual(len(tree), 51)
+        tree[99] = 'ninety-nine'
+        transaction.commit()
+        self.assertEqual(len(tree), 52)
+        self.assertFalse(tree._size is None)
@@ -0,0 +1,155 @@
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+class PersistentCounterTestCase(BaseTestCase):
+    def _get_root(self, value=None):
+        assert self.database.root is None
+        from dobbin.persistent import PersistentCounter
+        root = PersistentCounter(value)
+        self.database.elect(root)
+        transaction.commit()
+        return root
+
+    def test_increment(self):
+        counter = self._get_root(5)
+        self.assertEqual(counter.value, 5)
+        self.assertRaises(TypeError, counter.increment)
+
+        from dobbin.persistent import checkout
+        checkout(counter)
+        counter.increment()
+        counter.increment(3)
+        counter.decrement()
+        self.assertEqual(counter.value, 8)
+        self.assertEqual(int(counter), 8)
+        transaction.commit()
+
+        self.assertEqual(counter.value, 8)
+
+        from copy import copy
+        new_db = copy(self.database)
+        self.assertEqual(new_db.root.value, 8)
+
+    def test_commit_writes_delta(self):
+        counter = self._get_root(5)
+
+        written = []
+        write = self.database.write
+
+        def recording_write(oid, cls, state):
+            attrs, items = state
+            written.append(list(items._p_ops))
+            return write(oid, cls, state)
+
+        self.database.write = recording_write
+
+        from dobbin.persistent import checkout
+        checkout(counter)
+        counter.increment()
+        counter.increment()
+        transaction.commit()
+
+        self.assertEqual(written, [[('add', 2)]])
+
+    def test_concurrent_increments(self):
+        counter = self._get_root()
+
+        import threading
+        from dobbin.persistent import checkout
+
+        def run():
+            for i in range(10):
+                transaction.begin()
+                checkout(counter)
+                counter.increment()
+                transaction.commit()
+
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.value, 40)
+
+    def test_concurrent_increments_across_databases(self):
+        counter = self._get_root()
+
+        from copy import copy
+        new_db = copy(self.database)
+        other = new_db.root
+
+        import threading
+        flag = threading.Semaphore()
+        flag.acquire()
+
+        from dobbin.persistent import checkout
+
+        def run():
+            checkout(other)
+            other.increment(2)
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        checkout(counter)
+        counter.increment()
+        self.assertEqual(counter.value, 1)
+
+        flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(counter.value, 3)
+
+    def test_conflicted_increment(self):
+        counter = self._get_root(5)
+
+        from copy import copy
+        new_db = copy(self.database)
+        self.assertEqual(new_db.root.value, 5)
+
+        from dobbin.exc import WriteConflictError
+
+        class ConflictingDataManager(object):
+            # votes against the transaction after the changes of the
+            # database have been written to the log
+            transaction_manager = transaction.manager
+
+            def tpc_begin(self, transaction):
+                pass
+
+            commit = abort = tpc_abort = tpc_finish = tpc_begin
+
+            def tpc_vote(self, transaction):
+                raise WriteConflictError(counter)
+
+            def sortKey(self):
+                return (0, )
+
+        from dobbin.persistent import checkout
+        checkout(counter)
+        counter.increment(2)
+        transaction.get().join(ConflictingDataManager())
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        # the increment is not applied by this or any other database
+        transaction.begin()
+        self.assertEqual(counter.value, 5)
+        self.assertEqual(new_db.root.value, 5)
+        self.assertEqual(copy(self.database).root.value, 5)
+
+        checkout(counter)
+        counter.increment()
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(counter.value, 6)
+        self.assertEqual(new_db.root.value, 6)
+        self.assertEqual(copy(self.database).root.value, 6)
@@ -152,8 +152,8 @@ class PersistentDictTestCase(BaseTestCase):
 
         # local
         d['foo'] = 'bar'
-        self.assertEqual(d.keys(), ['foo'])
-        self.assertEqual(d.items(), [('foo', 'bar')])
+        self.assertEqual(list(d.keys()), ['foo'])
+        self.assertEqual(list(d.items()), [('foo', 'bar')])
         self.assertEqual(tuple(d), ('foo',))
 
         # shared
@@ -176,6 +176,62 @@ class PersistentDictTestCase(BaseTestCase):
         self.assertEqual(sorted(d.items()), [('bar', 'boo'), ('foo', 'bar')])
         self.assertEqual(tuple(sorted(d)), ('bar', 'foo',))
 
+    def test_views(self):
+        d = self._get_root()
+        d['foo'] = 'bar'
+        transaction.commit()
+
+        from dobbin.persistent import checkout
+        checkout(d)
+        d['bar'] = 'boo'
+        del d['foo']
+
+        keys = d.keys()
+        values = d.values()
+        items = d.items()
+
+        self.assertEqual(len(keys), 1)
+        self.assertTrue('bar' in keys)
+        self.assertFalse('foo' in keys)
+        self.assertEqual(list(values), ['boo'])
+        self.assertTrue(('bar', 'boo') in items)
+
+        # views are live
+        d['baz'] = 'bop'
+        self.assertEqual(sorted(keys), ['bar', 'baz'])
+        self.assertEqual(len(items), 2)
+
+    def test_len(self):
+        d = self._get_root()
+        d['foo'] = 'bar'
+        d['bar'] = 'boo'
+        self.assertEqual(len(d), 2)
+        transaction.commit()
+        self.assertEqual(len(d), 2)
+
+        from dobbin.persistent import checkout
+        checkout(d)
+        del d['foo']
+        d['baz'] = 'bop'
+        self.assertEqual(len(d), 2)
+        d.clear()
+        self.assertEqual(len(d), 0)
+        d['foo'] = 'bar'
+        self.assertEqual(len(d), 1)
+        self.assertEqual(list(d), ['foo'])
+
+    def test_iteration_large(self):
+        d = self._get_root()
+        for i in range(10000):
+            d[i] = i
+        transaction.commit()
+
+        from dobbin.persistent import checkout
+        checkout(d)
+        d[-1] = -1
+        self.assertEqual(len(list(d)), 10001)
+        self.assertEqual(sum(d.values()), sum(range(10000)) - 1)
+
     def test_type(self):
         d = self._get_root()
         self.assertTrue(isinstance(d, dict))
@@ -0,0 +1,197 @@
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+class PersistentListTestCase(BaseTestCase):
+    def _get_root(self, values=()):
+        assert self.database.root is None
+        from dobbin.persistent import PersistentList
+        root = PersistentList(values)
+        self.database.elect(root)
+        transaction.commit()
+        return root
+
+    def _get_thread(self, func):
+        import threading
+        flag = self._flag = threading.Semaphore()
+        flag.acquire()
+
+        def run():
+            func()
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_operations(self):
+        l = self._get_root([1, 2, 3])
+        self.assertEqual(list(l), [1, 2, 3])
+
+        from dobbin.persistent import checkout
+        checkout(l)
+        l.append(4)
+        l[0] = 0
+        del l[1]
+        l.insert(0, -1)
+        self.assertEqual(l.pop(), 4)
+        l += [5, 6]
+        l[1:3] = ['a', 'b', 'c']
+        self.assertEqual(l, [-1, 'a', 'b', 'c', 5, 6])
+        self.assertEqual(len(l), 6)
+        self.assertEqual(l[-1], 6)
+        self.assertEqual(l.index('b'), 2)
+        self.assertTrue('c' in l)
+        l.remove('c')
+        l.reverse()
+        self.assertEqual(l, [6, 5, 'b', 'a', -1])
+        del l[::2]
+        self.assertEqual(l, [5, 'a'])
+        transaction.commit()
+
+        self.assertEqual(list(l), [5, 'a'])
+
+        from copy import copy
+        new_db = copy(self.database)
+        self.assertEqual(list(new_db.root), [5, 'a'])
+
+    def test_shared(self):
+        l = self._get_root([1, 2, 3])
+        self.assertRaises(TypeError, l.append, 4)
+        self.assertRaises(TypeError, l.__setitem__, 0, 4)
+
+    def test_commit_writes_changes(self):
+        l = self._get_root(range(100))
+
+        written = []
+        write = self.database.write
+
+        def recording_write(oid, cls, state):
+            attrs, items = state
+            written.append(list(items._p_ops))
+            return write(oid, cls, state)
+
+        self.database.write = recording_write
+
+        from dobbin.persistent import checkout
+        checkout(l)
+        l.append(100)
+        transaction.commit()
+
+        self.assertEqual(written, [[('extend', [100])]])
+        self.assertEqual(len(l), 101)
+
+    def test_isolation(self):
+        l = self._get_root([1, 2, 3])
+
+        from dobbin.persistent import checkout
+        checkout(l)
+        self.assertEqual(len(l), 3)
+
+        def append():
+            checkout(l)
+            l.append(4)
+
+        thread = self._get_thread(append)
+        self._flag.release()
+        thread.join()
+
+        self.assertEqual(list(l), [1, 2, 3])
+        transaction.abort()
+        transaction.begin()
+        self.assertEqual(list(l), [1, 2, 3, 4])
+
+    def test_concurrent_appends(self):
+        l = self._get_root([1])
+
+        from dobbin.persistent import checkout
+
+        def append():
+            checkout(l)
+            l.append(2)
+
+        thread = self._get_thread(append)
+
+        checkout(l)
+        l.append(3)
+        l.extend([4, 5])
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(list(l), [1, 2, 3, 4, 5])
+
+    def test_concurrent_conflict(self):
+        l = self._get_root([1, 2])
+
+        from dobbin.persistent import checkout
+
+        def append():
+            checkout(l)
+            l.append(3)
+
+        thread = self._get_thread(append)
+
+        checkout(l)
+        l[0] = 0
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(list(l), [1, 2, 3])
+
+    def test_concurrent_appends_across_databases(self):
+        l = self._get_root([1])
+
+        from copy import copy
+        new_db = copy(self.database)
+        other = new_db.root
+
+        from dobbin.persistent import checkout
+
+        def append():
+            checkout(other)
+            other.append(2)
+
+        thread = self._get_thread(append)
+
+        checkout(l)
+        l.append(3)
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(list(l), [1, 2, 3])
+
+    def test_append_after_concurrent_change(self):
+        l = self._get_root([1, 2])
+
+        from dobbin.persistent import checkout
+
+        def change():
+            checkout(l)
+            l[0] = 0
+
+        thread = self._get_thread(change)
+
+        checkout(l)
+        l.append(3)
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(list(l), [0, 2])
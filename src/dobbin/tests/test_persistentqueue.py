@@ -0,0 +1,219 @@
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+from dobbin.persistent import PersistentQueue
+
+class SmallQueue(PersistentQueue):
+    max_segment_size = 2
+
+
+class PersistentQueueTestCase(BaseTestCase):
+    def _get_root(self, values=(), cls=SmallQueue):
+        assert self.database.root is None
+        root = cls(values)
+        self.database.elect(root)
+        transaction.commit()
+        return root
+
+    def _get_thread(self, func):
+        import threading
+        flag = self._flag = threading.Semaphore()
+        flag.acquire()
+
+        def run():
+            func()
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_operations(self):
+        queue = self._get_root([1, 2, 3])
+        self.assertEqual(list(queue), [1, 2, 3])
+        self.assertEqual(len(queue), 3)
+
+        queue.append(4)
+        queue.extend([5, 6])
+        self.assertEqual(queue.popleft(), 1)
+        self.assertEqual(queue.popleft(), 2)
+        transaction.commit()
+
+        self.assertEqual(list(queue), [3, 4, 5, 6])
+        self.assertEqual(len(queue), 4)
+
+        from copy import copy
+        new_db = copy(self.database)
+        self.assertEqual(list(new_db.root), [3, 4, 5, 6])
+
+        for value in (3, 4, 5, 6):
+            self.assertEqual(queue.popleft(), value)
+        self.assertRaises(IndexError, queue.popleft)
+        self.assertEqual(len(queue), 0)
+        transaction.commit()
+
+        queue.append(7)
+        transaction.commit()
+        self.assertEqual(list(queue), [7])
+
+    def test_drained_segments(self):
+        queue = self._get_root(range(6))
+        head = queue._head._segment
+
+        for i in range(3):
+            queue.popleft()
+        transaction.commit()
+
+        # the cursor has moved on to the second segment
+        self.assertTrue(queue._head._segment is head._next)
+        self.assertEqual(queue._head._index, 1)
+
+    def test_commit_writes_changes(self):
+        queue = self._get_root([1], cls=PersistentQueue)
+
+        written = []
+        write = self.database.write
+
+        def recording_write(oid, cls, state):
+            written.append(cls.__name__)
+            return write(oid, cls, state)
+
+        self.database.write = recording_write
+
+        queue.append(2)
+        transaction.commit()
+        self.assertEqual(written, ['QueueSegment'])
+
+        del written[:]
+        queue.popleft()
+        transaction.commit()
+        self.assertEqual(written, ['QueueCursor'])
+
+    def test_concurrent_producer_consumer(self):
+        queue = self._get_root([1], cls=PersistentQueue)
+
+        def produce():
+            queue.append(2)
+
+        thread = self._get_thread(produce)
+        self.assertEqual(queue.popleft(), 1)
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(list(queue), [2])
+
+    def test_concurrent_producers(self):
+        queue = self._get_root([1], cls=PersistentQueue)
+
+        def produce():
+            queue.append(2)
+
+        thread = self._get_thread(produce)
+        queue.append(3)
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(list(queue), [1, 2, 3])
+
+    def test_producers_and_consumers(self):
+        import threading
+        from dobbin.exc import ConflictError
+
+        queue = self._get_root()
+        done = threading.Event()
+        got = []
+
+        def produce(name):
+            self.database.root
+            for i in range(50):
+                while True:
+                    transaction.begin()
+                    queue.append((name, i))
+                    try:
+                        transaction.commit()
+                    except ConflictError:
+                        transaction.abort()
+                    else:
+                        break
+
+        def consume():
+            self.database.root
+            while True:
+                # the queue is empty when the producers are done
+                last = done.is_set()
+                transaction.begin()
+                try:
+                    value = queue.popleft()
+                    transaction.commit()
+                except IndexError:
+                    transaction.abort()
+                    if last:
+                        break
+                except ConflictError:
+                    transaction.abort()
+                else:
+                    got.append(value)
+
+        producers = [
+            threading.Thread(target=produce, args=(i, )) for i in range(2)]
+        consumers = [threading.Thread(target=consume) for i in range(2)]
+        for thread in producers + consumers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        done.set()
+        for thread in consumers:
+            thread.join()
+
+        # no item was lost or consumed twice
+        self.assertEqual(len(got), len(set(got)))
+        self.assertEqual(len(got), 100)
+        transaction.begin()
+        self.assertEqual(len(queue), 0)
+
+    def test_concurrent_consumers(self):
+        queue = self._get_root([1, 2])
+
+        def consume():
+            queue.popleft()
+
+        thread = self._get_thread(consume)
+        queue.popleft()
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(list(queue), [2])
+
+    def test_append_to_sealed_segment(self):
+        queue = self._get_root([1])
+
+        # fill the segment in a concurrent transaction such that the
+        # next entry goes into a new segment
+        def produce():
+            queue.extend([2, 3])
+
+        thread = self._get_thread(produce)
+        queue.append(4)
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(list(queue), [1, 2, 3])
@@ -0,0 +1,115 @@
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+class PersistentSetTestCase(BaseTestCase):
+    def _get_root(self, values=()):
+        assert self.database.root is None
+        from dobbin.persistent import PersistentSet
+        root = PersistentSet(values)
+        self.database.elect(root)
+        transaction.commit()
+        return root
+
+    def _get_thread(self, func):
+        import threading
+        flag = self._flag = threading.Semaphore()
+        flag.acquire()
+
+        def run():
+            func()
+            flag.acquire()
+            try:
+                transaction.commit()
+            finally:
+                flag.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_operations(self):
+        s = self._get_root('abc')
+        self.assertEqual(s, set('abc'))
+
+        from dobbin.persistent import checkout
+        checkout(s)
+        s.add('d')
+        s.discard('a')
+        s.remove('b')
+        self.assertRaises(KeyError, s.remove, 'b')
+        s |= set('xy')
+        s -= set('y')
+        self.assertEqual(s, set('cdx'))
+        self.assertEqual(len(s), 3)
+        self.assertTrue('x' in s)
+        self.assertEqual(s & set('cz'), set('c'))
+        s.intersection_update('cd')
+        self.assertEqual(s, set('cd'))
+        s.symmetric_difference_update('de')
+        self.assertEqual(s, set('ce'))
+        transaction.commit()
+
+        self.assertEqual(s, set('ce'))
+
+        from copy import copy
+        new_db = copy(self.database)
+        self.assertEqual(set(new_db.root), set('ce'))
+
+    def test_clear(self):
+        s = self._get_root('abc')
+
+        from dobbin.persistent import checkout
+        checkout(s)
+        s.clear()
+        s.add('d')
+        transaction.commit()
+
+        self.assertEqual(s, set('d'))
+
+    def test_concurrent_changes(self):
+        s = self._get_root('abc')
+
+        from dobbin.persistent import checkout
+
+        def change():
+            checkout(s)
+            s.add('d')
+            s.discard('a')
+
+        thread = self._get_thread(change)
+
+        checkout(s)
+        s.add('e')
+        s.add('d')
+        s.discard('b')
+
+        self._flag.release()
+        thread.join()
+
+        transaction.commit()
+        self.assertEqual(s, set('cde'))
+
+    def test_concurrent_conflict(self):
+        s = self._get_root('abc')
+
+        from dobbin.persistent import checkout
+
+        def discard():
+            checkout(s)
+            s.discard('a')
+
+        thread = self._get_thread(discard)
+
+        checkout(s)
+        s.discard('a')
+        s.add('a')
+
+        self._flag.release()
+        thread.join()
+
+        from dobbin.exc import WriteConflictError
+        self.assertRaises(WriteConflictError, transaction.commit)
+        transaction.abort()
+
+        self.assertEqual(s, set('bc'))
@@ -0,0 +1,196 @@
+import os
+import tempfile
+import threading
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+
+class ReplicationTestCase(BaseTestCase):
+    def setUp(self):
+        super(ReplicationTestCase, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        self.standby = os.path.join(self._directory, 'standby.fs')
+        self.addCleanup(self._remove)
+
+    def _remove(self):
+        for name in os.listdir(self._directory):
+            os.remove(os.path.join(self._directory, name))
+        os.rmdir(self._directory)
+
+    def _open_standby(self, **kwargs):
+        from dobbin.database import Database
+        database = Database(self.standby, **kwargs)
+        self.addCleanup(database.close)
+        return database
+
+    def _commit(self, value):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root = self.database.root
+        if root is None:
+            root = Persistent()
+            self.database.elect(root)
+        else:
+            checkout(root)
+        root.value = value
+        transaction.commit()
+        return root
+
+    def test_replicate(self):
+        from dobbin.exc import ReadOnlyError
+        from dobbin.persistent import PersistentFile
+        from dobbin.persistent import checkout
+        from dobbin.replication import replicate
+
+        # an empty log has nothing to ship
+        self.assertEqual(replicate(self._tempfile.name, self.standby), 0)
+
+        root = self._commit(1)
+        f = open(os.path.join(self._directory, 'data'), 'wb+')
+        f.write(b'abc')
+        f.seek(0)
+        checkout(root)
+        root.file = PersistentFile(f)
+        transaction.commit()
+
+        offset = replicate(self._tempfile.name, self.standby)
+        self.assertEqual(offset, os.path.getsize(self._tempfile.name))
+
+        # the standby is opened as a read-only database
+        standby = self._open_standby(read_only=True)
+        transaction.begin()
+        self.assertEqual(standby.root.value, 1)
+        stream = standby.root.file
+        stream.open()
+        try:
+            self.assertEqual(stream.read(), b'abc')
+        finally:
+            stream.close()
+        self.assertRaises(ReadOnlyError, checkout, standby.root)
+
+        # shipping resumes from the end of the standby
+        self._commit(2)
+        self.assertEqual(
+            replicate(self._tempfile.name, self.standby),
+            os.path.getsize(self._tempfile.name))
+        transaction.begin()
+        self.assertEqual(standby.root.value, 2)
+
+    def test_incomplete_transaction(self):
+        from dobbin.replication import replicate
+
+        self._commit(1)
+        size = os.path.getsize(self._tempfile.name)
+        self._commit(2)
+
+        # a transaction which is being written is not shipped
+        f = open(self._tempfile.name, 'rb+')
+        try:
+            f.truncate(os.path.getsize(self._tempfile.name) - 1)
+        finally:
+            f.close()
+
+        self.assertEqual(replicate(self._tempfile.name, self.standby), size)
+
+    def test_ship(self):
+        from dobbin.replication import Standby
+        from dobbin.replication import ship
+
+        self._commit(1)
+        stream = BytesIO()
+        offset = ship(self._tempfile.name, stream)
+        self.assertEqual(ship(self._tempfile.name, stream, offset), offset)
+
+        self._commit(2)
+        ship(self._tempfile.name, stream, offset)
+
+        stream.seek(0)
+        standby = Standby(self.standby)
+        self.assertEqual(
+            standby.receive(stream), os.path.getsize(self._tempfile.name))
+        self.assertEqual(self._open_standby().root.value, 2)
+
+    def test_mismatch(self):
+        from dobbin.exc import IntegrityError
+        from dobbin.replication import Standby
+        from dobbin.replication import frames
+
+        self._commit(1)
+        self._commit(2)
+        (frame, ) = frames(self._tempfile.name)
+        standby = Standby(self.standby)
+
+        # frames must follow the end of the standby
+        self.assertRaises(IntegrityError, standby.apply, 1, b'', b'')
+
+        # and the standby must match the log
+        offset, tail, data = frame
+        standby.apply(offset, tail, data[:10])
+        self.assertRaises(
+            IntegrityError, standby.apply, 10, b'x' * 10, data[10:])
+
+    def test_promote(self):
+        from dobbin.persistent import checkout
+        from dobbin.replication import Standby
+        from dobbin.replication import frames
+
+        self._commit(1)
+        size = os.path.getsize(self._tempfile.name)
+        self._commit(2)
+
+        # a transfer which was interrupted
+        (frame, ) = frames(self._tempfile.name)
+        offset, tail, data = frame
+        standby = Standby(self.standby)
+        standby.apply(offset, tail, data[:size + 10])
+
+        self.assertEqual(standby.promote(), size)
+        self.assertEqual(standby.offset, size)
+
+        database = self._open_standby()
+        transaction.begin()
+        self.assertEqual(database.root.value, 1)
+        checkout(database.root)
+        database.root.value = 3
+        transaction.commit()
+
+    def test_main(self):
+        from dobbin.replication import connect
+        from dobbin.replication import main
+        from dobbin.replication import serve
+        from dobbin.replication import ship
+
+        self._commit(1)
+        self.assertEqual(main(['copy', self._tempfile.name, self.standby]), 0)
+        self.assertEqual(self._open_standby().root.value, 1)
+
+        # a standby served on a socket sends its end when a client
+        # connects
+        self._commit(2)
+        address = os.path.join(self._directory, 'socket')
+        thread = threading.Thread(target=serve, args=(self.standby, address))
+        thread.daemon = True
+        thread.start()
+        while not os.path.exists(address):
+            thread.join(0.01)
+
+        stream, offset = connect(address)
+        self.assertEqual(offset, os.path.getsize(self.standby))
+        ship(self._tempfile.name, stream, offset)
+        stream.close()
+
+        database = self._open_standby(read_only=True)
+        for i in range(500):
+            database._sync()
+            if database.tx_count == 2:
+                break
+            thread.join(0.01)
+        self.assertEqual(database.root.value, 2)
@@ -0,0 +1,275 @@
+import os
+import pickle
+import tempfile
+import threading
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+
+class ServerTestCase(BaseTestCase):
+    def setUp(self):
+        from dobbin.server import StorageServer
+
+        super(ServerTestCase, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        self.address = os.path.join(self._directory, 'socket')
+        self.server = StorageServer(self._tempfile.name, self.address)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(os.rmdir, self._directory)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _connect(self):
+        from dobbin.server import ClientStorage
+        client = ClientStorage(self.address)
+        self.addCleanup(client.close)
+        return client
+
+    def _commit_root(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import PersistentDict
+
+        root = Persistent()
+        self.database.elect(root)
+        root.value = 1
+        root.mapping = PersistentDict()
+        root.mapping['a'] = 1
+        transaction.commit()
+        return root
+
+    def test_load(self):
+        from dobbin.history import Ghost
+        from dobbin.persistent import PersistentDict
+
+        self._commit_root()
+        client = self._connect()
+        transaction.begin()
+
+        # objects are loaded when they're used
+        root = client.root
+        self.assertEqual(root.value, 1)
+        mapping = root.mapping
+        self.assertTrue(isinstance(mapping, Ghost))
+        self.assertTrue(isinstance(mapping, PersistentDict))
+        self.assertEqual(len(client._loaded), 1)
+        self.assertEqual(mapping['a'], 1)
+        self.assertFalse(isinstance(mapping, Ghost))
+        self.assertEqual(client.tx_count, self.database.tx_count)
+
+    def test_load_snapshot(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root = self._commit_root()
+        checkout(root)
+        root.a = Persistent()
+        root.a.value = 0
+        root.b = Persistent()
+        root.b.value = 0
+        transaction.commit()
+
+        client = self._connect()
+        transaction.begin()
+        client_root = client.root
+        self.assertEqual(client_root.a.value, 0)
+
+        def run():
+            checkout(root.a)
+            root.a.value = 1
+            checkout(root.b)
+            root.b.value = 1
+            transaction.commit()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        # the object is loaded as of the position of the client
+        self.assertEqual(client_root.b.value, 0)
+        checkout(client_root)
+        client_root.c = (client_root.a.value, client_root.b.value)
+        transaction.commit()
+        self.assertEqual(self.server.database.root.c, (0, 0))
+
+        transaction.begin()
+        self.assertEqual(client.root.a.value, 1)
+        self.assertEqual(client.root.b.value, 1)
+
+    def test_commit(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import checkout
+
+        root = self._commit_root()
+        client = self._connect()
+        other = self._connect()
+        transaction.begin()
+        self.assertEqual(other.root.value, 1)
+
+        checkout(client.root)
+        client.root.value = 2
+        client.root.new = Persistent()
+        client.root.new.value = 3
+        checkout(client.root.mapping)
+        client.root.mapping['b'] = 2
+        transaction.commit()
+
+        # the transaction is written by the server
+        self.assertEqual(self.server.database.root.new.value, 3)
+        self.assertEqual(
+            client.root._p_serial, self.server.database.tx_timestamp)
+
+        # the changes are read by the other client (and database)
+        transaction.begin()
+        self.assertEqual(other.root.value, 2)
+        self.assertEqual(other.root.new.value, 3)
+        self.assertEqual(dict(other.root.mapping), {'a': 1, 'b': 2})
+        self.assertEqual(root.value, 2)
+
+        # and the client's own transaction is not applied twice
+        checkout(client.root.mapping)
+        client.root.mapping['c'] = 3
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(
+            dict(client.root.mapping), {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(
+            dict(other.root.mapping), {'a': 1, 'b': 2, 'c': 3})
+
+    def test_conflict(self):
+        from dobbin.database import LOG_VERSION
+        from dobbin.manager import ROOT_OID
+        from dobbin.persistent import Persistent
+
+        root = self._commit_root()
+        serial = root._p_serial
+
+        def vote(value, serial):
+            entry = ROOT_OID, Persistent, {'value': value}, serial
+            return self.server.vote(pickle.dumps((LOG_VERSION, entry)))
+
+        size = os.path.getsize(self._tempfile.name)
+        timestamp, conflicts = vote(2, serial)
+        self.assertEqual(conflicts, ())
+
+        # the transaction is written when it's finished
+        self.assertEqual(os.path.getsize(self._tempfile.name), size)
+        offset = self.server.finish()
+        self.assertEqual(offset, os.path.getsize(self._tempfile.name))
+
+        # the change was based on the previous version
+        self.assertEqual(vote(3, serial), (None, [ROOT_OID]))
+        transaction.begin()
+        self.assertEqual(root.value, 2)
+        self.assertEqual(root._p_serial, timestamp)
+
+    def test_abort(self):
+        from dobbin.exc import StorageError
+        from dobbin.persistent import checkout
+
+        self._commit_root()
+        client = self._connect()
+        size = os.path.getsize(self._tempfile.name)
+
+        class FailingDataManager(object):
+            # votes against the transaction after the client has voted
+            transaction_manager = transaction.manager
+
+            def tpc_begin(self, transaction):
+                pass
+
+            commit = abort = tpc_abort = tpc_finish = tpc_begin
+
+            def tpc_vote(self, transaction):
+                raise StorageError("Vote failed.")
+
+            def sortKey(self):
+                return (float('inf'), )
+
+        transaction.begin()
+        checkout(client.root)
+        client.root.value = 2
+        transaction.get().join(FailingDataManager())
+        self.assertRaises(StorageError, transaction.commit)
+        transaction.abort()
+
+        # nothing was written and the commit lock was released
+        self.assertEqual(os.path.getsize(self._tempfile.name), size)
+        self.assertEqual(self.server.database.root.value, 1)
+
+        transaction.begin()
+        checkout(client.root)
+        client.root.value = 3
+        transaction.commit()
+        self.assertEqual(self.server.database.root.value, 3)
+
+    def test_invalidations(self):
+        from dobbin.persistent import checkout
+
+        root = self._commit_root()
+        client = self._connect()
+        transaction.begin()
+        self.assertEqual(client.root.value, 1)
+
+        read = []
+        read_transaction = client._read_transaction
+
+        def recording_read_transaction(jar, offset):
+            read.append(offset)
+            return read_transaction(jar, offset)
+
+        client._read_transaction = recording_read_transaction
+
+        # the client has not loaded the mapping; the transaction is
+        # not read from the log
+        checkout(root.mapping)
+        root.mapping['b'] = 2
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(read, [])
+        self.assertEqual(client.tx_count, self.database.tx_count)
+        self.assertEqual(dict(client.root.mapping), {'a': 1, 'b': 2})
+
+        offset = client._index_end
+        checkout(root)
+        root.value = 2
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(client.root.value, 2)
+        self.assertEqual(read, [offset])
+
+        # the changes which are no longer kept by the server are read
+        # from the log
+        self.server.database._changes.clear()
+        checkout(root)
+        root.value = 3
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(client.root.value, 3)
+        self.assertEqual(client.tx_count, self.database.tx_count)
+
+    def test_unsupported(self):
+        from dobbin.exc import StorageError
+
+        root = self._commit_root()
+        client = self._connect()
+        transaction.begin()
+        self.assertRaises(StorageError, client.at, root._p_serial)
+        self.assertRaises(StorageError, client.bulk_load, [])
+        self.assertRaises(StorageError, client.checkpoint)
+        self.assertRaises(StorageError, client.object_history, client.root)
+
+    def test_files(self):
+        from dobbin.persistent import PersistentFile
+        from dobbin.persistent import checkout
+
+        self._commit_root()
+        client = self._connect()
+        transaction.begin()
+        checkout(client.root)
+        client.root.file = PersistentFile(tempfile.TemporaryFile())
+        self.assertRaises(TypeError, transaction.commit)
+        transaction.abort()
@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+
+from dobbin.tests.base import BaseTestCase
+
+import transaction
+
+
+class TracingTestCase(BaseTestCase):
+    def _open(self, **kwargs):
+        from dobbin.database import Database
+        from dobbin.tracing import Tracer
+        tracer = Tracer(**kwargs)
+        self.database.close()
+        self.database = Database(self._tempfile.name, tracer=tracer)
+        return tracer
+
+    def _commit_root(self):
+        from dobbin.persistent import Persistent
+        from dobbin.persistent import PersistentFile
+        root = Persistent()
+        root.value = 'x' * 100
+        f = tempfile.TemporaryFile()
+        f.write(b'abc')
+        f.seek(0)
+        root.file = PersistentFile(f)
+        self.database.elect(root)
+        transaction.commit()
+        return root
+
+    def test_trace(self):
+        traces = []
+        tracer = self._open(threshold=0, callback=traces.append)
+        root = self._commit_root()
+
+        self.assertEqual(len(traces), 1)
+        self.assertEqual(list(tracer.traces), traces)
+        trace = traces[0]
+        self.assertEqual(trace.status, 'committed')
+        self.assertEqual(trace.timestamp, root._p_serial)
+        for name in ('tpc_begin', 'commit', 'tpc_vote', 'tpc_finish',
+                     'commit_lock', 'sync'):
+            self.assertTrue(name in trace.phases, name)
+
+        (oid, cls, size), = trace.objects
+        self.assertEqual(oid, 0)
+        self.assertEqual(cls, 'dobbin.persistent.Persistent')
+        self.assertTrue(size > 100)
+        self.assertEqual(len(trace.streams), 1)
+        self.assertEqual(trace.streams[0][1], 3)
+        self.assertEqual(trace.profile, None)
+
+    def test_threshold(self):
+        tracer = self._open(threshold=60)
+        self._commit_root()
+        self.assertEqual(len(tracer.traces), 0)
+
+    def test_file(self):
+        f = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+
+        self._open(threshold=0, path=f.name, profile=1.0)
+        self._commit_root()
+
+        with open(f.name) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual(entry['status'], 'committed')
+        self.assertEqual(len(entry['objects']), 1)
+        self.assertTrue('function calls' in entry['profile'])
@@ -0,0 +1,124 @@
+import collections
+import json
+import random
+import threading
+import time
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+
+import pstats
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from dobbin.metrics import clock
+
+
+class TransactionTrace(object):
+    """Breakdown of a transaction commit.
+
+    The ``phases`` mapping holds the time spent (in seconds) in each
+    phase (see ``Manager.stats``); ``objects`` lists the objects
+    written as tuples of ``(oid, class name, pickled size)`` and
+    ``streams`` the binary streams and arrays copied to the log as
+    tuples of ``(name, length)``. The number of records read from the
+    log to catch up on transactions is ``records``.
+    """
+
+    timestamp = None
+    duration = None
+    status = None
+    profile = None
+
+    def __init__(self, sampled=False):
+        self.sampled = sampled
+        self.started = clock()
+        self.time = time.time()
+        self.phases = {}
+        self.objects = []
+        self.streams = []
+        self.records = 0
+
+    def phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def run_profiled(self, func, *args):
+        """Call function with a profiler enabled; the statistics are
+        kept as text (``profile``)."""
+
+        profiler = profile.Profile()
+        try:
+            return profiler.runcall(func, *args)
+        finally:
+            stream = StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(20)
+            self.profile = stream.getvalue()
+
+    def to_dict(self):
+        return {
+            'time': self.time,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'status': self.status,
+            'phases': self.phases,
+            'objects': self.objects,
+            'streams': self.streams,
+            'records': self.records,
+            'profile': self.profile,
+            }
+
+
+class Tracer(object):
+    """Slow-transaction tracer.
+
+    A database which is given a tracer (the ``tracer`` option) records
+    a trace of each transaction it commits (see ``TransactionTrace``).
+    Transactions which take at least ``threshold`` seconds are kept in
+    a ring buffer of the ``capacity`` most recent traces (``traces``);
+    if ``path`` is set, they're appended to this file (one JSON object
+    per line), and if ``callback`` is set, it's called with the trace.
+
+    A fraction ``profile`` of the transactions are profiled; the
+    statistics of the ``commit`` phase are included in the trace.
+    """
+
+    def __init__(self, threshold=0.1, capacity=100, path=None,
+                 callback=None, profile=0.0):
+        self.threshold = threshold
+        self.path = path
+        self.callback = callback
+        self.profile = profile
+        self.traces = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def begin(self):
+        sampled = self.profile > 0 and random.random() < self.profile
+        return TransactionTrace(sampled)
+
+    def end(self, trace, status):
+        trace.duration = clock() - trace.started
+        trace.status = status
+        if trace.duration < self.threshold:
+            return
+
+        self._lock.acquire()
+        try:
+            self.traces.append(trace)
+            if self.path is not None:
+                line = json.dumps(trace.to_dict(), sort_keys=True)
+                f = open(self.path, 'a')
+                try:
+                    f.write(line + '\n')
+                finally:
+                    f.close()
+        finally:
+            self._lock.release()
+
+        if self.callback is not None:
+            self.callback(trace)
@@ -1,10 +1,36 @@
+import os
+import threading
 import time
+import types
+import weakref
 
 MARKER = object()
 
+_slots = weakref.WeakKeyDictionary()
+
+_timestamp_lock = threading.Lock()
+_timestamp = [0.0]
+
 
 def make_timestamp():
-    return time.time()
+    """Return a timestamp; timestamps are strictly increasing (the
+    clock resolution may otherwise give two transactions the same
+    timestamp)."""
+
+    _timestamp_lock.acquire()
+    try:
+        timestamp = _timestamp[0] = max(time.time(), _timestamp[0] + 1e-6)
+    finally:
+        _timestamp_lock.release()
+    return timestamp
+
+
+def _after_fork():
+    global _timestamp_lock
+    _timestamp_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 
 class marker(object):
@@ -19,6 +45,37 @@ class default_property(property):
         property.__init__(self, get)
 
 
+class slot_property(property):
+    def __init__(self, key):
+        def get(self):
+            try:
+                return self.__dict__[key]
+            except KeyError:
+                raise AttributeError(key)
+        property.__init__(self, get)
+
+
+def slot_names(cls):
+    """Return the set of slot names declared by ``cls`` and its bases."""
+
+    try:
+        return _slots[cls]
+    except KeyError:
+        pass
+
+    names = set()
+    for base in cls.__mro__:
+        slots = base.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = slots,
+        names.update(slots)
+
+    names.discard('__dict__')
+    names.discard('__weakref__')
+    names = _slots[cls] = frozenset(names)
+    return names
+
+
 def add_class_properties(cls, local_cls, d):
     flattened = set()
     for base in local_cls.mro():
@@ -31,13 +88,21 @@ def add_class_properties(cls, local_cls, d):
         attrs.update(base.__dict__)
 
     for key, value in attrs.items():
-        if key == '__qualname__' or key == '__slots__':
+        if key in ('__qualname__', '__slots__', '__dict__', '__weakref__'):
             continue
 
         if (key, value) in flattened:
             continue
 
-        if not hasattr(value, '__get__'):
+        # slots hold the shared state; the local state is provided
+        # by the working copy (system attributes are provided by the
+        # local class)
+        if isinstance(value, types.MemberDescriptorType):
+            if key.startswith('_p_'):
+                continue
+            value = slot_property(key)
+
+        elif not hasattr(value, '__get__'):
             value = default_property(key, value)
 
         d[key] = value